@@ -0,0 +1,164 @@
+"""Per-user monthly feature aggregates kept in the "UserFeatureMonthly" table.
+
+process_csv adds the aggregates of every inserted batch to the table in the
+same transaction as the insert, so get_score/simulate can build a user's
+features from a single aggregate query over that user's months instead of
+re-reading every transaction. `python api/python/_feature_store.py rebuild`
+recomputes the table from "Transaction".
+"""
+import os
+import sys
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+# the stored aggregates use the scoring keyword lists
+from _scoring import FOOD_KEYS, LOAN_KEYS
+
+# "transactions" (default) recomputes from the Transaction table in Python,
+# "store" reads this table, "pushdown" aggregates "Transaction" in one SQL query
+FEATURE_SOURCE = os.environ.get("FEATURE_SOURCE", "transactions")
+SQL_SOURCES = ("store", "pushdown")
+# only the last N calendar months (the current one included) feed the SQL sources; 0 keeps all history
+FEATURE_LOOKBACK_MONTHS = int(os.environ.get("FEATURE_LOOKBACK_MONTHS", "0"))
+
+AGG_COLUMNS = ["incomeSum", "incomeCount", "expenseSum", "expenseCount", "debitSum", "foodSpend", "loanCount", "txnCount"]
+
+
+def _like_patterns(keys: Sequence[str]) -> List[str]:
+    escaped = (k.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") for k in keys)
+    return ["%" + k + "%" for k in escaped]
+
+
+def aggregate_sql(source: str) -> str:
+    """SELECT of (userId, month, AGG_COLUMNS...) over `source`, grouped per user-month.
+
+    `source` is a relation (table, subquery or CTE name) with "userId", date,
+    description, amount and type columns. The query takes %(loan)s and
+    %(food)s LIKE pattern arrays as parameters; see sql_params().
+    """
+    return f"""
+    SELECT "userId", to_char(date, 'YYYY-MM') AS month,
+           COALESCE(SUM(amount) FILTER (WHERE type = 'Credit'), 0),
+           COUNT(*) FILTER (WHERE type = 'Credit'),
+           COALESCE(SUM(amount) FILTER (WHERE type = 'Debit'), 0),
+           COUNT(*) FILTER (WHERE type = 'Debit'),
+           COALESCE(SUM(abs(amount)) FILTER (WHERE type = 'Debit'), 0),
+           COALESCE(SUM(abs(amount)) FILTER (WHERE type = 'Debit' AND lower(description) LIKE ANY(%(food)s)), 0),
+           COUNT(*) FILTER (WHERE lower(description) LIKE ANY(%(loan)s)),
+           COUNT(*)
+    FROM {source}
+    GROUP BY 1, 2
+    """
+
+
+def sql_params(**extra) -> Dict[str, Any]:
+    params = {"loan": _like_patterns(LOAN_KEYS), "food": _like_patterns(FOOD_KEYS)}
+    params.update(extra)
+    return params
+
+
+def upsert_sql(source: str) -> str:
+    """INSERT adding the aggregates of `source` onto existing user-months."""
+    cols = ", ".join(f'"{c}"' for c in AGG_COLUMNS)
+    updates = ", ".join(f'"{c}" = "UserFeatureMonthly"."{c}" + EXCLUDED."{c}"' for c in AGG_COLUMNS)
+    return f"""
+    INSERT INTO "UserFeatureMonthly" ("userId", month, {cols})
+    {aggregate_sql(source)}
+    ON CONFLICT ("userId", month) DO UPDATE SET {updates}, "updatedAt" = now()
+    """
+
+
+def rebuild(conn, user_ids: List[str] = None) -> int:
+    """Recompute the store from "Transaction", for all users or only `user_ids`."""
+    with conn.cursor() as cur:
+        if user_ids:
+            cur.execute('DELETE FROM "UserFeatureMonthly" WHERE "userId" = ANY(%(users)s)', {"users": list(user_ids)})
+            source = '(SELECT "userId", date, description, amount, type FROM "Transaction" WHERE "userId" = ANY(%(users)s)) AS t'
+            cur.execute(upsert_sql(source), sql_params(users=list(user_ids)))
+        else:
+            cur.execute('DELETE FROM "UserFeatureMonthly"')
+            cur.execute(upsert_sql('"Transaction"'), sql_params())
+        cur.execute('SELECT count(*) FROM "UserFeatureMonthly"')
+        n = cur.fetchone()[0]
+    conn.commit()
+    return n
+
+
+def totals_sql(relation: str) -> str:
+    """Per-user totals from the monthly rows of `relation` (AGG_COLUMNS named as in the store)."""
+    return f"""
+    SELECT "userId",
+           COALESCE(AVG("incomeSum") FILTER (WHERE "incomeCount" > 0), 0),
+           COALESCE(AVG("expenseSum") FILTER (WHERE "expenseCount" > 0), 0),
+           COALESCE(SUM("loanCount"), 0),
+           COALESCE(SUM("debitSum"), 0),
+           COALESCE(SUM("foodSpend"), 0),
+           COALESCE(SUM("txnCount"), 0)
+    FROM {relation}
+    GROUP BY "userId"
+    """
+
+
+def pushdown_sql(since: bool) -> str:
+    """Totals aggregated straight from "Transaction": months are grouped in a CTE, so
+    only one row per user leaves the database. Served by the ("userId", date) index."""
+    window = " AND date >= %(since)s" if since else ""
+    source = f'(SELECT "userId", date, description, amount, type FROM "Transaction" WHERE "userId" = ANY(%(users)s){window}) AS t'
+    cols = ", ".join(f'"{c}"' for c in AGG_COLUMNS)
+    return f'WITH monthly ("userId", month, {cols}) AS ({aggregate_sql(source)}) {totals_sql("monthly")}'
+
+
+def lookback_start(months: int, now: datetime = None) -> Optional[datetime]:
+    """First day of the oldest month in a `months`-month window ending with the current month."""
+    if months <= 0:
+        return None
+    now = now or datetime.utcnow()
+    index = now.year * 12 + now.month - 1 - (months - 1)
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def features_from_totals(avg_income, avg_expense, loans, total_debit, food_spend, n) -> Dict[str, Any]:
+    """Model features from per-user totals, matching compute_features_from_df."""
+    avg_income = float(avg_income or 0.0)
+    avg_expense = float(avg_expense or 0.0)
+    total_debit = float(total_debit or 0.0)
+    return {
+        "avg_monthly_income": avg_income,
+        "avg_monthly_expense": avg_expense,
+        "savings_rate": (avg_income - avg_expense) / avg_income * 100.0 if avg_income else 0.0,
+        "expense_to_income_ratio": avg_expense / avg_income if avg_income else 0.0,
+        "num_loan_payments": int(loans or 0),
+        "pct_spend_on_food": float(food_spend or 0.0) / total_debit * 100.0 if total_debit else 0.0,
+        "total_transactions": int(n or 0),
+    }
+
+
+def read_features_many(cur, user_ids: List[str], source: str = "store",
+                       lookback_months: int = FEATURE_LOOKBACK_MONTHS) -> Dict[str, Dict[str, Any]]:
+    """Features for each user id from one of SQL_SOURCES; users without months get all-zero features."""
+    since = lookback_start(lookback_months)
+    if source == "pushdown":
+        cur.execute(pushdown_sql(since is not None), sql_params(users=list(user_ids), since=since))
+    else:
+        window = " AND month >= %(since)s" if since else ""
+        relation = f'(SELECT * FROM "UserFeatureMonthly" WHERE "userId" = ANY(%(users)s){window}) AS m'
+        cur.execute(totals_sql(relation), {"users": list(user_ids), "since": since and since.strftime("%Y-%m")})
+    found = {row[0]: features_from_totals(*row[1:]) for row in cur.fetchall()}
+    return {uid: found.get(uid) or features_from_totals(0, 0, 0, 0, 0, 0) for uid in user_ids}
+
+
+def read_features(cur, user_id: str, source: str = "store") -> Dict[str, Any]:
+    return read_features_many(cur, [user_id], source)[user_id]
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from _runtime import db_connection
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        users = sys.argv[2:] or None
+        with db_connection() as conn:
+            print(json.dumps({"rows": rebuild(conn, users)}))
+    else:
+        print("Usage: _feature_store.py rebuild [<userId> ...]")
@@ -0,0 +1,257 @@
+"""Process-wide resources shared by the api/python handlers.
+
+Warm serverless instances (and long-running processes) reuse one lazily
+created connection pool per DSN and one parsed LightGBM Booster, instead of
+connecting and re-reading ml/model.lgb on every request. The leading
+underscore keeps Vercel from exposing this module as a function.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from _tracing import stage
+
+MODEL_PATH = os.path.join(os.getcwd(), "ml", "model.lgb")
+# "1" loads the flat NumPy export (ml/model.npz, see _treemodel.py) when it matches the model.
+# It skips importing lightgbm on a cold start but predicts 2-4x slower than the Booster once warm,
+# so it is opt-in for cold-start-bound serverless deployments.
+FAST_PREDICT = os.environ.get("FAST_PREDICT", "0") == "1"
+
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "5"))
+# connections idle longer than this are pinged before being handed out
+POOL_CHECK_SECONDS = float(os.environ.get("DB_POOL_CHECK_SECONDS", "30"))
+
+_lock = threading.Lock()
+_pools = {}
+_pool_pid = None
+_last_used = {}
+
+_model = None
+_model_key = None
+_hashes = {}
+_batcher = None
+
+
+def get_pool(dsn: str):
+    global _pool_pid
+    import psycopg2.pool
+    with _lock:
+        # pools must not be shared across fork(); start fresh in a child process
+        if _pool_pid != os.getpid():
+            _pools.clear()
+            _last_used.clear()
+            _pool_pid = os.getpid()
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, dsn)
+            _pools[dsn] = pool
+        return pool
+
+
+def _healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0.0) < POOL_CHECK_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _checkout(pool):
+    # a dead connection is discarded and replaced; give up after POOL_MAX tries
+    for _ in range(POOL_MAX + 1):
+        conn = pool.getconn()
+        if _healthy(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise RuntimeError("no healthy database connection available")
+
+
+@contextmanager
+def db_connection(dsn: str = None):
+    """Borrow a pooled connection; it is rolled back (or dropped if broken) on return."""
+    import psycopg2
+    dsn = dsn or os.environ.get("DATABASE_URL")
+    if not dsn:
+        raise RuntimeError("DATABASE_URL not set")
+    with stage("db_connect"):
+        pool = get_pool(dsn)
+        conn = _checkout(pool)
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        broken = broken or bool(conn.closed)
+        if broken:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=broken)
+
+
+def close_pools():
+    """Close every pooled connection (at shutdown of a long-running process)."""
+    with _lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _last_used.clear()
+
+
+def _model_stamp(path: str):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def model_hash(path: str = MODEL_PATH) -> str:
+    """sha256 prefix of the model file ("none" when missing); rehashed only when the file changes."""
+    import hashlib
+    try:
+        stamp = _model_stamp(path)
+    except OSError:
+        return "none"
+    cached = _hashes.get(path)
+    if cached is None or cached[0] != stamp:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        cached = _hashes[path] = (stamp, h.hexdigest()[:16])
+    return cached[1]
+
+
+def load_model(path: str = MODEL_PATH):
+    """Return the cached model for `path`, reloading when the file (or its export) changes.
+
+    This is the exported TreeModel when an up-to-date .npz sits next to the
+    model file, otherwise the LightGBM Booster; both have predict(X).
+    """
+    global _model, _model_key
+    try:
+        key = (path, _model_stamp(path))
+    except OSError:
+        return None
+    if FAST_PREDICT:
+        from _treemodel import npz_path
+        try:
+            key += _model_stamp(npz_path(path))
+        except OSError:
+            pass
+    with _lock:
+        if _model_key == key:
+            return _model
+        _model = None
+        if FAST_PREDICT:
+            try:
+                from _treemodel import load_for
+                _model = load_for(path)
+            except Exception as e:
+                print("Failed to load exported model, using LightGBM:", e)
+        if _model is None:
+            import lightgbm as lgb
+            try:
+                _model = lgb.Booster(model_file=path)
+            except Exception as e:
+                print("Failed to load model:", e)
+                _model = None
+        _model_key = key
+        return _model
+
+
+class PredictBatcher:
+    """Coalesces predict calls from concurrent threads into one model.predict.
+
+    The first caller to arrive waits `wait_ms` for others to join, then
+    predicts on all queued matrices stacked together and hands each caller
+    its slice. Callers arriving while that predict runs start the next batch.
+    """
+
+    def __init__(self, wait_ms: float = 2.0, max_rows: int = 8192):
+        self.wait = wait_ms / 1e3
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._queue = []
+        self._leading = False
+        self.batches = 0
+        self.rows = 0
+
+    def predict(self, model, X):
+        import numpy as np
+        item = {"model": model, "X": X, "done": threading.Event()}
+        with self._lock:
+            self._queue.append(item)
+            leader = not self._leading
+            self._leading = leader or self._leading
+        if leader:
+            self._lead()
+        item["done"].wait()
+        if "error" in item:
+            raise item["error"]
+        return np.asarray(item["out"], dtype=np.float64).reshape(-1)
+
+    def _lead(self):
+        time.sleep(self.wait)
+        with self._lock:
+            batch, self._queue = self._queue, []
+            self._leading = False
+        # a model reload between calls can mix models; each gets its own predict
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item["model"]), []).append(item)
+        for items in groups.values():
+            start = 0
+            while start < len(items):
+                # split oversized batches, but never a single caller's matrix
+                chunk, rows = [], 0
+                for item in items[start:]:
+                    if chunk and rows + len(item["X"]) > self.max_rows:
+                        break
+                    chunk.append(item)
+                    rows += len(item["X"])
+                self._run(chunk)
+                start += len(chunk)
+
+    def _run(self, items):
+        import numpy as np
+        try:
+            X = np.vstack([np.asarray(item["X"], dtype=np.float64) for item in items])
+            out = np.asarray(items[0]["model"].predict(X), dtype=np.float64).reshape(-1)
+            with self._lock:
+                self.batches += 1
+                self.rows += len(X)
+            offset = 0
+            for item in items:
+                item["out"] = out[offset:offset + len(item["X"])]
+                offset += len(item["X"])
+        except Exception as e:
+            for item in items:
+                item["error"] = e
+        finally:
+            for item in items:
+                item["done"].set()
+
+
+def set_predict_batcher(batcher):
+    """Route _scoring's model predicts through `batcher` (None turns batching off)."""
+    global _batcher
+    _batcher = batcher
+
+
+def predict_batcher():
+    return _batcher
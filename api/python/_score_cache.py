@@ -0,0 +1,245 @@
+"""get_score results cached per user until the user's transactions or the model change.
+
+An entry is valid for a key made of the user's transaction watermark
+(max "createdAt" and row count, one indexed query), the model file hash and
+the feature settings. New, re-uploaded or deleted transactions and a
+redeployed model all change the key, so stale entries are never served.
+process_csv also drops a user's entries when it inserts rows for them, so
+they do not linger.
+
+Entries live in an in-process LRU (SCORE_CACHE_SIZE users). SCORE_CACHE
+picks a shared backend behind it:
+
+- "memory" (default): the LRU only
+- "postgres": the "ScoreCache" table, shared by every process on the database
+- "sqlite:<path>": a local SQLite file, shared by the processes on one host
+- "off": no caching
+
+Hits and misses are counted in the request trace, so they show up as
+bharatledger_cache_hits_total / bharatledger_cache_misses_total. Backend
+failures are printed and counted as bharatledger_cache_errors_total; a read
+failure is served as a miss, so the cache never fails a request.
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import _tracing as tracing
+from _feature_store import FEATURE_LOOKBACK_MONTHS, FEATURE_SOURCE
+from _runtime import model_hash
+
+SCORE_CACHE = os.environ.get("SCORE_CACHE", "memory")
+SCORE_CACHE_SIZE = int(os.environ.get("SCORE_CACHE_SIZE", "10000"))
+
+_WATERMARK_SQL = """
+    SELECT "userId", max("createdAt"), count(*)
+    FROM "Transaction"
+    WHERE "userId" = ANY(%s)
+    GROUP BY "userId"
+"""
+
+# one statement for the whole batch; ids without a User row (scored as all-zero
+# features) drop out of the join instead of failing the foreign key
+_PUT_SQL = """
+    INSERT INTO "ScoreCache" ("userId", key, body, "updatedAt")
+    SELECT u.id, v.key, v.body, now()
+    FROM unnest(%s::text[], %s::text[], %s::text[]) AS v(uid, key, body)
+    JOIN "User" u ON u.id = v.uid
+    ON CONFLICT ("userId") DO UPDATE SET key = EXCLUDED.key, body = EXCLUDED.body, "updatedAt" = now()
+"""
+
+# ids per IN (...) list; older SQLite builds allow only 999 variables a statement
+_SQLITE_CHUNK = 900
+
+Entry = Dict[str, Any]
+
+
+class _PostgresBackend:
+    """Entries in the "ScoreCache" table, one row per user.
+
+    Reads and writes go through the handler's own cursor: a second pooled
+    connection per request could exhaust the pool, which raises rather than waits.
+    """
+
+    def get_many(self, cur, user_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        try:
+            cur.execute('SELECT "userId", key, body FROM "ScoreCache" WHERE "userId" = ANY(%s)', (list(user_ids),))
+            return {uid: (key, body) for uid, key, body in cur.fetchall()}
+        except Exception:
+            # leave the handler's transaction usable; it has only read so far
+            cur.connection.rollback()
+            raise
+
+    def put_many(self, cur, items: Dict[str, Tuple[str, str]]):
+        uids = list(items)
+        try:
+            cur.execute(_PUT_SQL, (uids, [items[u][0] for u in uids], [items[u][1] for u in uids]))
+            # the handlers only read otherwise, so this commits nothing but the entries
+            cur.connection.commit()
+        except Exception:
+            cur.connection.rollback()
+            raise
+
+    def invalidate(self, user_ids: List[str]):
+        # process_csv deletes the rows in its insert transaction (see invalidate_sql)
+        pass
+
+
+class _SqliteBackend:
+    """Entries in a local SQLite file; WAL mode lets several processes share it."""
+
+    def __init__(self, path: str):
+        import sqlite3
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS score_cache (user_id TEXT PRIMARY KEY, key TEXT, body TEXT)")
+
+    def get_many(self, cur, user_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        found = {}
+        for chunk in _chunks(user_ids):
+            marks = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(f"SELECT user_id, key, body FROM score_cache WHERE user_id IN ({marks})", chunk).fetchall()
+            found.update((uid, (key, body)) for uid, key, body in rows)
+        return found
+
+    def put_many(self, cur, items: Dict[str, Tuple[str, str]]):
+        with self._lock:
+            # one transaction for the batch; autocommit would sync once per row
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO score_cache VALUES (?, ?, ?)",
+                                       [(uid, key, body) for uid, (key, body) in items.items()])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def invalidate(self, user_ids: List[str]):
+        for chunk in _chunks(user_ids):
+            marks = ",".join("?" * len(chunk))
+            with self._lock:
+                self._conn.execute(f"DELETE FROM score_cache WHERE user_id IN ({marks})", chunk)
+
+
+def _chunks(ids: List[str]) -> Iterable[List[str]]:
+    ids = list(ids)
+    for i in range(0, len(ids), _SQLITE_CHUNK):
+        yield ids[i:i + _SQLITE_CHUNK]
+
+
+class ScoreCache:
+    def __init__(self, size: int = SCORE_CACHE_SIZE, backend=None):
+        self.size = size
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, Tuple[str, Entry]]" = OrderedDict()
+
+    @staticmethod
+    def keys(cur, user_ids: List[str]) -> Dict[str, str]:
+        """Current cache key per user id; users without transactions get a zero watermark."""
+        with tracing.stage("cache"):
+            cur.execute(_WATERMARK_SQL, (list(user_ids),))
+            marks = {uid: f"{latest.isoformat()}/{n}" for uid, latest, n in cur.fetchall()}
+        settings = f"{model_hash()}/{FEATURE_SOURCE}/{FEATURE_LOOKBACK_MONTHS}"
+        return {uid: f"{marks.get(uid, '-/0')}/{settings}" for uid in user_ids}
+
+    def get_many(self, cur, keys: Dict[str, str]) -> Dict[str, Entry]:
+        """Entries whose stored key matches; counts hits and misses on the current trace."""
+        found: Dict[str, Entry] = {}
+        with tracing.stage("cache"):
+            with self._lock:
+                for uid, key in keys.items():
+                    hit = self._lru.get(uid)
+                    if hit is not None and hit[0] == key:
+                        self._lru.move_to_end(uid)
+                        found[uid] = hit[1]
+            missing = [uid for uid in keys if uid not in found]
+            if missing and self.backend is not None:
+                try:
+                    stored = self.backend.get_many(cur, missing)
+                except Exception as e:
+                    # the cache is only an optimization: an outage means misses, not failed requests
+                    print("Failed to read score cache:", e)
+                    tracing.add(cache_errors=1)
+                    stored = {}
+                remote = {}
+                for uid, (key, body) in stored.items():
+                    if key == keys[uid]:
+                        remote[uid] = found[uid] = json.loads(body)
+                self._remember({uid: (keys[uid], entry) for uid, entry in remote.items()})
+        tracing.add(cache_hits=len(found), cache_misses=len(keys) - len(found))
+        return found
+
+    def put_many(self, cur, items: Dict[str, Tuple[str, Entry]]):
+        """Store {userId: (key, entry)} in the LRU and the backend."""
+        if not items:
+            return
+        self._remember(items)
+        if self.backend is not None:
+            with tracing.stage("cache"):
+                try:
+                    self.backend.put_many(cur, {uid: (key, json.dumps(entry)) for uid, (key, entry) in items.items()})
+                except Exception as e:
+                    # a failed write only costs a later miss
+                    print("Failed to write score cache:", e)
+                    tracing.add(cache_errors=1)
+
+    def _remember(self, items: Dict[str, Tuple[str, Entry]]):
+        with self._lock:
+            for uid, value in items.items():
+                self._lru[uid] = value
+                self._lru.move_to_end(uid)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[str]):
+        user_ids = list(user_ids)
+        with self._lock:
+            for uid in user_ids:
+                self._lru.pop(uid, None)
+        if self.backend is not None and user_ids:
+            self.backend.invalidate(user_ids)
+
+
+def _make() -> Optional[ScoreCache]:
+    if SCORE_CACHE == "off" or SCORE_CACHE_SIZE <= 0:
+        return None
+    if SCORE_CACHE == "postgres":
+        return ScoreCache(backend=_PostgresBackend())
+    if SCORE_CACHE.startswith("sqlite:"):
+        return ScoreCache(backend=_SqliteBackend(SCORE_CACHE[len("sqlite:"):]))
+    if SCORE_CACHE != "memory":
+        raise ValueError(f"unknown SCORE_CACHE {SCORE_CACHE!r}")
+    return ScoreCache()
+
+
+_cache = None
+_made = False
+_make_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ScoreCache]:
+    """The process-wide cache, created on first use; None when SCORE_CACHE=off."""
+    global _cache, _made
+    with _make_lock:
+        if not _made:
+            _cache, _made = _make(), True
+        return _cache
+
+
+def invalidate_sql(users: str) -> str:
+    """Statement deleting the shared rows of the users selected by `users`, for process_csv's insert."""
+    if SCORE_CACHE != "postgres":
+        return ""
+    return f'DELETE FROM "ScoreCache" WHERE "userId" IN ({users})'
+
+
+def invalidate(user_ids: Iterable[str]):
+    """Drop cached scores of users whose transactions just changed."""
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(user_ids)
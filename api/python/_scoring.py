@@ -0,0 +1,226 @@
+"""Scoring core shared by get_score and simulate.
+
+Owns the model feature definition (names, column order and the
+FEATURE_INDEX name -> column map), feature extraction from transactions,
+and scoring: the cached model from _runtime, one predict call per batch, and
+the rule-based fallback used when no model is deployed. polars and numpy are
+imported inside the functions that need them, like in the handlers.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Mapping, Sequence, TypedDict
+
+from _runtime import load_model, predict_batcher
+from _tracing import stage
+
+if TYPE_CHECKING:
+    import numpy as np
+    import polars as pl
+
+# Feature engineering mirrors notebook/processor logic
+FOOD_KEYS = ["zomato", "swiggy", "dominos", "restaurant", "cafe", "mcdonald", "food"]
+LOAN_KEYS = ["emi", "loan", "equated", "instalment", "installment"]
+
+# model input order
+FEATURE_NAMES = ["avg_monthly_income", "avg_monthly_expense", "savings_rate", "expense_to_income_ratio", "num_loan_payments", "pct_spend_on_food", "total_transactions"]
+# feature name -> column in the model input matrix
+FEATURE_INDEX: Dict[str, int] = {n: i for i, n in enumerate(FEATURE_NAMES)}
+
+
+class Features(TypedDict):
+    avg_monthly_income: float
+    avg_monthly_expense: float
+    savings_rate: float
+    expense_to_income_ratio: float
+    num_loan_payments: int
+    pct_spend_on_food: float
+    total_transactions: int
+
+
+def zero_features() -> Features:
+    return Features(
+        avg_monthly_income=0.0,
+        avg_monthly_expense=0.0,
+        savings_rate=0.0,
+        expense_to_income_ratio=0.0,
+        num_loan_payments=0,
+        pct_spend_on_food=0.0,
+        total_transactions=0,
+    )
+
+
+def safe_div(a, b):
+    try:
+        if b == 0 or b is None:
+            return 0.0
+        return float(a) / float(b)
+    except Exception:
+        return 0.0
+
+
+# characters the polars (Rust) regex engine needs escaped; unlike re.escape it
+# rejects escapes of plain characters such as spaces
+_REGEX_META = set("\\.+*?()|[]{}^$")
+
+
+def keyword_pattern(keys: List[str]) -> str:
+    """Regex matching any of `keys` literally, for polars str.contains."""
+    return "|".join("".join("\\" + ch if ch in _REGEX_META else ch for ch in k) for k in keys)
+
+
+LOAN_PATTERN = keyword_pattern(LOAN_KEYS)
+FOOD_PATTERN = keyword_pattern(FOOD_KEYS)
+
+
+def features_query(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Lazy plan producing the model features per userId in one pass.
+
+    Expects columns userId, month, description, amount (Float64) and type.
+    Keyword matches are native regex `str.contains` over a lowercased
+    description and every aggregate is a conditional sum, so no Python
+    callback runs per row.
+    """
+    import polars as pl
+    is_credit = pl.col("type") == "Credit"
+    is_debit = pl.col("type") == "Debit"
+    desc = pl.col("description").fill_null("").str.to_lowercase()
+    monthly = (
+        lf.with_columns([
+            desc.str.contains(LOAN_PATTERN).alias("is_loan"),
+            desc.str.contains(FOOD_PATTERN).alias("is_food"),
+        ])
+        .groupby(["userId", "month"])
+        .agg([
+            pl.col("amount").filter(is_credit).sum().alias("income"),
+            is_credit.any().alias("has_income"),
+            pl.col("amount").filter(is_debit).sum().alias("expense"),
+            is_debit.any().alias("has_expense"),
+            pl.col("is_loan").sum().alias("loans"),
+            pl.col("amount").abs().filter(is_debit).sum().alias("debit"),
+            pl.col("amount").abs().filter(is_debit & pl.col("is_food")).sum().alias("food"),
+            pl.count().alias("n"),
+        ])
+    )
+    inc = pl.col("avg_monthly_income")
+    exp = pl.col("avg_monthly_expense")
+    return (
+        monthly.groupby("userId")
+        .agg([
+            pl.col("income").filter(pl.col("has_income")).mean().fill_null(0.0).alias("avg_monthly_income"),
+            pl.col("expense").filter(pl.col("has_expense")).mean().fill_null(0.0).alias("avg_monthly_expense"),
+            pl.col("loans").sum().cast(pl.Int64).alias("num_loan_payments"),
+            pl.col("debit").sum().fill_null(0.0).alias("total_debit"),
+            pl.col("food").sum().fill_null(0.0).alias("food_spend"),
+            pl.col("n").sum().cast(pl.Int64).alias("total_transactions"),
+        ])
+        .with_columns([
+            pl.when(inc != 0).then((inc - exp) / inc * 100.0).otherwise(0.0).alias("savings_rate"),
+            pl.when(inc != 0).then(exp / inc).otherwise(0.0).alias("expense_to_income_ratio"),
+            pl.when(pl.col("total_debit") != 0).then(pl.col("food_spend") / pl.col("total_debit") * 100.0).otherwise(0.0).alias("pct_spend_on_food"),
+        ])
+        .select(["userId"] + FEATURE_NAMES)
+    )
+
+
+def with_month(lf: pl.LazyFrame, date_dtype) -> pl.LazyFrame:
+    # dates from the DB are already datetimes; strings (CSV/tests) are parsed
+    import polars as pl
+    date = pl.col("date")
+    if date_dtype == pl.Utf8:
+        date = date.str.strptime(pl.Date, fmt=None, strict=False).cast(pl.Datetime)
+    return lf.with_column(date.dt.strftime("%Y-%m").alias("month"))
+
+
+def compute_features_from_df(df: pl.DataFrame) -> Features:
+    # Expect columns: date (string/datetime), description, amount (float), type (Credit/Debit)
+    import polars as pl
+    if df.height == 0:
+        # empty user: return zeros
+        return zero_features()
+
+    lf = df.lazy()
+    # normalize amount and type
+    if "amount" in df.columns:
+        lf = lf.with_column(pl.col("amount").cast(pl.Float64))
+    else:
+        lf = lf.with_column(pl.lit(0.0).alias("amount"))
+    if "type" not in df.columns:
+        # infer type by sign
+        lf = lf.with_column(pl.when(pl.col("amount") >= 0).then(pl.lit("Credit")).otherwise(pl.lit("Debit")).alias("type"))
+    if "description" not in df.columns:
+        lf = lf.with_column(pl.lit("").alias("description"))
+    # month key
+    if "date" in df.columns:
+        lf = with_month(lf, df["date"].dtype)
+    else:
+        lf = lf.with_column(pl.lit("unknown").alias("month"))
+
+    row = features_query(lf.with_column(pl.lit("").alias("userId"))).collect().to_dicts()[0]
+    return Features(**{n: row[n] for n in FEATURE_NAMES})
+
+
+def compute_features_grouped(df: pl.DataFrame) -> pl.DataFrame:
+    """Features for many users in one grouped pass; one row per userId.
+
+    Expects columns userId, date, description, amount, type. Matches
+    compute_features_from_df for each user's rows.
+    """
+    import polars as pl
+    lf = with_month(df.lazy(), df["date"].dtype).with_column(pl.col("amount").cast(pl.Float64))
+    return features_query(lf).collect()
+
+
+def heuristic_scores(X: np.ndarray) -> np.ndarray:
+    # vectorized form of the single-user fallback; int() truncates toward zero
+    import numpy as np
+    base = 600.0
+    base = base + np.minimum(200, np.trunc(X[:, FEATURE_INDEX["savings_rate"]] * 2))
+    base = base + np.maximum(-100, np.trunc((1 - X[:, FEATURE_INDEX["expense_to_income_ratio"]]) * 50))
+    base = base + np.maximum(-50, 50 - X[:, FEATURE_INDEX["num_loan_payments"]] * 10)
+    return np.clip(base, 300, 850)
+
+
+def heuristic_score(features: Mapping[str, float]) -> float:
+    """Single-row fallback score in plain Python (no numpy import for one user)."""
+    base = 600
+    base += min(200, int(features["savings_rate"] * 2))
+    base += max(-100, int((1 - features["expense_to_income_ratio"]) * 50))
+    base += max(-50, 50 - features["num_loan_payments"] * 10)
+    return max(300, min(850, base))
+
+
+def feature_matrix(rows: Sequence[Mapping[str, float]]) -> np.ndarray:
+    """Model input matrix (len(rows) x len(FEATURE_NAMES), float64) in FEATURE_INDEX order."""
+    import numpy as np
+    return np.array([[float(r.get(n, 0.0)) for n in FEATURE_NAMES] for r in rows], dtype=np.float64).reshape(len(rows), len(FEATURE_NAMES))
+
+
+def predict_scores(X: np.ndarray, model=None) -> np.ndarray:
+    """Scores for every row of X with one predict call, or the heuristic when no model is deployed."""
+    import numpy as np
+    if model is None:
+        with stage("model_load"):
+            model = load_model()
+    with stage("predict"):
+        if model is None or not len(X):
+            return heuristic_scores(X)
+        batcher = predict_batcher()
+        if batcher is not None:
+            return batcher.predict(model, X)
+        return np.asarray(model.predict(X), dtype=np.float64).reshape(-1)
+
+
+def score_one(features: Mapping[str, float]) -> float:
+    """Score of one user's features; matches predict_scores on a one-row matrix."""
+    with stage("model_load"):
+        model = load_model()
+    if model is None:
+        return heuristic_score(features)
+    row = [[features.get(n, 0.0) for n in FEATURE_NAMES]]
+    batcher = predict_batcher()
+    with stage("predict"):
+        pred = batcher.predict(model, row) if batcher is not None else model.predict(row)
+    try:
+        return float(pred[0])
+    except Exception:
+        return float(pred)
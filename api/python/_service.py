@@ -0,0 +1,292 @@
+"""Long-running HTTP service around the api/python handlers, for on-prem deployments.
+
+The serverless handlers pay for imports, a database connection and the
+model load on every cold invocation. This process pays for them once. It is
+an asyncio HTTP/1.1 server (standard library only) with these routes:
+
+    POST /score     -> get_score
+    POST /simulate  -> simulate
+    POST /ingest    -> process_csv
+    GET  /metrics   -> Prometheus text (see _tracing)
+    GET  /healthz   -> 200, or 503 while draining
+
+Request bodies are the handlers' JSON bodies, unchanged. The handlers stay
+synchronous. Scoring runs on a bounded thread pool and ingests on a separate
+one, so a long upload never holds up scores. Both pools borrow connections
+from _runtime's shared psycopg2 pool, and polars, LightGBM and psycopg2
+release the GIL for their heavy work.
+
+Model predicts from concurrent requests are coalesced into single predict
+calls (_runtime.PredictBatcher). Requests beyond a pool's size wait, up to
+--max-queue of them, and the rest get a 503. SIGTERM or SIGINT stops
+accepting connections, lets in-flight requests finish (up to
+--drain-seconds), then closes the pool.
+
+    DATABASE_URL=... python api/python/_service.py --port 8080 --workers 8
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import importlib
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", str(min(8, os.cpu_count() or 1))))
+SERVICE_INGEST_WORKERS = int(os.environ.get("SERVICE_INGEST_WORKERS", "1"))
+# connections each batch ingest writes through, so ingests cannot drain the pool scoring uses
+SERVICE_INGEST_WRITERS = int(os.environ.get("SERVICE_INGEST_WRITERS", "2"))
+SERVICE_MAX_QUEUE = int(os.environ.get("SERVICE_MAX_QUEUE", "64"))
+SERVICE_BATCH_MS = float(os.environ.get("SERVICE_BATCH_MS", "2"))
+SERVICE_DRAIN_SECONDS = float(os.environ.get("SERVICE_DRAIN_SECONDS", "30"))
+SERVICE_IDLE_SECONDS = float(os.environ.get("SERVICE_IDLE_SECONDS", "15"))
+MAX_BODY_BYTES = int(os.environ.get("SERVICE_MAX_BODY_BYTES", str(1 << 20)))
+
+# route -> (handler module, pool)
+ROUTES = {
+    "/score": ("get_score", "score"),
+    "/simulate": ("simulate", "score"),
+    "/ingest": ("process_csv", "ingest"),
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class _Pool:
+    """A thread pool with at most `size` requests running and `max_queue` waiting."""
+
+    def __init__(self, name: str, size: int, max_queue: int):
+        self.executor = ThreadPoolExecutor(size, thread_name_prefix=f"service-{name}")
+        self.slots = asyncio.Semaphore(size)
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.running = 0
+
+    async def run(self, fn, *args):
+        if self.slots.locked() and self.waiting >= self.max_queue:
+            raise HTTPError(503, "server busy, retry later")
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.slots.release()
+
+
+class Service:
+    def __init__(self, workers: int = SERVICE_WORKERS, ingest_workers: int = SERVICE_INGEST_WORKERS,
+                 max_queue: int = SERVICE_MAX_QUEUE, batch_ms: float = SERVICE_BATCH_MS,
+                 drain_seconds: float = SERVICE_DRAIN_SECONDS):
+        self.workers = workers
+        self.ingest_workers = ingest_workers
+        self.max_queue = max_queue
+        self.batch_ms = batch_ms
+        self.drain_seconds = drain_seconds
+        self.pools = {}
+        self.handlers = {}
+        self.batcher = None
+        self.draining = False
+        self._idle = set()
+        self._connections = set()
+
+    def warm(self):
+        """Import the handlers, load the model and open the pool before the first request."""
+        import _runtime
+        for module, _ in ROUTES.values():
+            self.handlers[module] = importlib.import_module(module).handler
+        t0 = time.perf_counter()
+        _runtime.load_model()
+        if os.environ.get("DATABASE_URL"):
+            with _runtime.db_connection():
+                pass
+        if self.batch_ms > 0:
+            self.batcher = _runtime.PredictBatcher(self.batch_ms)
+            _runtime.set_predict_batcher(self.batcher)
+        print(f"service warm in {(time.perf_counter() - t0) * 1e3:.0f} ms")
+
+    def _call(self, module: str, event: dict) -> dict:
+        return self.handlers[module](event)
+
+    async def dispatch(self, method: str, path: str, body: bytes):
+        """(status, content type, body bytes) for one request."""
+        import _tracing as tracing
+        path = path.split("?", 1)[0]
+        if path == "/healthz":
+            status = 503 if self.draining else 200
+            return status, "application/json", json.dumps({"ok": not self.draining}).encode()
+        if path == "/metrics":
+            if method != "GET":
+                raise HTTPError(405, "use GET")
+            return 200, "text/plain; version=0.0.4", (tracing.render_metrics() + self.render_metrics()).encode()
+        route = ROUTES.get(path)
+        if route is None:
+            raise HTTPError(404, "not found")
+        if method != "POST":
+            raise HTTPError(405, "use POST")
+        module, pool = route
+        text = body.decode("utf-8")
+        if module == "process_csv":
+            text = self._limit_writers(text)
+        response = await self.pools[pool].run(self._call, module, {"body": text, "httpMethod": method, "path": path})
+        out = response.get("body")
+        out = out if isinstance(out, str) else json.dumps(out)
+        return int(response.get("statusCode") or 200), "application/json", out.encode()
+
+    @staticmethod
+    def _limit_writers(text: str) -> str:
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            return text  # the handler reports the bad body
+        if isinstance(payload, dict) and not payload.get("writers"):
+            payload["writers"] = SERVICE_INGEST_WRITERS
+            return json.dumps(payload)
+        return text
+
+    def render_metrics(self) -> str:
+        from _tracing import METRICS_PREFIX as p
+        lines = [f"# TYPE {p}_service_running gauge"]
+        lines += [f'{p}_service_running{{pool="{name}"}} {pool.running}' for name, pool in sorted(self.pools.items())]
+        lines.append(f"# TYPE {p}_service_waiting gauge")
+        lines += [f'{p}_service_waiting{{pool="{name}"}} {pool.waiting}' for name, pool in sorted(self.pools.items())]
+        if self.batcher is not None:
+            lines += [f"# TYPE {p}_predict_batches_total counter", f"{p}_predict_batches_total {self.batcher.batches}",
+                      f"# TYPE {p}_predict_batched_rows_total counter", f"{p}_predict_batched_rows_total {self.batcher.rows}"]
+        return "\n".join(lines) + "\n"
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "bad Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return method.upper(), target, body, keep_alive
+
+    @staticmethod
+    async def _respond(writer, status: int, ctype: str, body: bytes, keep_alive: bool):
+        reason = HTTPStatus(status).phrase if status in HTTPStatus._value2member_map_ else ""
+        head = (f"HTTP/1.1 {status} {reason}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write((head + "\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _client(self, reader, writer):
+        self._connections.add(asyncio.current_task())
+        try:
+            keep_alive = True
+            while keep_alive and not self.draining:
+                self._idle.add(writer)
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), SERVICE_IDLE_SECONDS)
+                except HTTPError as e:
+                    await self._respond(writer, e.status, "application/json", json.dumps({"error": str(e)}).encode(), False)
+                    break
+                finally:
+                    self._idle.discard(writer)
+                if request is None:
+                    break
+                method, target, body, keep_alive = request
+                keep_alive = keep_alive and not self.draining
+                try:
+                    status, ctype, out = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, ctype, out = e.status, "application/json", json.dumps({"error": str(e)}).encode()
+                except Exception as e:
+                    print("Unhandled service error:", e)
+                    status, ctype, out = 500, "application/json", json.dumps({"error": "internal error"}).encode()
+                await self._respond(writer, status, ctype, out, keep_alive and not self.draining)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def serve(self, host: str = SERVICE_HOST, port: int = SERVICE_PORT):
+        loop = asyncio.get_running_loop()
+        self.pools = {"score": _Pool("score", self.workers, self.max_queue),
+                      "ingest": _Pool("ingest", self.ingest_workers, self.max_queue)}
+        await loop.run_in_executor(self.pools["score"].executor, self.warm)
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        server = await asyncio.start_server(self._client, host, port)
+        print(f"serving on http://{host}:{port} ({self.workers} score workers, {self.ingest_workers} ingest)")
+        await stop.wait()
+        await self.shutdown(server)
+
+    async def shutdown(self, server):
+        """Stop accepting, finish in-flight requests (up to drain_seconds), then release resources."""
+        import _runtime
+        self.draining = True
+        server.close()
+        # connections between requests have nothing to finish
+        for writer in list(self._idle):
+            writer.close()
+        pending = [t for t in self._connections if t is not asyncio.current_task()]
+        if pending:
+            print(f"draining {len(pending)} connection(s)")
+            _, late = await asyncio.wait(pending, timeout=self.drain_seconds)
+            for task in late:
+                task.cancel()
+        for pool in self.pools.values():
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+        _runtime.set_predict_batcher(None)
+        _runtime.close_pools()
+        print("service stopped")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--host", default=SERVICE_HOST)
+    p.add_argument("--port", type=int, default=SERVICE_PORT)
+    p.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="concurrent score/simulate requests")
+    p.add_argument("--ingest-workers", type=int, default=SERVICE_INGEST_WORKERS, help="concurrent ingest requests")
+    p.add_argument("--max-queue", type=int, default=SERVICE_MAX_QUEUE, help="requests waiting per pool before 503s")
+    p.add_argument("--batch-ms", type=float, default=SERVICE_BATCH_MS, help="predict coalescing window; 0 disables")
+    p.add_argument("--drain-seconds", type=float, default=SERVICE_DRAIN_SECONDS)
+    args = p.parse_args()
+
+    # every worker thread may hold a connection at once; _runtime reads this on import
+    os.environ.setdefault("DB_POOL_MAX", str(args.workers + args.ingest_workers * SERVICE_INGEST_WRITERS))
+    # a warm process gains nothing from the NumPy tree export (2-4x slower per predict than the Booster)
+    os.environ.setdefault("FAST_PREDICT", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    service = Service(args.workers, args.ingest_workers, args.max_queue, args.batch_ms, args.drain_seconds)
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Per-request stage timings, Prometheus metrics and an optional profiler for the handlers.
+
+Each handler runs inside `request(name)`, which makes a Trace current for
+the request. Code anywhere below it (the handlers, _runtime, _scoring,
+process_csv) wraps its steps in `stage("fetch")` and reports sizes with
+`add(rows_fetched=n)`. Both are no-ops outside a request, so the helpers
+stay usable from scripts and workers.
+
+- A request body with `"timings": true` (or TRACE_TIMINGS=1) gets a
+  `timings` block in the response: total and per-stage milliseconds plus
+  the counters.
+- Every request feeds process-wide histograms per (handler, stage) and
+  counters. `render_metrics()` returns them in the Prometheus text format,
+  and METRICS_TEXTFILE=<path> rewrites that file after each request (for
+  node_exporter's textfile collector).
+- PROFILE=cprofile|pyinstrument profiles requests: PROFILE_RATE is the
+  fraction sampled (default 1), PROFILE_MIN_MS keeps only requests at least
+  that slow, and profiles are written to PROFILE_DIR. Only one request is
+  profiled at a time; requests overlapping it are not sampled.
+"""
+import os
+import json
+import time
+import random
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+TRACE_TIMINGS = os.environ.get("TRACE_TIMINGS", "0") == "1"
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE")
+METRICS_PREFIX = "bharatledger"
+
+PROFILE = os.environ.get("PROFILE", "").lower()
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", "1"))
+PROFILE_MIN_MS = float(os.environ.get("PROFILE_MIN_MS", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "bharatledger-profiles")
+
+# histogram upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_lock = threading.Lock()
+# (handler, stage) -> [bucket counts..., +Inf count, sum]
+_histograms: Dict[tuple, list] = {}
+# (name, handler) -> value
+_counters: Dict[tuple, float] = {}
+_requests: Dict[tuple, int] = {}
+# one profiled request at a time: profilers are process-wide (cProfile on 3.12+),
+# so concurrent requests are simply not sampled while one is being profiled
+_profile_lock = threading.Lock()
+
+
+class Trace:
+    """Stage timings and counters of one request."""
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.want_timings = TRACE_TIMINGS
+        self.status = None
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            # a stage entered several times (one per batch, say) accumulates
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def add(self, **counts: int):
+        for k, v in counts.items():
+            self.counts[k] = self.counts.get(k, 0) + int(v)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def timings(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"total_ms": round(self.elapsed() * 1e3, 3)}
+        out["stages"] = {k: round(v * 1e3, 3) for k, v in self.stages.items()}
+        out.update(self.counts)
+        return out
+
+    def respond(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Record the status and, when asked for, add the timings block to a JSON object body."""
+        self.status = response.get("statusCode")
+        if self.want_timings and isinstance(response.get("body"), str):
+            try:
+                body = json.loads(response["body"])
+            except ValueError:
+                return response
+            if isinstance(body, dict):
+                body["timings"] = self.timings()
+                response = dict(response, body=json.dumps(body))
+        return response
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def stage(name: str):
+    """Time a step of the current request; a no-op outside one."""
+    trace = _current.get()
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+def add(**counts: int):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(**counts)
+
+
+def include_timings(flag):
+    """Called with the request's `timings` field; TRACE_TIMINGS=1 includes them regardless."""
+    trace = _current.get()
+    if trace is not None and flag:
+        trace.want_timings = True
+
+
+def _observe(key: tuple, seconds: float):
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            hist[i] += 1
+    hist[len(BUCKETS)] += 1
+    hist[-1] += seconds
+
+
+def record(trace: Trace):
+    """Fold a finished request into the process-wide metrics."""
+    with _lock:
+        _observe((trace.handler, "total"), trace.elapsed())
+        for name, seconds in trace.stages.items():
+            _observe((trace.handler, name), seconds)
+        for name, value in trace.counts.items():
+            _counters[(name, trace.handler)] = _counters.get((name, trace.handler), 0) + value
+        key = (trace.handler, str(trace.status or "error"))
+        _requests[key] = _requests.get(key, 0) + 1
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    p = METRICS_PREFIX
+    lines = [f"# HELP {p}_requests_total Handled requests by handler and HTTP status.", f"# TYPE {p}_requests_total counter"]
+    with _lock:
+        for (handler, status), n in sorted(_requests.items()):
+            lines.append(f"{p}_requests_total{_labels(handler=handler, status=status)} {n}")
+        lines += [f"# HELP {p}_stage_duration_seconds Time per request stage; stage=\"total\" is the whole request.",
+                  f"# TYPE {p}_stage_duration_seconds histogram"]
+        for (handler, name), hist in sorted(_histograms.items()):
+            for bound, n in zip(BUCKETS, hist):
+                lines.append(f"{p}_stage_duration_seconds_bucket{_labels(handler=handler, stage=name, le=bound)} {n}")
+            lines.append(f"{p}_stage_duration_seconds_bucket{_labels(handler=handler, stage=name, le='+Inf')} {hist[len(BUCKETS)]}")
+            lines.append(f"{p}_stage_duration_seconds_sum{_labels(handler=handler, stage=name)} {hist[-1]:.6f}")
+            lines.append(f"{p}_stage_duration_seconds_count{_labels(handler=handler, stage=name)} {hist[len(BUCKETS)]}")
+        for name in sorted({n for n, _ in _counters}):
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            for (n, handler), value in sorted(_counters.items()):
+                if n == name:
+                    lines.append(f"{p}_{name}_total{_labels(handler=handler)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str = None):
+    path = path or METRICS_TEXTFILE
+    if not path:
+        return
+    # write then rename, so the collector never reads a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render_metrics())
+    os.replace(tmp, path)
+
+
+class _Profiler:
+    """cProfile or pyinstrument around one request; pyinstrument falls back to cProfile if missing."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        if kind == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+                self.impl = Profiler(interval=0.001)
+            except ImportError:
+                print("PROFILE=pyinstrument but pyinstrument is not installed; using cProfile")
+                self.kind = "cprofile"
+        if self.kind == "cprofile":
+            import cProfile
+            self.impl = cProfile.Profile()
+
+    def start(self):
+        if self.kind == "cprofile":
+            self.impl.enable()
+        else:
+            self.impl.start()
+
+    def stop_and_save(self, trace: Trace) -> Optional[str]:
+        if self.kind == "cprofile":
+            self.impl.disable()
+        else:
+            self.impl.stop()
+        ms = trace.elapsed() * 1e3
+        if ms < PROFILE_MIN_MS:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{trace.handler}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{ms:.0f}ms")
+        if self.kind == "cprofile":
+            path = base + ".prof"
+            self.impl.dump_stats(path)
+        else:
+            path = base + ".html"
+            with open(path, "w") as f:
+                f.write(self.impl.output_html())
+        return path
+
+
+@contextmanager
+def request(handler: str):
+    """Trace one handler call; records metrics (and a sampled profile) when it ends."""
+    trace = Trace(handler)
+    token = _current.set(trace)
+    profiler = None
+    try:
+        if PROFILE in ("cprofile", "pyinstrument") and random.random() < PROFILE_RATE \
+                and _profile_lock.acquire(blocking=False):
+            try:
+                profiler = _Profiler(PROFILE)
+                profiler.start()
+            except Exception as e:
+                # e.g. cProfile's "Another profiling tool is already active"
+                print("Failed to start profiler:", e)
+                profiler = None
+                _profile_lock.release()
+        yield trace
+    finally:
+        if profiler is not None:
+            try:
+                path = profiler.stop_and_save(trace)
+                if path:
+                    print(f"profile written to {path}")
+            except Exception as e:
+                print("Failed to save profile:", e)
+            finally:
+                _profile_lock.release()
+        _current.reset(token)
+        record(trace)
+        if METRICS_TEXTFILE:
+            try:
+                write_textfile()
+            except OSError as e:
+                print("Failed to write metrics textfile:", e)
@@ -0,0 +1,215 @@
+"""Flat NumPy form of a LightGBM model for fast in-process scoring.
+
+`python api/python/_treemodel.py export ml/model.lgb` writes ml/model.npz:
+every tree's nodes concatenated into parallel arrays (split feature,
+threshold, child index, default direction, missing type, leaf value).
+Loading the .npz is a few array reads, with no lightgbm import and no text
+parsing, and `TreeModel.predict` walks all trees for all rows at once, one
+tree level per NumPy step, with LightGBM's numerical split and missing-value
+rules.
+
+Only numerical splits with a binary or identity-link regression objective
+are supported; `from_booster` raises UnsupportedModel otherwise and callers
+keep using the Booster.
+"""
+import os
+import sys
+import json
+import hashlib
+from typing import Any, Dict
+
+import numpy as np
+
+MISSING_TYPES = {"None": 0, "Zero": 1, "NaN": 2}
+# LightGBM's kZeroThreshold: |x| at or below this counts as zero for missing_type Zero
+ZERO_THRESHOLD = 1e-35
+# LightGBM's AvoidInf: the value dump_model writes for an infinite threshold
+DUMPED_INF = 1e300
+IDENTITY_OBJECTIVES = ("regression", "regression_l1", "huber", "fair", "quantile")
+
+_ARRAYS = ("feature", "threshold", "child", "default_left", "missing_type", "value", "roots", "active")
+
+
+class UnsupportedModel(ValueError):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TreeModel:
+    """Trees as flat node arrays.
+
+    Each internal node's children sit next to each other, so a row moves to
+    `child[node] + went_right`. Leaves point to themselves with an infinite
+    threshold and stay put. Trees are stored deepest first and `active[level]`
+    counts the trees still descending at that level, so each step only
+    touches those.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.num_features = int(meta["num_features"])
+        self.sigmoid = meta.get("sigmoid")
+        self.average_output = bool(meta.get("average_output"))
+        self.has_zero_missing = bool((self.missing_type == MISSING_TYPES["Zero"]).any())
+
+    @classmethod
+    def from_booster(cls, booster) -> "TreeModel":
+        model = booster.dump_model()
+        objective = (model.get("objective") or "").split()
+        meta: Dict[str, Any] = {"num_features": model["max_feature_idx"] + 1, "average_output": model.get("average_output", False)}
+        if model.get("num_class", 1) != 1 or model.get("num_tree_per_iteration", 1) != 1:
+            raise UnsupportedModel("multiclass models are not supported")
+        if objective and objective[0] == "binary":
+            params = dict(p.split(":", 1) for p in objective[1:] if ":" in p)
+            meta["sigmoid"] = float(params.get("sigmoid", 1.0))
+        elif not objective or objective[0] not in IDENTITY_OBJECTIVES:
+            raise UnsupportedModel(f"objective {model.get('objective')!r} is not supported")
+
+        def depth(node):
+            if "leaf_value" in node:
+                return 0
+            return 1 + max(depth(node["left_child"]), depth(node["right_child"]))
+
+        trees = [t["tree_structure"] for t in model["tree_info"]]
+        depths = [depth(t) for t in trees]
+        # stable sort keeps equal-depth trees in boosting order
+        order = sorted(range(len(trees)), key=lambda i: -depths[i])
+
+        feature, threshold, child, default_left, missing_type, value = [], [], [], [], [], []
+
+        def alloc(node):
+            feature.append(0)
+            threshold.append(np.inf)
+            child.append(len(child))
+            default_left.append(False)
+            missing_type.append(0)
+            value.append(0.0)
+            return len(feature) - 1
+
+        roots = []
+        for i in order:
+            # breadth-first so both children of a node get consecutive slots
+            queue = [(trees[i], alloc(trees[i]))]
+            roots.append(queue[0][1])
+            while queue:
+                node, slot = queue.pop(0)
+                if "leaf_value" in node:
+                    if "leaf_coeff" in node:
+                        raise UnsupportedModel("linear trees are not supported")
+                    value[slot] = node["leaf_value"]
+                    continue
+                if node.get("decision_type", "<=") != "<=":
+                    raise UnsupportedModel("categorical splits are not supported")
+                feature[slot] = node["split_feature"]
+                # dump_model writes infinite thresholds as +-1e300; the Booster compares with the infinity
+                threshold[slot] = node["threshold"] if abs(node["threshold"]) < DUMPED_INF else np.copysign(np.inf, node["threshold"])
+                default_left[slot] = bool(node.get("default_left", True))
+                missing_type[slot] = MISSING_TYPES[node.get("missing_type", "None")]
+                left, right = alloc(node["left_child"]), alloc(node["right_child"])
+                child[slot] = left
+                queue += [(node["left_child"], left), (node["right_child"], right)]
+
+        sorted_depths = np.asarray([depths[i] for i in order])
+        max_depth = int(sorted_depths.max()) if len(order) else 0
+        arrays = {
+            "feature": np.asarray(feature, dtype=np.intp),
+            "threshold": np.asarray(threshold, dtype=np.float64),
+            "child": np.asarray(child, dtype=np.intp),
+            "default_left": np.asarray(default_left, dtype=bool),
+            "missing_type": np.asarray(missing_type, dtype=np.int8),
+            "value": np.asarray(value, dtype=np.float64),
+            "roots": np.asarray(roots, dtype=np.intp),
+            "active": np.asarray([(sorted_depths > level).sum() for level in range(max_depth)], dtype=np.intp),
+        }
+        return cls(arrays, meta)
+
+    def save(self, path: str):
+        # np.savez appends .npz to other names, so write through a file object
+        with open(path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(self.meta)), **{n: getattr(self, n) for n in _ARRAYS})
+
+    @classmethod
+    def load(cls, path: str) -> "TreeModel":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls({n: data[n] for n in _ARRAYS}, meta)
+
+    def raw_score(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n, nf = X.shape
+        if nf != self.num_features:
+            raise ValueError(f"expected {self.num_features} features, got {nf}")
+        flat = X.ravel()
+        offsets = (np.arange(n) * nf)[:, None]
+        nan = np.isnan(flat)
+        # the missing-value rules only matter if a NaN (or a zero, for zero-as-missing splits) is present
+        special = nan.any() or (self.has_zero_missing and (np.abs(flat) <= ZERO_THRESHOLD).any())
+        node = np.empty((n, self.roots.size), dtype=np.intp)
+        node[:] = self.roots
+        for k in self.active:
+            nd = node[:, :k]
+            x = flat[offsets + self.feature[nd]]
+            if special:
+                mt = self.missing_type[nd]
+                is_nan = np.isnan(x)
+                # LightGBM treats NaN as 0.0 unless the split has its own NaN handling
+                x = np.where(is_nan & (mt != 2), 0.0, x)
+                use_default = ((mt == 1) & (np.abs(x) <= ZERO_THRESHOLD)) | ((mt == 2) & is_nan)
+                went_right = np.where(use_default, ~self.default_left[nd], x > self.threshold[nd])
+            else:
+                went_right = x > self.threshold[nd]
+            node[:, :k] = self.child[nd] + went_right
+        out = self.value[node].sum(axis=1)
+        if self.average_output and self.roots.size:
+            out /= self.roots.size
+        return out
+
+    def predict(self, X, raw_score: bool = False) -> np.ndarray:
+        """Same output as Booster.predict for the supported objectives."""
+        out = self.raw_score(X)
+        if raw_score or self.sigmoid is None:
+            return out
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * out))
+
+
+def npz_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".npz"
+
+
+def export(model_path: str, out_path: str = None) -> str:
+    """Write the flat form of `model_path`, tagged with its hash so stale exports are ignored."""
+    import lightgbm as lgb
+    tm = TreeModel.from_booster(lgb.Booster(model_file=model_path))
+    tm.meta["source_sha256"] = file_sha256(model_path)
+    out_path = out_path or npz_path(model_path)
+    tm.save(out_path)
+    return out_path
+
+
+def load_for(model_path: str):
+    """The exported TreeModel for `model_path`, or None if there is none or it is out of date."""
+    path = npz_path(model_path)
+    if not os.path.exists(path):
+        return None
+    tm = TreeModel.load(path)
+    if tm.meta.get("source_sha256") != file_sha256(model_path):
+        return None
+    return tm
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "export":
+        print(json.dumps({"written": export(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)}))
+    else:
+        print("Usage: _treemodel.py export <model.lgb> [<out.npz>]")
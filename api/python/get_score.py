@@ -1,122 +1,89 @@
+from __future__ import annotations
+
 import os
+import sys
 import json
-import math
-from typing import Dict, Any
-
-import polars as pl
-import psycopg2
-import lightgbm as lgb
-
-# Feature engineering mirrors notebook/processor logic
-FOOD_KEYS = ["zomato", "swiggy", "dominos", "restaurant", "cafe", "mcdonald", "food"]
-LOAN_KEYS = ["emi", "loan", "equated", "instalment", "installment"]
-
-MODEL_PATH = os.path.join(os.getcwd(), "ml", "model.lgb")
-
-
-def safe_div(a, b):
-    try:
-        if b == 0 or b is None:
-            return 0.0
-        return float(a) / float(b)
-    except Exception:
-        return 0.0
-
-
-def compute_features_from_df(df: pl.DataFrame) -> Dict[str, Any]:
-    # Expect columns: date (string/datetime), description, amount (float), type (Credit/Debit)
-    if df.height == 0:
-        # empty user: return zeros
-        return {
-            "avg_monthly_income": 0.0,
-            "avg_monthly_expense": 0.0,
-            "savings_rate": 0.0,
-            "expense_to_income_ratio": 0.0,
-            "num_loan_payments": 0,
-            "pct_spend_on_food": 0.0,
-            "total_transactions": 0,
+from typing import TYPE_CHECKING, Dict, Any
+
+# polars/numpy are imported inside the functions that use them, so cold starts
+# and cheap paths (bad requests, feature-store reads) do not pay for them
+if TYPE_CHECKING:
+    import numpy as np
+    import polars as pl
+
+# sibling helper modules are underscore-prefixed so Vercel does not expose them as functions
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _runtime import db_connection  # noqa: E402
+import _tracing as tracing  # noqa: E402
+from _feature_store import FEATURE_SOURCE, SQL_SOURCES, read_features, read_features_many  # noqa: E402
+from _scoring import FEATURE_NAMES, compute_features_from_df, compute_features_grouped, predict_scores, score_one  # noqa: E402
+from _score_cache import get_cache  # noqa: E402
+
+
+def score_batch(payload: Dict[str, Any], db_url: str) -> Dict[str, Any]:
+    """Score many users with one user lookup, one transaction query and one predict."""
+    import numpy as np
+    import polars as pl
+    user_ids = list(payload.get("userIds") or [])
+    emails = list(payload.get("userEmails") or [])
+    not_found = []
+    with db_connection(db_url) as conn:
+        cur = conn.cursor()
+        if emails:
+            cur.execute('SELECT id, email FROM "User" WHERE email = ANY(%s)', (emails,))
+            by_email = {email: uid for uid, email in cur.fetchall()}
+            not_found = [e for e in emails if e not in by_email]
+            user_ids += [by_email[e] for e in emails if e in by_email]
+        user_ids = list(dict.fromkeys(user_ids))
+        # keys are taken before the fetch, so rows landing in between only make the entry unreachable
+        cache = get_cache()
+        keys = cache.keys(cur, user_ids) if cache is not None and user_ids else {}
+        cached = cache.get_many(cur, keys) if keys else {}
+        all_ids, user_ids = user_ids, [u for u in user_ids if u not in cached]
+        with tracing.stage("fetch"):
+            if FEATURE_SOURCE in SQL_SOURCES:
+                stored = read_features_many(cur, user_ids, FEATURE_SOURCE)
+                rows = []
+            else:
+                cur.execute('SELECT "userId", date, description, amount, type FROM "Transaction" WHERE "userId" = ANY(%s)', (user_ids,))
+                rows = cur.fetchall()
+        tracing.add(users=len(user_ids), rows_fetched=len(rows))
+
+        with tracing.stage("features"):
+            ids = pl.DataFrame({"userId": user_ids}, schema={"userId": pl.Utf8})
+            if FEATURE_SOURCE in SQL_SOURCES:
+                feats = ids.with_columns([pl.Series(n, [stored[u][n] for u in user_ids]) for n in FEATURE_NAMES])
+            elif rows:
+                tx = pl.DataFrame(rows, schema=["userId", "date", "description", "amount", "type"])
+                tracing.add(bytes_fetched=tx.estimated_size())
+                feats = ids.join(compute_features_grouped(tx), on="userId", how="left")
+            else:
+                feats = ids.with_columns([pl.lit(None).alias(n) for n in FEATURE_NAMES])
+            # users without transactions get the same all-zero features as the single-user path
+            feats = feats.with_columns(
+                [pl.col(n).fill_null(0.0) for n in FEATURE_NAMES[:4] + ["pct_spend_on_food"]]
+                + [pl.col(n).fill_null(0).cast(pl.Int64) for n in ("num_loan_payments", "total_transactions")]
+            ).select(["userId"] + FEATURE_NAMES)
+
+        X = feats.select(FEATURE_NAMES).to_numpy().astype(np.float64)
+        scores = predict_scores(X)
+        fresh = {
+            rec["userId"]: {"score": int(round(float(sc))), "features": {n: rec[n] for n in FEATURE_NAMES}}
+            for rec, sc in zip(feats.to_dicts(), scores)
         }
+        if cache is not None:
+            # on this connection: the shared backend must not take a second one from the pool
+            cache.put_many(cur, {uid: (keys[uid], entry) for uid, entry in fresh.items()})
+    results = [{"userId": uid, **(cached.get(uid) or fresh[uid])} for uid in all_ids]
+    return {"scores": results, "notFound": not_found}
 
-    # parse date
-    if "date" in df.columns:
-        try:
-            df = df.with_column(pl.col("date").str.strptime(pl.Date, fmt=None).alias("date_parsed"))
-            df = df.with_column(pl.col("date_parsed").cast(pl.Datetime).alias("date"))
-        except Exception:
-            pass
-
-    # normalize amount and type
-    if "amount" in df.columns:
-        df = df.with_column(pl.col("amount").cast(pl.Float64).alias("amount"))
-    else:
-        df = df.with_column(pl.lit(0.0).alias("amount"))
-
-    if "type" not in df.columns:
-        # infer type by sign
-        df = df.with_column(pl.when(pl.col("amount") >= 0).then("Credit").otherwise("Debit").alias("type"))
 
-    # month key
-    if "date" in df.columns:
-        df = df.with_column(pl.col("date").dt.strftime("%Y-%m").alias("month"))
-    else:
-        df = df.with_column(pl.lit("unknown").alias("month"))
+def handler(event, context=None):
+    with tracing.request("get_score") as trace:
+        return trace.respond(_handle(event))
 
-    # monthly aggregates
-    monthly = df.groupby(["month", "type"]).agg(pl.col("amount").sum().alias("sum_amount"))
 
-    # pivot to get income/expense per month
-    # fallback compute manual
-    income_monthly_sums = []
-    expense_monthly_sums = []
-    try:
-        income = monthly.filter(pl.col("type") == "Credit")
-        expense = monthly.filter(pl.col("type") == "Debit")
-        income_monthly_sums = income.select("sum_amount").to_series().to_list()
-        expense_monthly_sums = expense.select("sum_amount").to_series().to_list()
-    except Exception:
-        pass
-
-    avg_monthly_income = float(sum(income_monthly_sums) / len(income_monthly_sums)) if income_monthly_sums else 0.0
-    avg_monthly_expense = float(sum(expense_monthly_sums) / len(expense_monthly_sums)) if expense_monthly_sums else 0.0
-
-    savings_rate = safe_div((avg_monthly_income - avg_monthly_expense), avg_monthly_income) * 100.0 if avg_monthly_income else 0.0
-    expense_to_income_ratio = safe_div(avg_monthly_expense, avg_monthly_income) if avg_monthly_income else 0.0
-
-    # num loan payments
-    desc_col = df.get_column("description") if "description" in df.columns else pl.Series([""] * df.height)
-    desc_lower = desc_col.str.to_lowercase()
-    num_loan_payments = sum(any(k in (d or "") for k in LOAN_KEYS) for d in desc_lower.to_list())
-
-    # pct spend on food (of total debit spend)
-    debit_df = df.filter(pl.col("type") == "Debit")
-    total_debit = float(debit_df.select(pl.col("amount").abs().sum()).to_series()[0]) if debit_df.height > 0 else 0.0
-    food_mask = debit_df.filter(pl.col("description").str.to_lowercase().map(lambda s: any(k in (s or "") for k in FOOD_KEYS))) if debit_df.height > 0 else pl.DataFrame([])
-    food_spend = float(food_mask.select(pl.col("amount").abs().sum()).to_series()[0]) if (debit_df.height > 0 and food_mask.height > 0) else 0.0
-    pct_spend_on_food = safe_div(food_spend, total_debit) * 100.0 if total_debit else 0.0
-
-    return {
-        "avg_monthly_income": avg_monthly_income,
-        "avg_monthly_expense": avg_monthly_expense,
-        "savings_rate": savings_rate,
-        "expense_to_income_ratio": expense_to_income_ratio,
-        "num_loan_payments": int(num_loan_payments),
-        "pct_spend_on_food": pct_spend_on_food,
-        "total_transactions": int(df.height),
-    }
-
-
-def load_model():
-    if os.path.exists(MODEL_PATH):
-        try:
-            bst = lgb.Booster(model_file=MODEL_PATH)
-            return bst
-        except Exception as e:
-            print("Failed to load model:", e)
-            return None
-    return None
-
-
-def handler(event, context=None):
+def _handle(event):
     try:
         body = None
         if isinstance(event, dict):
@@ -124,6 +91,7 @@ def handler(event, context=None):
         if not body:
             return {"statusCode": 400, "body": json.dumps({"error": "Missing request body. Provide JSON { userEmail: ... }"})}
         payload = json.loads(body)
+        tracing.include_timings(payload.get("timings"))
         user_email = payload.get("userEmail")
         user_id = payload.get("userId")
 
@@ -131,52 +99,60 @@ def handler(event, context=None):
         if not db_url:
             return {"statusCode": 500, "body": json.dumps({"error": "DATABASE_URL not set"})}
 
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
-
-        if user_id is None:
-            if not user_email:
-                return {"statusCode": 400, "body": json.dumps({"error": "userId or userEmail required"})}
-            # resolve user id by email
-            cur.execute('SELECT id FROM "User" WHERE email = %s LIMIT 1', (user_email,))
-            row = cur.fetchone()
-            if not row:
-                return {"statusCode": 404, "body": json.dumps({"error": "User not found"})}
-            user_id = row[0]
-
-        # fetch transactions
-        cur.execute('SELECT date, description, amount, type FROM "Transaction" WHERE "userId" = %s ORDER BY date ASC', (user_id,))
-        rows = cur.fetchall()
-        conn.close()
-
-        # build DataFrame
-        if not rows:
-            df = pl.DataFrame([])
-        else:
-            df = pl.DataFrame(rows, schema=["date", "description", "amount", "type"])
-
-        features = compute_features_from_df(df)
-
-        model = load_model()
-        score = None
-        if model is not None:
-            # model expects 2D array
-            feat_names = ["avg_monthly_income", "avg_monthly_expense", "savings_rate", "expense_to_income_ratio", "num_loan_payments", "pct_spend_on_food", "total_transactions"]
-            X = [[features.get(n, 0.0) for n in feat_names]]
-            pred = model.predict(X)
-            try:
-                score = float(pred[0])
-            except Exception:
-                score = float(pred)
-        else:
-            # Fallback heuristic scoring
-            base = 600
-            base += min(200, int(features["savings_rate"] * 2))
-            base += max(-100, int((1 - features["expense_to_income_ratio"]) * 50))
-            base += max(-50, 50 - features["num_loan_payments"] * 10)
-            score = max(300, min(850, base))
-
-        return {"statusCode": 200, "body": json.dumps({"score": int(round(score)), "features": features})}
+        # batch mode: { userIds: [...] } and/or { userEmails: [...] }
+        if payload.get("userIds") or payload.get("userEmails"):
+            return {"statusCode": 200, "body": json.dumps(score_batch(payload, db_url))}
+
+        with db_connection(db_url) as conn:
+            cur = conn.cursor()
+
+            if user_id is None:
+                if not user_email:
+                    return {"statusCode": 400, "body": json.dumps({"error": "userId or userEmail required"})}
+                # resolve user id by email
+                with tracing.stage("resolve_user"):
+                    cur.execute('SELECT id FROM "User" WHERE email = %s LIMIT 1', (user_email,))
+                    row = cur.fetchone()
+                if not row:
+                    return {"statusCode": 404, "body": json.dumps({"error": "User not found"})}
+                user_id = row[0]
+
+            # a cached result is valid while the transaction watermark and model are unchanged
+            cache = get_cache()
+            if cache is not None:
+                key = cache.keys(cur, [user_id])[user_id]
+                hit = cache.get_many(cur, {user_id: key}).get(user_id)
+                if hit is not None:
+                    return {"statusCode": 200, "body": json.dumps(hit)}
+
+            # aggregates computed in the database for the SQL sources, else fetch transactions
+            with tracing.stage("fetch"):
+                stored = read_features(cur, user_id, FEATURE_SOURCE) if FEATURE_SOURCE in SQL_SOURCES else None
+                if stored is None:
+                    cur.execute('SELECT date, description, amount, type FROM "Transaction" WHERE "userId" = %s ORDER BY date ASC', (user_id,))
+                    rows = cur.fetchall()
+                    tracing.add(rows_fetched=len(rows))
+
+            if stored is not None:
+                features = stored
+            else:
+                with tracing.stage("features"):
+                    import polars as pl
+                    # build DataFrame
+                    if not rows:
+                        df = pl.DataFrame([])
+                    else:
+                        df = pl.DataFrame(rows, schema=["date", "description", "amount", "type"])
+                        tracing.add(bytes_fetched=df.estimated_size())
+                    features = compute_features_from_df(df)
+
+            # cached model (or the heuristic fallback when none is deployed)
+            score = score_one(features)
+            result = {"score": int(round(score)), "features": features}
+            if cache is not None:
+                cache.put_many(cur, {user_id: (key, result)})
+
+        return {"statusCode": 200, "body": json.dumps(result)}
     except Exception as e:
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
 
@@ -184,9 +160,13 @@ def handler(event, context=None):
 if __name__ == "__main__":
     # quick CLI for testing
     import sys
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2:
+        # several ids: score them in one batch
+        ev = {"body": json.dumps({"userIds": sys.argv[1:]})}
+        print(handler(ev))
+    elif len(sys.argv) > 1:
         # allow passing userId
         ev = {"body": json.dumps({"userId": sys.argv[1]})}
         print(handler(ev))
     else:
-        print("Usage: get_score.py <userId>")
+        print("Usage: get_score.py <userId> [<userId> ...]")
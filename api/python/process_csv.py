@@ -1,12 +1,26 @@
+from __future__ import annotations
+
 import os
+import sys
 import json
 import io
-from typing import List, Dict, Any
+import time
+import threading
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple
+
+# External libs: polars, psycopg2 (via _runtime); polars is imported inside the
+# functions that use it, so cold starts and rejected requests do not pay for it
+if TYPE_CHECKING:
+    import polars as pl
 
-# External libs: polars, psycopg2
-import polars as pl
-import psycopg2
-from psycopg2.extras import execute_values
+# sibling helper modules are underscore-prefixed so Vercel does not expose them as functions
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _runtime import POOL_MAX, db_connection  # noqa: E402
+import _feature_store as feature_store  # noqa: E402
+import _score_cache as score_cache  # noqa: E402
+import _tracing as tracing  # noqa: E402
+# categorization matches keywords with the same escaping as scoring
+from _scoring import keyword_pattern  # noqa: E402
 
 # Minimal rule-based categorizer
 CATEGORY_RULES = [
@@ -17,8 +31,40 @@ CATEGORY_RULES = [
     ("Salary", ["salary", "payroll", "salarycredit"]),
 ]
 
+
+def load_category_rules(path: str) -> List[Tuple[str, List[str]]]:
+    """Read ordered (category, keywords) rules from a JSON or CSV file.
+
+    JSON is an object {"Category": ["keyword", ...]} (key order is rule order);
+    any other file is CSV with `category,keyword` rows, categories ranked by
+    first appearance. Keywords are lowercased, blank ones are dropped.
+    """
+    import polars as pl
+    rules: Dict[str, List[str]] = {}
+    if path.endswith(".json"):
+        with open(path) as f:
+            items = json.load(f).items()
+    else:
+        df = pl.read_csv(path, has_header=False, new_columns=["category", "keyword"], dtypes=[pl.Utf8, pl.Utf8])
+        if df.height and df[0, "category"].strip().lower() == "category":
+            df = df.slice(1)
+        items = ((cat, [kw]) for cat, kw in df.iter_rows())
+    for cat, keys in items:
+        bucket = rules.setdefault(cat.strip(), [])
+        bucket.extend(k.strip().lower() for k in keys if k and k.strip())
+    return list(rules.items())
+
+
+# CATEGORY_RULES_PATH swaps the built-in rules for a (possibly much larger) rule file
+if os.environ.get("CATEGORY_RULES_PATH"):
+    CATEGORY_RULES = load_category_rules(os.environ["CATEGORY_RULES_PATH"])
+
+# rows per read/clean/COPY batch; the request payload's "batchSize" overrides it
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "50000"))
+
 # Column mapping and cleaning helper
 
+
 def standardize_type(val: str) -> str:
     if not val:
         return "Debit"
@@ -42,8 +88,36 @@ def categorize(description: str) -> str:
     return "Other"
 
 
+def _compile_rules(rules) -> List[Tuple[str, str]]:
+    # one literal alternation per category; the regex engine matches these with
+    # a multi-pattern automaton, so thousands of keywords cost about the same as a few
+    return [(cat, keyword_pattern(keys)) for cat, keys in rules if keys]
+
+
+_CATEGORY_PATTERNS = _compile_rules(CATEGORY_RULES)
+
+
+def category_expr(column: str = "description") -> pl.Expr:
+    """Vectorized `categorize`: the first rule (in CATEGORY_RULES order) with a keyword in the text wins."""
+    import polars as pl
+    text = pl.col(column).str.to_lowercase()
+    expr = pl.when(pl.col(column).is_null() | (pl.col(column) == "")).then(pl.lit("Uncategorized"))
+    for cat, pattern in _CATEGORY_PATTERNS:
+        expr = expr.when(text.str.contains(pattern)).then(pl.lit(cat))
+    return expr.otherwise(pl.lit("Other"))
+
+
+def type_expr(df: pl.DataFrame, column: str = "type") -> pl.Expr:
+    """Vectorized `standardize_type`: normalise each distinct value once, then map_dict."""
+    import polars as pl
+    values = df.get_column(column).cast(pl.Utf8)
+    lookup = {v: standardize_type(v) for v in values.unique().to_list() if v is not None}
+    return pl.col(column).cast(pl.Utf8).map_dict(lookup)
+
+
 def clean_dataframe(df: pl.DataFrame) -> pl.DataFrame:
     # Normalize common column names
+    import polars as pl
     cols = [c.lower() for c in df.columns]
     mapping = {}
     # heuristics to find columns
@@ -85,13 +159,13 @@ def clean_dataframe(df: pl.DataFrame) -> pl.DataFrame:
 
     # Standardize type
     if "type" in df.columns:
-        df = df.with_column(pl.col("type").apply(standardize_type).alias("type"))
+        df = df.with_column(type_expr(df).alias("type"))
     else:
         df = df.with_column(pl.lit("Debit").alias("type"))
 
     # Category
     if "description" in df.columns:
-        df = df.with_column(pl.col("description").apply(categorize).alias("category"))
+        df = df.with_column(category_expr().alias("category"))
     else:
         df = df.with_column(pl.lit("Uncategorized").alias("category"))
 
@@ -100,95 +174,343 @@ def clean_dataframe(df: pl.DataFrame) -> pl.DataFrame:
     return df
 
 
-def bulk_insert_transactions(conn, rows: List[Dict[str, Any]]):
-    if not rows:
-        return
-    # Map rows to tuple order
-    columns = ["user_id", "account_id", "date", "description", "amount", "type", "category", "reference"]
-    values = [tuple(row.get(col) for col in columns) for row in rows]
+def iter_clean_batches(path: str, batch_size: int = INGEST_BATCH_SIZE):
+    """Yield cleaned DataFrames of about `batch_size` rows read lazily from `path`."""
+    import polars as pl
+    with tracing.stage("read"):
+        reader = pl.read_csv_batched(path, batch_size=batch_size)
+    while True:
+        with tracing.stage("read"):
+            batches = reader.next_batches(1)
+        if not batches:
+            return
+        for df in batches:
+            tracing.add(rows_read=df.height)
+            with tracing.stage("clean"):
+                df = clean_dataframe(df)
+            yield df
 
-    insert_sql = f"""
-    INSERT INTO "Transaction" (userId, accountId, date, description, amount, type, category, reference)
-    VALUES %s
-    RETURNING id;
-    """
+
+COPY_COLUMNS = ["userId", "accountId", "date", "description", "amount", "type", "category", "reference"]
+
+_STAGE_SQL = """
+CREATE TEMP TABLE ingest_stage (
+    "userId" text, "accountId" text, date timestamp, description text,
+    amount double precision, type text, category text, reference text,
+    "contentKey" text
+) ON COMMIT DROP
+"""
+
+_COPY_SQL = "COPY ingest_stage FROM STDIN WITH (FORMAT csv, HEADER true)"
+
+_COPY_LIST = ", ".join(f'"{c}"' for c in COPY_COLUMNS)
+
+_INVALIDATE_SQL = score_cache.invalidate_sql('SELECT "userId" FROM ins')
+_CACHE_CTE = f", cache AS ({_INVALIDATE_SQL})" if _INVALIDATE_SQL else ""
+
+# Prisma's cuid() id default is generated client-side, so the insert supplies the id.
+# Move the staged rows into Transaction, skipping rows whose content hash is
+# already stored, add the inserted ones to the feature store and drop the
+# shared cached scores of their users (SCORE_CACHE=postgres). Identical
+# rows within one upload are numbered so genuine repeats (two equal payments
+# on the same day) are kept while re-uploading the same statement is not.
+
+_MOVE_SQL = f"""
+WITH staged AS (
+    SELECT {_COPY_LIST},
+           md5("contentKey" || E'\\x1f' || row_number() OVER (PARTITION BY "contentKey")) AS "contentHash"
+    FROM ingest_stage
+), ins AS (
+    INSERT INTO "Transaction" (id, {_COPY_LIST}, "contentHash")
+    SELECT gen_random_uuid()::text, {_COPY_LIST}, "contentHash" FROM staged
+    ON CONFLICT ("contentHash") DO NOTHING
+    RETURNING "userId", date, description, amount, type
+), feat AS ({feature_store.upsert_sql("ins")}){_CACHE_CTE}
+SELECT (SELECT count(*) FROM ingest_stage), (SELECT count(*) FROM ins), ARRAY(SELECT DISTINCT "userId" FROM ins)
+"""
+
+
+def _date_text(df: pl.DataFrame) -> pl.Expr:
+    import polars as pl
+    if "date" not in df.columns:
+        return pl.lit(None, dtype=pl.Utf8)
+    if df["date"].dtype in (pl.Date, pl.Datetime):
+        return pl.col("date").cast(pl.Datetime).dt.strftime("%Y-%m-%d %H:%M:%S")
+    return pl.col("date").cast(pl.Utf8)
+
+
+def content_key_expr() -> pl.Expr:
+    """Canonical text of (userId, date, amount, description, reference) the content hash is taken over."""
+    import polars as pl
+    parts = [pl.col("userId"), pl.col("date"), pl.col("amount").cast(pl.Utf8), pl.col("description"), pl.col("reference")]
+    return pl.concat_str([p.fill_null("") for p in parts], sep="\x1f")
+
+
+def copy_frame(df: pl.DataFrame, user_id: str = None, account_id: str = None) -> pl.DataFrame:
+    """Cleaned batch as COPY_COLUMNS plus contentKey, with the defaults the row-wise insert used."""
+    import polars as pl
+
+    def col(name):
+        return pl.col(name) if name in df.columns else pl.lit(None, dtype=pl.Utf8)
+
+    reference = col("reference").cast(pl.Utf8)
+    frame = df.select([
+        pl.lit(user_id, dtype=pl.Utf8).alias("userId"),
+        pl.lit(account_id, dtype=pl.Utf8).alias("accountId"),
+        _date_text(df).alias("date"),
+        col("description").fill_null("").alias("description"),
+        (pl.col("amount") if "amount" in df.columns else pl.lit(None, dtype=pl.Float64)).cast(pl.Float64).fill_null(0.0).alias("amount"),
+        col("type").fill_null("Debit").alias("type"),
+        col("category").fill_null("Uncategorized").alias("category"),
+        pl.when(reference == "").then(None).otherwise(reference).alias("reference"),
+    ])
+    return frame.with_column(content_key_expr().alias("contentKey"))
+
+
+def _stage_and_move(conn, frames) -> Tuple[int, int]:
+    """COPY `frames` into the staging table and insert them in one transaction; returns (inserted, skipped)."""
     with conn.cursor() as cur:
-        execute_values(cur, insert_sql, values)
-    conn.commit()
+        cur.execute(_STAGE_SQL)
+        for frame in frames:
+            with tracing.stage("copy"):
+                buf = io.BytesIO()
+                frame.write_csv(buf)
+                tracing.add(bytes_copied=buf.tell())
+                buf.seek(0)
+                cur.copy_expert(_COPY_SQL, buf)
+        with tracing.stage("insert"):
+            cur.execute(_MOVE_SQL, feature_store.sql_params())
+            staged, inserted, users = cur.fetchone()
+    with tracing.stage("commit"):
+        conn.commit()
+    if users:
+        score_cache.invalidate(users)
+    tracing.add(rows_inserted=inserted, rows_skipped=staged - inserted)
+    return inserted, staged - inserted
+
+
+def ingest_csv(conn, path: str, user_id: str, account_id: str = None, batch_size: int = INGEST_BATCH_SIZE) -> Tuple[int, int]:
+    """Stream a CSV into "Transaction" in a single transaction; returns (inserted, skipped).
+
+    Only one batch is held in memory at a time: each is cleaned and COPY'd
+    into a temporary staging table, then one INSERT ... SELECT moves the
+    staged rows into "Transaction" and updates the feature store before the
+    commit. Rows already stored for the user (same content hash) are
+    skipped. Any failure rolls back the whole file.
+    """
+    frames = (copy_frame(batch, user_id, account_id) for batch in iter_clean_batches(path, batch_size))
+    return _stage_and_move(conn, frames)
+
+
+def load_jobs(source: str, user_id: str = None, account_id: str = None) -> List[Dict[str, Any]]:
+    """Files to ingest from a directory of CSVs or a manifest.
+
+    A directory yields every *.csv in it (sorted) for `user_id`. A manifest is
+    JSON lines or a CSV with `path`, `userId` and optional `accountId`
+    columns; missing ids fall back to the arguments and relative paths are
+    resolved against the manifest's directory.
+    """
+    import polars as pl
+    if os.path.isdir(source):
+        if not user_id:
+            raise ValueError("userId is required when ingesting a directory")
+        names = sorted(f for f in os.listdir(source) if f.lower().endswith(".csv"))
+        return [{"path": os.path.join(source, f), "userId": user_id, "accountId": account_id} for f in names]
+    if source.endswith((".jsonl", ".json")):
+        with open(source) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    else:
+        entries = pl.read_csv(source, infer_schema_length=0).to_dicts()
+    base = os.path.dirname(os.path.abspath(source))
+    jobs = []
+    for e in entries:
+        uid = e.get("userId") or user_id
+        if not e.get("path") or not uid:
+            raise ValueError(f"manifest entry needs path and userId: {e}")
+        jobs.append({"path": os.path.join(base, e["path"]), "userId": uid, "accountId": e.get("accountId") or account_id})
+    return jobs
+
+
+def read_checkpoint(path: str) -> set:
+    """Paths recorded as ingested successfully in a JSON-lines checkpoint."""
+    done = set()
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if rec.get("status") == "ok":
+                    done.add(rec["path"])
+    return done
+
+
+def _parse_job(path: str, user_id: str, account_id: str, batch_size: int) -> List[pl.DataFrame]:
+    # runs in a worker process; the parsed frames are pickled back to the writers
+    try:
+        return [copy_frame(batch, user_id, account_id) for batch in iter_clean_batches(path, batch_size)]
+    except Exception as e:
+        # polars exceptions do not survive pickling, so send back plain text
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def ingest_batch(jobs: List[Dict[str, Any]], db_url: str = None, workers: int = None, writers: int = None,
+                 batch_size: int = INGEST_BATCH_SIZE, checkpoint: str = None, on_result=None) -> Dict[str, Any]:
+    """Ingest many files: parse/clean in a process pool, write through a few pooled connections.
+
+    Each file is still committed as its own transaction. At most
+    `workers + 2 * writers` files are parsed or waiting for a writer at any
+    time, so a slow database throttles parsing instead of filling memory.
+    Every finished file is appended to `checkpoint` (JSON lines); files
+    already recorded there as ok are skipped, so a failed run can be resumed.
+    `on_result` is called with each per-file status dict.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    # the writers share one connection pool, which hands out at most POOL_MAX connections
+    writers = min(writers or POOL_MAX, POOL_MAX)
+    done = read_checkpoint(checkpoint)
+    todo = [j for j in jobs if j["path"] not in done]
+    slots = threading.BoundedSemaphore(workers + 2 * writers)
+    lock = threading.Lock()
+    results: List[Dict[str, Any]] = []
+    start = time.perf_counter()
+
+    def record(job, status, **info):
+        res = {"path": job["path"], "userId": job["userId"], "status": status, **info}
+        with lock:
+            results.append(res)
+            if checkpoint:
+                with open(checkpoint, "a") as f:
+                    f.write(json.dumps(res) + "\n")
+            if on_result:
+                on_result(res)
+
+    def write(job, parsed):
+        t0 = time.perf_counter()
+        try:
+            frames = parsed.result()
+            with db_connection(db_url) as conn:
+                inserted, skipped = _stage_and_move(conn, frames)
+            record(job, "ok", inserted=inserted, skipped=skipped, seconds=round(time.perf_counter() - t0, 3))
+        except Exception as e:
+            record(job, "failed", error=str(e))
+        finally:
+            slots.release()
+
+    # polars is multi-threaded, so workers are spawned rather than forked
+    ctx = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(writers) as write_pool, ProcessPoolExecutor(workers, mp_context=ctx) as parse_pool:
+        for job in todo:
+            slots.acquire()
+            fut = parse_pool.submit(_parse_job, job["path"], job["userId"], job.get("accountId"), batch_size)
+            fut.add_done_callback(lambda f, job=job: write_pool.submit(write, job, f))
+
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r["status"] == "ok"]
+    rows = sum(r["inserted"] + r["skipped"] for r in ok)
+    return {
+        "files": len(jobs),
+        "resumed": len(jobs) - len(todo),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "inserted": sum(r["inserted"] for r in ok),
+        "skipped": sum(r["skipped"] for r in ok),
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+        "results": results,
+    }
 
 
 # Simple WSGI-like handler for Vercel serverless function
-from http.server import BaseHTTPRequestHandler
 
 # Vercel directly runs Python files as handlers when placed under /api; implement a small handler using environment provided input.
 # But for compatibility, implement a simple Flask-like minimal handling by reading stdin/body when executed as a function.
 
 
 def handler(event, context=None):
+    with tracing.request("process_csv") as trace:
+        return trace.respond(_handle(event))
+
+
+def _handle(event):
     # event: dict with keys method and body (string) - Vercel may call with different signature; keep defensive
     try:
         body = event.get("body") if isinstance(event, dict) else None
         if not body:
             return {"statusCode": 400, "body": json.dumps({"error": "Missing body"})}
         payload = json.loads(body)
+        tracing.include_timings(payload.get("timings"))
         path = payload.get("path")
         user_id = payload.get("userId")
         account_id = payload.get("accountId")
-        if not path or not user_id:
+        # batch mode: a directory of CSVs or a manifest instead of one path
+        source = payload.get("manifest") or payload.get("dir")
+        if not source and (not path or not user_id):
             return {"statusCode": 400, "body": json.dumps({"error": "path and userId required"})}
 
         # Read CSV using Polars
-        if not os.path.exists(path):
-            return {"statusCode": 400, "body": json.dumps({"error": f"file not found: {path}"})}
-
-        # Polars can read from path
-        df = pl.read_csv(path)
-        df = clean_dataframe(df)
-
-        # Build rows
-        rows = []
-        for rec in df.iter_rows(named=True):
-            # rec is dict-like
-            date_val = rec.get("date")
-            # Coerce date to ISO string
-            if isinstance(date_val, (pl.Date, pl.Datetime)):
-                date_iso = str(date_val)
-            else:
-                date_iso = str(rec.get("date")) if rec.get("date") is not None else None
-
-            rows.append({
-                "user_id": user_id,
-                "account_id": account_id,
-                "date": date_iso,
-                "description": rec.get("description") or "",
-                "amount": rec.get("amount") or 0.0,
-                "type": rec.get("type") or "Debit",
-                "category": rec.get("category") or "Uncategorized",
-                "reference": rec.get("reference") or None,
-            })
+        if not os.path.exists(source or path):
+            return {"statusCode": 400, "body": json.dumps({"error": f"file not found: {source or path}"})}
+
+        try:
+            batch_size = int(payload.get("batchSize") or INGEST_BATCH_SIZE)
+            workers = int(payload["workers"]) if payload.get("workers") else None
+            writers = int(payload["writers"]) if payload.get("writers") else None
+        except (TypeError, ValueError):
+            return {"statusCode": 400, "body": json.dumps({"error": "batchSize, workers and writers must be integers"})}
+        if batch_size <= 0:
+            return {"statusCode": 400, "body": json.dumps({"error": "batchSize must be positive"})}
 
         # Connect to DB
         db_url = os.environ.get("DATABASE_URL") or os.environ.get("DATABASE_URL_DATABASE") or os.environ.get("DATABASE_URL")
         if not db_url:
             return {"statusCode": 500, "body": json.dumps({"error": "DATABASE_URL not set in environment"})}
 
-        conn = psycopg2.connect(db_url)
-        bulk_insert_transactions(conn, rows)
-        conn.close()
+        if source:
+            try:
+                jobs = load_jobs(source, user_id, account_id)
+            except ValueError as e:
+                return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+            report = ingest_batch(jobs, db_url, workers, writers, batch_size, payload.get("checkpoint"))
+            # files are parsed in worker processes, so only the totals reach this trace
+            tracing.add(rows_inserted=report.get("inserted", 0), rows_skipped=report.get("skipped", 0))
+            return {"statusCode": 200, "body": json.dumps(report)}
+
+        # read, clean and COPY the file batch by batch, committed as one transaction
+        with db_connection(db_url) as conn:
+            inserted, skipped = ingest_csv(conn, path, user_id, account_id, batch_size)
 
-        return {"statusCode": 200, "body": json.dumps({"inserted": len(rows)})}
+        return {"statusCode": 200, "body": json.dumps({"inserted": inserted, "skipped": skipped})}
     except Exception as e:
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
 
 
 # If run directly (for local testing)
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 1:
-        # Accept a path arg
-        p = sys.argv[1]
-        ev = {"body": json.dumps({"path": p, "userId": os.environ.get("TEST_USER_ID", "local-user"), "accountId": os.environ.get("TEST_ACCOUNT_ID", None)})}
+    import argparse
+    parser = argparse.ArgumentParser(description="Ingest one CSV, or a directory/manifest of CSVs in parallel")
+    parser.add_argument("path", nargs="?", help="CSV file to ingest")
+    parser.add_argument("--batch", help="directory of CSVs or manifest (JSON lines / CSV with path,userId[,accountId])")
+    parser.add_argument("--user", default=os.environ.get("TEST_USER_ID", "local-user"))
+    parser.add_argument("--account", default=os.environ.get("TEST_ACCOUNT_ID", None))
+    parser.add_argument("--workers", type=int, default=None, help="parse/clean processes (default: CPU count)")
+    parser.add_argument("--writers", type=int, default=None, help="concurrent DB writers (capped at DB_POOL_MAX)")
+    parser.add_argument("--checkpoint", default=None, help="JSON-lines progress file; completed files are skipped on rerun")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    args = parser.parse_args()
+    if args.batch:
+        jobs = load_jobs(args.batch, args.user, args.account)
+        report = ingest_batch(jobs, None, args.workers, args.writers, args.batch_size, args.checkpoint,
+                              on_result=lambda r: print(json.dumps(r), flush=True))
+        report.pop("results")
+        print(json.dumps(report))
+    elif args.path:
+        ev = {"body": json.dumps({"path": args.path, "userId": args.user, "accountId": args.account, "batchSize": args.batch_size})}
         r = handler(ev)
         print(r)
     else:
-        print("Usage: process_csv.py <path-to-csv>")
+        parser.print_usage()
@@ -1,111 +1,90 @@
+from __future__ import annotations
+
 import os
+import sys
 import json
-from typing import Dict, Any
-
-import polars as pl
-import psycopg2
-import lightgbm as lgb
-
-MODEL_PATH = os.path.join(os.getcwd(), "ml", "model.lgb")
-
-# helper functions copied/compatible with get_score
-
-def safe_div(a, b):
-    try:
-        if b == 0 or b is None:
-            return 0.0
-        return float(a) / float(b)
-    except Exception:
-        return 0.0
-
-FOOD_KEYS = ["zomato", "swiggy", "dominos", "restaurant", "cafe", "mcdonald", "food"]
-LOAN_KEYS = ["emi", "loan", "equated", "instalment", "installment"]
-
-
-def compute_features_from_df(df: pl.DataFrame) -> Dict[str, Any]:
-    if df.height == 0:
-        return {
-            "avg_monthly_income": 0.0,
-            "avg_monthly_expense": 0.0,
-            "savings_rate": 0.0,
-            "expense_to_income_ratio": 0.0,
-            "num_loan_payments": 0,
-            "pct_spend_on_food": 0.0,
-            "total_transactions": 0,
-        }
-
-    # parse date
-    if "date" in df.columns:
-        try:
-            df = df.with_column(pl.col("date").str.strptime(pl.Date, fmt=None).alias("date_parsed"))
-            df = df.with_column(pl.col("date_parsed").cast(pl.Datetime).alias("date"))
-        except Exception:
-            pass
-
-    if "amount" in df.columns:
-        df = df.with_column(pl.col("amount").cast(pl.Float64).alias("amount"))
-    else:
-        df = df.with_column(pl.lit(0.0).alias("amount"))
-
-    if "type" not in df.columns:
-        df = df.with_column(pl.when(pl.col("amount") >= 0).then("Credit").otherwise("Debit").alias("type"))
-
-    if "date" in df.columns:
-        df = df.with_column(pl.col("date").dt.strftime("%Y-%m").alias("month"))
-    else:
-        df = df.with_column(pl.lit("unknown").alias("month"))
+import math
+from typing import TYPE_CHECKING
+
+# polars/numpy are imported inside the functions that use them, so cold starts
+# and cheap paths (bad requests, feature-store reads) do not pay for them
+if TYPE_CHECKING:
+    import numpy as np
+    import polars as pl
+
+# sibling helper modules are underscore-prefixed so Vercel does not expose them as functions
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _runtime import db_connection  # noqa: E402
+import _tracing as tracing  # noqa: E402
+from _feature_store import FEATURE_SOURCE, SQL_SOURCES, read_features  # noqa: E402
+from _scoring import FEATURE_INDEX, FEATURE_NAMES, Features, compute_features_from_df, feature_matrix, predict_scores  # noqa: E402
+
+# largest what-if grid (product of the three axis lengths) one request may ask for
+GRID_MAX_POINTS = int(os.environ.get("SIMULATE_GRID_MAX", "10000"))
+
+# scenario inputs, each accepted in snake_case or camelCase
+SIM_KEYS = [("missed_payments", "missedPayments"), ("income_change", "incomeChange"), ("spending_increase", "spendingIncrease")]
+
+
+def _grid_range(spec: dict):
+    """(min, step, length) of a {min, max, step} range, validated without building it."""
+    lo, hi, step = float(spec.get("min", 0)), float(spec.get("max", 0)), float(spec.get("step", 1))
+    if not all(math.isfinite(v) for v in (lo, hi, step)) or step <= 0 or hi < lo:
+        raise ValueError("grid ranges need finite values, step > 0 and max >= min")
+    # half a step of slack so float steps still include max
+    n = (hi - lo) / step + 0.5
+    if not math.isfinite(n) or n > GRID_MAX_POINTS:
+        raise ValueError(f"grid range has more than {GRID_MAX_POINTS} points")
+    return lo, step, math.ceil(n)
+
+
+def axis_length(spec) -> int:
+    """Number of values grid_axis(spec) would return."""
+    if isinstance(spec, dict):
+        return _grid_range(spec)[2]
+    if isinstance(spec, (list, tuple)):
+        return len(spec)
+    return 1
+
+
+def grid_axis(spec) -> np.ndarray:
+    """Values of one grid axis: a list, a {min, max, step} range (max inclusive) or a single number."""
+    import numpy as np
+    if spec is None:
+        return np.zeros(1)
+    if isinstance(spec, dict):
+        lo, step, n = _grid_range(spec)
+        return lo + step * np.arange(n, dtype=np.float64)
+    if isinstance(spec, (list, tuple)):
+        if not spec:
+            raise ValueError("grid value lists must not be empty")
+        return np.asarray(spec, dtype=np.float64)
+    return np.asarray([spec], dtype=np.float64)
+
+
+def scenario_matrix(features: Features, missed: np.ndarray, income_change: np.ndarray, spending_increase: np.ndarray) -> np.ndarray:
+    """Model inputs for every (missed, income_change, spending_increase) combination, in C order."""
+    import numpy as np
+    m, inc, sp = np.meshgrid(np.trunc(missed), income_change, spending_increase, indexing="ij")
+    X = np.repeat(feature_matrix([features]), m.size, axis=0)
+    avg_inc = np.maximum(0.0, X[:, FEATURE_INDEX["avg_monthly_income"]] + inc.ravel())
+    avg_exp = X[:, FEATURE_INDEX["avg_monthly_expense"]] * (1.0 + sp.ravel() / 100.0)
+    has_inc = avg_inc != 0
+    safe_inc = np.where(has_inc, avg_inc, 1.0)
+    X[:, FEATURE_INDEX["avg_monthly_income"]] = avg_inc
+    X[:, FEATURE_INDEX["avg_monthly_expense"]] = avg_exp
+    X[:, FEATURE_INDEX["num_loan_payments"]] += m.ravel()
+    X[:, FEATURE_INDEX["savings_rate"]] = np.where(has_inc, (avg_inc - avg_exp) / safe_inc * 100.0, 0.0)
+    X[:, FEATURE_INDEX["expense_to_income_ratio"]] = np.where(has_inc, avg_exp / safe_inc, 0.0)
+    return X
 
-    monthly = df.groupby(["month", "type"]).agg(pl.col("amount").sum().alias("sum_amount"))
 
-    income_monthly_sums = []
-    expense_monthly_sums = []
-    try:
-        income = monthly.filter(pl.col("type") == "Credit")
-        expense = monthly.filter(pl.col("type") == "Debit")
-        income_monthly_sums = income.select("sum_amount").to_series().to_list()
-        expense_monthly_sums = expense.select("sum_amount").to_series().to_list()
-    except Exception:
-        pass
-
-    avg_monthly_income = float(sum(income_monthly_sums) / len(income_monthly_sums)) if income_monthly_sums else 0.0
-    avg_monthly_expense = float(sum(expense_monthly_sums) / len(expense_monthly_sums)) if expense_monthly_sums else 0.0
-
-    savings_rate = safe_div((avg_monthly_income - avg_monthly_expense), avg_monthly_income) * 100.0 if avg_monthly_income else 0.0
-    expense_to_income_ratio = safe_div(avg_monthly_expense, avg_monthly_income) if avg_monthly_income else 0.0
-
-    desc_col = df.get_column("description") if "description" in df.columns else pl.Series([""] * df.height)
-    desc_lower = desc_col.str.to_lowercase()
-    num_loan_payments = sum(any(k in (d or "") for k in LOAN_KEYS) for d in desc_lower.to_list())
-
-    debit_df = df.filter(pl.col("type") == "Debit")
-    total_debit = float(debit_df.select(pl.col("amount").abs().sum()).to_series()[0]) if debit_df.height > 0 else 0.0
-    food_mask = debit_df.filter(pl.col("description").str.to_lowercase().map(lambda s: any(k in (s or "") for k in FOOD_KEYS))) if debit_df.height > 0 else pl.DataFrame([])
-    food_spend = float(food_mask.select(pl.col("amount").abs().sum()).to_series()[0]) if (debit_df.height > 0 and food_mask.height > 0) else 0.0
-    pct_spend_on_food = safe_div(food_spend, total_debit) * 100.0 if total_debit else 0.0
-
-    return {
-        "avg_monthly_income": avg_monthly_income,
-        "avg_monthly_expense": avg_monthly_expense,
-        "savings_rate": savings_rate,
-        "expense_to_income_ratio": expense_to_income_ratio,
-        "num_loan_payments": int(num_loan_payments),
-        "pct_spend_on_food": pct_spend_on_food,
-        "total_transactions": int(df.height),
-    }
-
-
-def load_model():
-    if os.path.exists(MODEL_PATH):
-        try:
-            bst = lgb.Booster(model_file=MODEL_PATH)
-            return bst
-        except Exception as e:
-            print("Failed to load model:", e)
-            return None
-    return None
+def handler(event, context=None):
+    with tracing.request("simulate") as trace:
+        return trace.respond(_handle(event))
 
 
-def handler(event, context=None):
+def _handle(event):
     try:
         body = None
         if isinstance(event, dict):
@@ -113,76 +92,93 @@ def handler(event, context=None):
         if not body:
             return {"statusCode": 400, "body": json.dumps({"error": "Missing body"})}
         payload = json.loads(body)
+        tracing.include_timings(payload.get("timings"))
         user_email = payload.get("userEmail")
         user_id = payload.get("userId")
         sim = payload.get("simulation") or {}
+        grid = payload.get("grid")
+
+        import numpy as np
+
+        # Simulation keys: missed_payments, income_change, spending_increase (percent);
+        # grid mode takes a list or {min, max, step} range for each instead of one value
+        try:
+            if grid is not None:
+                if not isinstance(grid, dict):
+                    raise ValueError("grid must be an object")
+                specs = [grid.get(k, grid.get(camel)) for k, camel in SIM_KEYS]
+                # sized before anything is allocated, so a huge range costs nothing
+                points = math.prod(axis_length(spec) for spec in specs)
+                if points > GRID_MAX_POINTS:
+                    raise ValueError(f"grid has {points} points, limit is {GRID_MAX_POINTS}")
+                axes = [grid_axis(spec) for spec in specs]
+            else:
+                axes = [np.array([int(sim.get("missed_payments") or sim.get("missedPayments") or 0)], dtype=np.float64),
+                        np.array([float(sim.get("income_change") or sim.get("incomeChange") or 0)]),
+                        np.array([float(sim.get("spending_increase") or sim.get("spendingIncrease") or 0)])]
+        except (TypeError, ValueError) as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
 
         db_url = os.environ.get("DATABASE_URL")
         if not db_url:
             return {"statusCode": 500, "body": json.dumps({"error": "DATABASE_URL not set"})}
 
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
-
-        if user_id is None:
-            if not user_email:
-                return {"statusCode": 400, "body": json.dumps({"error": "userId or userEmail required"})}
-            cur.execute('SELECT id FROM "User" WHERE email = %s LIMIT 1', (user_email,))
-            row = cur.fetchone()
-            if not row:
-                return {"statusCode": 404, "body": json.dumps({"error": "User not found"})}
-            user_id = row[0]
-
-        cur.execute('SELECT date, description, amount, type FROM "Transaction" WHERE "userId" = %s ORDER BY date ASC', (user_id,))
-        rows = cur.fetchall()
-        conn.close()
-
-        if not rows:
-            df = pl.DataFrame([])
-        else:
-            df = pl.DataFrame(rows, schema=["date", "description", "amount", "type"])
-
-        features = compute_features_from_df(df)
-
-        # Apply simulation adjustments
-        # Example simulation keys: missed_payments, income_change, spending_increase (percent)
-        missed = int(sim.get("missed_payments") or sim.get("missedPayments") or 0)
-        income_change = float(sim.get("income_change") or sim.get("incomeChange") or 0)
-        spending_increase = float(sim.get("spending_increase") or sim.get("spendingIncrease") or 0)
-
-        # Adjust features accordingly
-        # Increase avg monthly income
-        features["avg_monthly_income"] = max(0.0, features.get("avg_monthly_income", 0.0) + income_change)
-        # Missed payments increases num_loan_payments or penalizes score; increment loan payments
-        features["num_loan_payments"] = int(features.get("num_loan_payments", 0) + missed)
-        # Spending increase: increase avg_monthly_expense by percent
-        features["avg_monthly_expense"] = features.get("avg_monthly_expense", 0.0) * (1.0 + spending_increase / 100.0)
-
-        # Recompute derived features
-        avg_inc = features["avg_monthly_income"]
-        avg_exp = features["avg_monthly_expense"]
-        features["savings_rate"] = safe_div((avg_inc - avg_exp), avg_inc) * 100.0 if avg_inc else 0.0
-        features["expense_to_income_ratio"] = safe_div(avg_exp, avg_inc) if avg_inc else 0.0
-
-        model = load_model()
-        score = None
-        if model is not None:
-            feat_names = ["avg_monthly_income", "avg_monthly_expense", "savings_rate", "expense_to_income_ratio", "num_loan_payments", "pct_spend_on_food", "total_transactions"]
-            X = [[features.get(n, 0.0) for n in feat_names]]
-            pred = model.predict(X)
-            try:
-                score = float(pred[0])
-            except Exception:
-                score = float(pred)
+        with db_connection(db_url) as conn:
+            cur = conn.cursor()
+
+            if user_id is None:
+                if not user_email:
+                    return {"statusCode": 400, "body": json.dumps({"error": "userId or userEmail required"})}
+                with tracing.stage("resolve_user"):
+                    cur.execute('SELECT id FROM "User" WHERE email = %s LIMIT 1', (user_email,))
+                    row = cur.fetchone()
+                if not row:
+                    return {"statusCode": 404, "body": json.dumps({"error": "User not found"})}
+                user_id = row[0]
+
+            with tracing.stage("fetch"):
+                stored = read_features(cur, user_id, FEATURE_SOURCE) if FEATURE_SOURCE in SQL_SOURCES else None
+                if stored is None:
+                    cur.execute('SELECT date, description, amount, type FROM "Transaction" WHERE "userId" = %s ORDER BY date ASC', (user_id,))
+                    rows = cur.fetchall()
+                    tracing.add(rows_fetched=len(rows))
+
+        if stored is not None:
+            features = stored
         else:
-            # heuristic fallback
-            base = 600
-            base += min(200, int(features["savings_rate"] * 2))
-            base += max(-100, int((1 - features["expense_to_income_ratio"]) * 50))
-            base += max(-50, 50 - features["num_loan_payments"] * 10)
-            score = max(300, min(850, base))
-
-        return {"statusCode": 200, "body": json.dumps({"simulatedScore": int(round(score)), "features": features})}
+            with tracing.stage("features"):
+                import polars as pl
+                if not rows:
+                    df = pl.DataFrame([])
+                else:
+                    df = pl.DataFrame(rows, schema=["date", "description", "amount", "type"])
+                    tracing.add(bytes_fetched=df.estimated_size())
+                features = compute_features_from_df(df)
+
+        # Apply simulation adjustments: every scenario becomes one row of X, scored in a single predict
+        with tracing.stage("scenarios"):
+            X = scenario_matrix(features, *axes)
+        tracing.add(scenarios=len(X))
+        scores = np.rint(predict_scores(X)).astype(int)
+
+        if grid is not None:
+            surface = {
+                "axes": {k: a.tolist() for (k, _), a in zip(SIM_KEYS, axes)},
+                # scores[i][j][k] is the score for missed_payments[i], income_change[j], spending_increase[k]
+                "scores": scores.reshape([len(a) for a in axes]).tolist(),
+                "baseFeatures": features,
+            }
+            return {"statusCode": 200, "body": json.dumps(surface)}
+
+        # single scenario: report the adjusted features alongside the score
+        features = dict(features)
+        for i, n in enumerate(FEATURE_NAMES):
+            if n in ("avg_monthly_income", "avg_monthly_expense", "savings_rate", "expense_to_income_ratio"):
+                features[n] = float(X[0, i])
+        features["num_loan_payments"] = int(X[0, FEATURE_INDEX["num_loan_payments"]])
+        score = scores[0]
+
+        return {"statusCode": 200, "body": json.dumps({"simulatedScore": int(score), "features": features})}
     except Exception as e:
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
 
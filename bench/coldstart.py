@@ -0,0 +1,137 @@
+"""Cold-start timings for the api/python handlers.
+
+Every sample runs in a fresh interpreter, the way a serverless cold start
+does. The child imports the handler module, calls handler() once with a
+request that is rejected before any work is done (no body), and optionally
+makes one real request. --ref benchmarks the handlers as of a git revision
+too, extracted with `git archive`, for a before/after table. --importtime adds
+a per-module report from `python -X importtime` for each handler.
+
+    python bench/coldstart.py --ref HEAD~1 --repeat 5
+    DATABASE_URL=... python bench/coldstart.py --user <userId> --importtime
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLERS = ["get_score", "simulate", "process_csv"]
+
+# runs inside the child; timings in milliseconds
+CHILD = r"""
+import json, sys, time
+name, api_dir, body = sys.argv[1], sys.argv[2], sys.argv[3]
+t0 = time.perf_counter()
+sys.path.insert(0, api_dir)
+mod = __import__(name)
+t1 = time.perf_counter()
+mod.handler({})
+t2 = time.perf_counter()
+out = {"import_ms": (t1 - t0) * 1e3, "reject_ms": (t2 - t1) * 1e3}
+if body:
+    r = mod.handler({"body": body})
+    out["request_ms"] = (time.perf_counter() - t2) * 1e3
+    out["status"] = r.get("statusCode")
+print(json.dumps(out))
+"""
+
+
+def request_body(name: str, args) -> str:
+    if name == "process_csv":
+        return json.dumps({"path": os.path.abspath(args.ingest_csv), "userId": args.user}) if args.ingest_csv else ""
+    if not args.user or not os.environ.get("DATABASE_URL"):
+        return ""
+    if name == "simulate":
+        return json.dumps({"userId": args.user, "simulation": {"missed_payments": 1}})
+    return json.dumps({"userId": args.user})
+
+
+def sample(tree: str, name: str, body: str) -> dict:
+    # run from the tree root so ml/model.lgb resolves as it does in the app
+    res = subprocess.run([sys.executable, "-c", CHILD, name, os.path.join(tree, "api", "python"), body],
+                         cwd=tree, capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def import_report(tree: str, name: str, top: int):
+    """(handler ms, [(module, self ms, cumulative ms), ...]) for the handler's slowest direct imports."""
+    code = f"import sys; sys.path.insert(0, {os.path.join(tree, 'api', 'python')!r}); import {name}"
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=tree, capture_output=True, text=True, check=True)
+    rows, pending, total = [], [], 0.0
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, module = line[len("import time:"):].split("|")
+        # nesting is two spaces of indent per level, and a module's imports are
+        # listed before it, so level-1 rows collect until their parent appears
+        level = (len(module) - len(module.lstrip()) - 1) // 2
+        if level == 1:
+            pending.append((module.strip(), int(self_us) / 1e3, int(cum_us) / 1e3))
+        elif level == 0:
+            if module.strip() == name:
+                total, rows = int(cum_us) / 1e3, pending
+            pending = []
+    return total, sorted(rows, key=lambda r: -r[2])[:top]
+
+
+def checkout(ref: str, dest: str):
+    archive = subprocess.run(["git", "archive", ref, "api/python", "ml"], cwd=ROOT, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", dest], input=archive.stdout, check=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--ref", help="git revision to compare against the working tree")
+    p.add_argument("--repeat", type=int, default=5, help="fresh interpreters per handler (median is reported)")
+    p.add_argument("--handlers", nargs="+", default=HANDLERS, choices=HANDLERS)
+    p.add_argument("--user", help="userId for a real get_score/simulate request (needs DATABASE_URL)")
+    p.add_argument("--ingest-csv", help="CSV to send through process_csv as a real request")
+    p.add_argument("--importtime", action="store_true", help="print the slowest imports per handler")
+    p.add_argument("--top", type=int, default=8)
+    p.add_argument("--json", help="also write the results to this file")
+    args = p.parse_args()
+
+    trees = [("worktree", ROOT)]
+    tmp = None
+    if args.ref:
+        tmp = tempfile.TemporaryDirectory()
+        checkout(args.ref, tmp.name)
+        trees.insert(0, (args.ref, tmp.name))
+
+    results = []
+    print(f"{'handler':<12} {'tree':<10} {'import ms':>10} {'reject ms':>10} {'request ms':>11} {'first ms':>9}")
+    for name in args.handlers:
+        body = request_body(name, args)
+        for label, tree in trees:
+            runs = [sample(tree, name, body) for _ in range(args.repeat)]
+            row = {"handler": name, "tree": label}
+            for key in ("import_ms", "reject_ms", "request_ms"):
+                vals = [r[key] for r in runs if key in r]
+                row[key] = round(statistics.median(vals), 2) if vals else None
+            results.append(row)
+            # first ms: import plus the first real request, what a cold user-facing call costs
+            row["first_ms"] = round(row["import_ms"] + row["request_ms"], 2) if row["request_ms"] is not None else None
+            request = f"{row['request_ms']:>11.1f} {row['first_ms']:>9.1f}" if row["request_ms"] is not None else f"{'-':>11} {'-':>9}"
+            print(f"{name:<12} {label:<10} {row['import_ms']:>10.1f} {row['reject_ms']:>10.1f} {request}")
+
+    if args.importtime:
+        for name in args.handlers:
+            for label, tree in trees:
+                total, rows = import_report(tree, name, args.top)
+                print(f"\n{name} @ {label}: {total:.1f} ms to import")
+                for module, self_ms, cum_ms in rows:
+                    print(f"  {cum_ms:>8.1f} ms cumulative {self_ms:>7.1f} ms self  {module}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
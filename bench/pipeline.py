@@ -0,0 +1,463 @@
+"""Scale-tiered timings and peak memory for the ml pipeline and the api handlers' data paths.
+
+Each tier is a row count (10k, 1m, 10m). Its inputs are built once under
+--data-dir with ml/mock_data.py: a customer-month panel of that many rows,
+its features, and a bank-statement CSV of that many transactions. Every
+(tier, stage) sample then runs in a fresh interpreter that loads its input
+first and times only the stage itself, so imports and input I/O are not
+counted. Memory is the RSS high-water mark above the pre-stage baseline,
+sampled while the stage runs (it includes polars/Arrow/LightGBM native
+allocations, which tracemalloc does not see).
+
+    python bench/pipeline.py --tiers 10k 1m --repeat 3 --out bench-before.json
+    python bench/pipeline.py --tiers 10k 1m --repeat 3 --out bench-after.json --compare bench-before.json
+    python bench/pipeline.py --compare bench-before.json --against bench-after.json
+
+Stages:
+  generate     mock_data.generate for the tier's panel
+  features     features.compute_features over the panel
+  train        train.train on the features (no Dataset cache; --train-sample, default panel)
+  clean        process_csv.clean_dataframe over the statement CSV
+  ingest       process_csv.ingest_csv: batched read, clean, COPY and insert
+  score        compute_features_from_df + score_one, all rows as one user (the get_score path)
+  score_batch  compute_features_grouped + predict_scores, about 200 rows per user
+
+ingest writes to an in-memory stand-in for the psycopg2 connection. It
+serializes and counts the COPY data but runs no SQL. Pass --dsn (or set
+BENCH_DATABASE_URL) and --user to insert into a real Postgres instead.
+Repeated runs against the same database then measure the deduplicating
+re-upload path after the first one.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ML_DIR = os.path.join(ROOT, "ml")
+API_DIR = os.path.join(ROOT, "api", "python")
+
+TIERS = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+STAGES = ["generate", "features", "train", "clean", "ingest", "score", "score_batch"]
+MONTHS = 24
+ROWS_PER_USER = 200
+# bump when the generated inputs change, so stale tier data is rebuilt
+DATA_VERSION = 1
+# time changes below this many seconds are noise, whatever the ratio
+NOISE_SECONDS = 0.05
+NOISE_MB = 5.0
+
+# (description, type, low amount, high amount, weight) for synthetic statement rows
+STATEMENT_ROWS = [
+    ("Salary Credit ACME Pvt Ltd", "credit", 30000, 90000, 2),
+    ("Freelance Project Payment", "credit", 2000, 20000, 1),
+    ("Zomato Order", "debit", 150, 900, 8),
+    ("Swiggy Instamart", "debit", 200, 1500, 6),
+    ("Cafe Coffee Day", "debit", 120, 600, 4),
+    ("EMI Home Loan Instalment", "debit", 8000, 25000, 1),
+    ("Uber Ride", "debit", 90, 700, 6),
+    ("Electricity Bill BESCOM", "debit", 600, 3500, 1),
+    ("Amazon Shopping", "debit", 300, 6000, 5),
+    ("Apollo Pharmacy", "debit", 100, 2500, 2),
+    ("Netflix Subscription", "debit", 199, 649, 1),
+    ("UPI Transfer", "debit", 50, 5000, 8),
+    ("ATM Cash Withdrawal", "debit", 500, 10000, 2),
+    ("Interest Credit", "credit", 10, 900, 1),
+]
+
+
+# --- in-memory database stand-in ----------------------------------------------------------------
+
+class MemoryCursor:
+    """Cursor that accepts process_csv's staging SQL and COPY without a server."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.statements += 1
+        # the move statement reports (staged, inserted, users); everything staged counts as new
+        self._result = (self.conn.staged, self.conn.staged, [])
+
+    def copy_expert(self, sql, file):
+        data = file.read()
+        self.conn.copy_bytes += len(data)
+        # one header line per COPY
+        self.conn.staged += max(0, data.count(b"\n") - 1)
+
+    def fetchone(self):
+        return self._result
+
+    def fetchall(self):
+        return [self._result] if self._result is not None else []
+
+    def close(self):
+        pass
+
+
+class MemoryConnection:
+    """psycopg2-shaped connection that keeps only counters."""
+
+    def __init__(self):
+        self.statements = 0
+        self.copy_bytes = 0
+        self.staged = 0
+        self.commits = 0
+
+    def cursor(self):
+        return MemoryCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.staged = 0
+
+    def close(self):
+        pass
+
+
+# --- tier inputs ---------------------------------------------------------------------------------
+
+def _import_paths():
+    for path in (ML_DIR, API_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def tier_dir(data_dir: str, tier: str, seed: int) -> str:
+    return os.path.join(data_dir, f"{tier}-seed{seed}-v{DATA_VERSION}")
+
+
+def statement_frame(rows: int, seed: int):
+    """Synthetic bank statement of `rows` transactions over two years, as a polars DataFrame."""
+    import numpy as np
+    import polars as pl
+    rng = np.random.default_rng(seed)
+    weights = np.array([r[4] for r in STATEMENT_ROWS], dtype=np.float64)
+    kind = rng.choice(len(STATEMENT_ROWS), size=rows, p=weights / weights.sum())
+    low = np.array([r[2] for r in STATEMENT_ROWS])[kind]
+    high = np.array([r[3] for r in STATEMENT_ROWS])[kind]
+    days = rng.integers(0, 730, size=rows)
+    dates = (np.datetime64("2023-01-01") + days).astype("datetime64[D]")
+    ref = rng.integers(10**8, 10**9, size=rows)
+    return pl.DataFrame({
+        "date": dates.astype(str),
+        # a reference number in the narration keeps descriptions mostly unique, like real statements
+        "description": pl.Series(np.array([r[0] for r in STATEMENT_ROWS])[kind]) + " REF" + pl.Series(ref.astype(str)),
+        "amount": np.round(rng.uniform(low, high), 2),
+        "type": np.array([r[1] for r in STATEMENT_ROWS])[kind],
+        "reference": ref.astype(str),
+    })
+
+
+def prepare(tier: str, data_dir: str, seed: int) -> str:
+    """Build the tier's inputs if they are not already on disk; returns the tier directory."""
+    _import_paths()
+    out = tier_dir(data_dir, tier, seed)
+    done = os.path.join(out, "READY")
+    if os.path.exists(done):
+        return out
+    import numpy as np
+    import polars as pl
+    import mock_data
+    import features
+    from schema import write_table
+    import process_csv
+
+    os.makedirs(out, exist_ok=True)
+    rows = TIERS[tier]
+    t0 = time.perf_counter()
+    raw = mock_data.generate(n_customers=max(1, rows // MONTHS), months=MONTHS, seed=seed)
+    write_table(raw, os.path.join(out, "raw.parquet"), "raw")
+    write_table(features.compute_features(raw), os.path.join(out, "features.parquet"), "features")
+    del raw
+    statement = statement_frame(rows, seed)
+    statement.write_csv(os.path.join(out, "statement.csv"))
+    users = pl.Series("userId", np.char.add("bench-", (np.arange(rows) % max(1, rows // ROWS_PER_USER)).astype(str)))
+    process_csv.clean_dataframe(statement).with_columns([users]).write_parquet(os.path.join(out, "statement.parquet"))
+    with open(done, "w") as f:
+        f.write(json.dumps({"rows": rows, "seed": seed, "seconds": round(time.perf_counter() - t0, 2)}))
+    print(f"prepared {tier} in {time.perf_counter() - t0:.1f} s: {out}", file=sys.stderr)
+    return out
+
+
+# --- child: one timed stage ----------------------------------------------------------------------
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # no procfs: fall back to the high-water mark, which only ever grows
+        return _maxrss_bytes()
+
+
+def _maxrss_bytes() -> int:
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform == "darwin" else r * 1024
+
+
+class PeakSampler:
+    """Poll RSS on a thread and remember the highest value seen."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def setup_stage(stage: str, tier: str, tdir: str, args):
+    """Import what the stage needs and load its input; returns a zero-argument callable to time."""
+    _import_paths()
+    rows = TIERS[tier]
+    if stage == "generate":
+        import mock_data
+        return lambda: {"rows": len(mock_data.generate(n_customers=max(1, rows // MONTHS), months=MONTHS, seed=args.seed))}
+    if stage == "features":
+        import features
+        from schema import read_table
+        raw = read_table(os.path.join(tdir, "raw.parquet"))
+        return lambda: {"rows": len(features.compute_features(raw))}
+    if stage == "train":
+        import tempfile
+        import train
+        out = tempfile.mkdtemp()
+
+        def run():
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                train.train(os.path.join(tdir, "features.parquet"), os.path.join(out, "model.txt"), cache_dir=None,
+                            sample=args.train_sample, sample_rate=args.train_sample_rate)
+            return {"sample": args.train_sample}
+        return run
+    if stage == "clean":
+        import polars as pl
+        import process_csv
+        df = pl.read_csv(os.path.join(tdir, "statement.csv"))
+        return lambda: {"rows": process_csv.clean_dataframe(df).height}
+    if stage == "ingest":
+        import process_csv
+        path = os.path.join(tdir, "statement.csv")
+        if args.dsn:
+            import psycopg2
+
+            def run():
+                conn = psycopg2.connect(args.dsn)
+                try:
+                    inserted, skipped = process_csv.ingest_csv(conn, path, args.user)
+                finally:
+                    conn.close()
+                return {"inserted": inserted, "skipped": skipped, "db": "postgres"}
+            return run
+
+        def run():
+            conn = MemoryConnection()
+            inserted, skipped = process_csv.ingest_csv(conn, path, args.user or "bench-user")
+            return {"inserted": inserted, "skipped": skipped, "copy_mb": round(conn.copy_bytes / 2**20, 1), "db": "memory"}
+        return run
+    if stage == "score":
+        import polars as pl
+        from _scoring import compute_features_from_df, score_one
+        df = pl.read_parquet(os.path.join(tdir, "statement.parquet"), columns=["date", "description", "amount", "type"])
+        return lambda: {"score": round(float(score_one(compute_features_from_df(df))), 4)}
+    if stage == "score_batch":
+        import numpy as np
+        import polars as pl
+        from _scoring import FEATURE_NAMES, compute_features_grouped, predict_scores
+        df = pl.read_parquet(os.path.join(tdir, "statement.parquet"), columns=["userId", "date", "description", "amount", "type"])
+
+        def run():
+            feats = compute_features_grouped(df)
+            scores = predict_scores(feats.select(FEATURE_NAMES).to_numpy().astype(np.float64))
+            return {"users": feats.height, "mean_score": round(float(np.mean(scores)), 4)}
+        return run
+    raise ValueError(f"unknown stage {stage}")
+
+
+def run_child(args):
+    import gc
+    tdir = tier_dir(args.data_dir, args.tier, args.seed)
+    fn = setup_stage(args.child, args.tier, tdir, args)
+    gc.collect()
+    base = _rss_bytes()
+    with PeakSampler() as sampler:
+        t0 = time.perf_counter()
+        info = fn()
+        seconds = time.perf_counter() - t0
+    print(json.dumps({
+        "seconds": seconds,
+        "stage_mb": max(0, sampler.peak - base) / 2**20,
+        # not ru_maxrss: on Linux it carries over the parent's high-water mark through fork/exec
+        "peak_rss_mb": sampler.peak / 2**20,
+        "info": info,
+    }))
+
+
+# --- parent: run, report, compare ----------------------------------------------------------------
+
+def sample(stage: str, tier: str, args) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", stage, "--tier", tier, "--data-dir", args.data_dir,
+           "--seed", str(args.seed), "--train-sample", args.train_sample, "--train-sample-rate", str(args.train_sample_rate)]
+    if args.dsn:
+        cmd += ["--dsn", args.dsn]
+    if args.user:
+        cmd += ["--user", args.user]
+    # run from the repo root so ml/model.lgb resolves as it does in the app
+    res = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(f"{tier}/{stage} failed:\n{res.stderr[-2000:]}")
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def environment() -> dict:
+    from importlib import metadata
+    versions = {}
+    for pkg in ("numpy", "pandas", "polars", "pyarrow", "lightgbm", "psycopg2-binary", "psycopg2"):
+        try:
+            versions[pkg] = metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            pass
+
+    def git(*a):
+        try:
+            return subprocess.run(["git", *a], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "packages": versions,
+        "model": os.path.exists(os.path.join(ROOT, "ml", "model.lgb")),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def run_suite(args) -> dict:
+    results = []
+    print(f"{'tier':<5} {'stage':<12} {'rows':>10} {'median s':>9} {'min s':>8} {'stage MB':>9} {'peak MB':>8}")
+    for tier in args.tiers:
+        prepare(tier, args.data_dir, args.seed)
+        for stage in args.stages:
+            runs = [sample(stage, tier, args) for _ in range(args.repeat)]
+            secs = [r["seconds"] for r in runs]
+            row = {
+                "tier": tier,
+                "stage": stage,
+                "rows": TIERS[tier],
+                "seconds": round(statistics.median(secs), 4),
+                "min_seconds": round(min(secs), 4),
+                "samples": [round(s, 4) for s in secs],
+                "stage_mb": round(max(r["stage_mb"] for r in runs), 1),
+                "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+                "info": runs[-1]["info"],
+            }
+            results.append(row)
+            print(f"{tier:<5} {stage:<12} {row['rows']:>10} {row['seconds']:>9.3f} {row['min_seconds']:>8.3f} "
+                  f"{row['stage_mb']:>9.1f} {row['peak_rss_mb']:>8.1f}")
+    return {
+        "environment": environment(),
+        "config": {"repeat": args.repeat, "seed": args.seed, "train_sample": args.train_sample,
+                   "train_sample_rate": args.train_sample_rate, "db": "postgres" if args.dsn else "memory",
+                   "data_version": DATA_VERSION},
+        "results": results,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """Print new vs base per (tier, stage); returns the rows that got slower or bigger beyond `threshold`."""
+    before = {(r["tier"], r["stage"]): r for r in base["results"]}
+    regressions = []
+    print(f"\n{'tier':<5} {'stage':<12} {'base s':>8} {'new s':>8} {'time':>7} {'base MB':>8} {'new MB':>8} {'mem':>7}")
+    for r in new["results"]:
+        b = before.get((r["tier"], r["stage"]))
+        if b is None:
+            continue
+        t_ratio = r["seconds"] / b["seconds"] if b["seconds"] else float("inf")
+        m_ratio = r["stage_mb"] / b["stage_mb"] if b["stage_mb"] else float("inf") if r["stage_mb"] else 1.0
+        slower = t_ratio > 1 + threshold and r["seconds"] - b["seconds"] > NOISE_SECONDS
+        bigger = m_ratio > 1 + threshold and r["stage_mb"] - b["stage_mb"] > NOISE_MB
+        flag = " ".join(f for f, on in (("SLOWER", slower), ("MORE-MEMORY", bigger)) if on)
+        if flag:
+            regressions.append(r)
+        print(f"{r['tier']:<5} {r['stage']:<12} {b['seconds']:>8.3f} {r['seconds']:>8.3f} {t_ratio:>6.2f}x "
+              f"{b['stage_mb']:>8.1f} {r['stage_mb']:>8.1f} {m_ratio:>6.2f}x {flag}")
+    changed = {k: (base["config"].get(k), v) for k, v in new["config"].items() if base["config"].get(k) != v}
+    if changed:
+        print("note: the runs used different settings:", ", ".join(f"{k} {a} -> {b}" for k, (a, b) in changed.items()))
+    for label, env in (("base", base["environment"]), ("new", new["environment"])):
+        print(f"{label}: {(env.get('commit') or '?')[:10]}{' (dirty)' if env.get('dirty') else ''} {env.get('time')}")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--tiers", nargs="+", default=["10k", "1m"], choices=list(TIERS))
+    p.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    p.add_argument("--repeat", type=int, default=3, help="fresh interpreters per stage (median time, max memory)")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--data-dir", default=os.path.join(ROOT, "bench", ".data"), help="where tier inputs are built and kept")
+    p.add_argument("--train-sample", default="panel", choices=["latest", "panel"])
+    p.add_argument("--train-sample-rate", type=float, default=1.0)
+    p.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL"), help="ingest into this Postgres instead of the in-memory stand-in")
+    p.add_argument("--user", help="userId owning the ingested rows (must exist with --dsn)")
+    p.add_argument("--out", help="write the results as JSON to this file")
+    p.add_argument("--compare", help="baseline JSON to compare against")
+    p.add_argument("--against", help="with --compare: compare this results file instead of running")
+    p.add_argument("--threshold", type=float, default=0.10, help="relative slowdown/growth reported as a regression")
+    p.add_argument("--child", choices=STAGES, help=argparse.SUPPRESS)
+    p.add_argument("--tier", choices=list(TIERS), help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+    if args.against:
+        if not args.compare:
+            p.error("--against needs --compare")
+        with open(args.compare) as f, open(args.against) as g:
+            sys.exit(1 if compare(json.load(f), json.load(g), args.threshold) else 0)
+
+    report = run_suite(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.exit(1 if compare(json.load(f), report, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,262 @@
 """Feature engineering utilities for credit rating using pandas."""
 import argparse
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 
+from schema import (
+    FEATURES, RAW_COLUMNS, IpcPartitionWriter, TableWriter, iter_table, read_ipc, read_state, read_table,
+    write_ipc, write_state, write_table,
+)
+
+# longest rolling window is 12 months, so 11 prior rows reproduce it exactly
+HISTORY_MONTHS = 11
+
+# carried-over state: recent raw rows plus per-customer recency anchors
+STATE_COLUMNS = RAW_COLUMNS + ['first_month', 'last_payment_month']
+
+DAYS_PER_MONTH = 30.44
+
+
+def _shift(values: np.ndarray, k: int) -> np.ndarray:
+    """Shift a float array down by k rows, padding the top with NaN."""
+    if k == 0:
+        return values
+    out = np.full(len(values), np.nan)
+    out[k:] = values[:-k]
+    return out
+
+
+def _rolling_sum(values: np.ndarray, pos: np.ndarray, window: int):
+    """Sum and count of non-NaN values over each customer's trailing window.
+
+    `pos` is the 0-based row position within the customer, so lag k only
+    contributes where pos >= k and windows never cross customer boundaries.
+    """
+    total = np.zeros(len(values))
+    count = np.zeros(len(values))
+    for k in range(window):
+        lag = _shift(values, k)
+        ok = (pos >= k) & ~np.isnan(lag)
+        total += np.where(ok, lag, 0.0)
+        count += ok
+    return total, count
+
+
+def _rolling_mean(values, pos, window):
+    total, count = _rolling_sum(values, pos, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def _rolling_std(values, pos, window):
+    """Sample standard deviation (ddof=1), two-pass so flat windows give exactly 0."""
+    mean = _rolling_mean(values, pos, window)
+    sq = np.zeros(len(values))
+    count = np.zeros(len(values))
+    for k in range(window):
+        lag = _shift(values, k)
+        ok = (pos >= k) & ~np.isnan(lag)
+        sq += np.where(ok, (lag - mean) ** 2, 0.0)
+        count += ok
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 1, np.sqrt(sq / (count - 1)), np.nan)
+
+
+def _rolling_max(values, pos, window):
+    out = np.full(len(values), np.nan)
+    for k in range(window):
+        out = np.where(pos >= k, np.fmax(out, _shift(values, k)), out)
+    return out
+
+
+def _rolling_slope(values, pos, window):
+    """Closed-form OLS slope of values against 0..n-1 over the trailing window.
+
+    For n points at x = 0..n-1 the centred x has sum of squares n(n^2-1)/12,
+    so the slope is sum((x - xbar) * y) / (n(n^2-1)/12), the same value
+    np.polyfit(np.arange(n), y, 1)[0] returns.
+    """
+    n = np.minimum(pos + 1, window).astype(float)
+    xbar = (n - 1) / 2
+    num = np.zeros(len(values))
+    for k in range(window):
+        ok = pos >= k
+        x = n - 1 - k
+        num += np.where(ok, (x - xbar) * _shift(values, k), 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n >= 2, num / (n * (n ** 2 - 1) / 12), np.nan)
+
+
+def _months_between(later: np.ndarray, earlier: np.ndarray) -> np.ndarray:
+    days = (later - earlier).astype('timedelta64[D]').astype(float)
+    return days / DAYS_PER_MONTH
+
+
+def _compute(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized feature pass returning the sorted working frame.
+
+    Besides the feature columns, every row gets `first_month` (the customer's
+    first month) and `last_payment_month` (latest month with a payment up to
+    and including that row). If the input already carries those columns on
+    the leading rows of a customer -- carried-over history rows -- they seed
+    the recency features for activity older than the rows present.
+    """
+    df = df.copy()
+    df['month'] = pd.to_datetime(df['month'])
+    df = df.sort_values(['cust_id', 'month'])
+
+    cust = df['cust_id'].to_numpy()
+    month = df['month'].to_numpy()
+    n = len(df)
+    idx = np.arange(n)
+    new_cust = np.ones(n, dtype=bool)
+    new_cust[1:] = cust[1:] != cust[:-1]
+    start = np.maximum.accumulate(np.where(new_cust, idx, 0))
+    pos = idx - start
+
+    # basic ratios
+    df['utilization'] = df['balance'] / df['credit_limit'].replace(0, np.nan)
+    df['dti'] = df['balance'] / df['income'].replace(0, np.nan)
+    util = df['utilization'].to_numpy(dtype=float)
+    balance = df['balance'].to_numpy(dtype=float)
+
+    # rolling aggregates per customer
+    df['util_3m_mean'] = _rolling_mean(util, pos, 3)
+    df['util_6m_std'] = np.nan_to_num(_rolling_std(util, pos, 6), nan=0.0)
+    df['balance_3m_slope'] = _rolling_slope(balance, pos, 6)
+
+    # payment behavior
+    df['payment_to_balance'] = df['payment'] / df['balance'].replace(0, np.nan)
+    on_time = (df['days_past_due'] == 0).to_numpy(dtype=float)
+    df['on_time_ratio_6m'] = _rolling_mean(on_time, pos, 6)
+    dpd = df['days_past_due'].to_numpy(dtype=float)
+    df['max_days_past_due_12m'] = np.nan_to_num(_rolling_max(dpd, pos, 12), nan=0.0)
+
+    # inquiries and new accounts
+    inquiries, inquiries_n = _rolling_sum(df['inquiries'].to_numpy(dtype=float), pos, 3)
+    df['inquiries_3m'] = np.where(inquiries_n > 0, inquiries, np.nan)
+    open_accounts = df['open_accounts'].to_numpy(dtype=float)
+    first_in_window = open_accounts[idx - np.minimum(pos, 5)]
+    df['new_accounts_6m'] = np.maximum(0.0, open_accounts - first_in_window)
+
+    # recency features, seeded from carried-over history where present
+    first_seed = _seed(df, 'first_month', start)
+    first_month = np.where(np.isnat(first_seed), month[start], first_seed)
+    df['months_since_first'] = _months_between(month, first_month)
+
+    paid = np.where(df['payment'].to_numpy() > 0, idx, -1)
+    last_pay = np.maximum.accumulate(paid)
+    has_paid = last_pay >= start
+    last_payment_month = np.where(has_paid, month[np.where(has_paid, last_pay, idx)], _seed(df, 'last_payment_month', start))
+    df['months_since_last_payment'] = np.where(
+        np.isnat(last_payment_month), 999.0, _months_between(month, last_payment_month))
+    df['first_month'] = first_month
+    df['last_payment_month'] = last_payment_month
+
+    # derived interactions
+    df['util_x_delinq'] = df['utilization'] * (df['max_days_past_due_12m'] > 0).astype(int)
+    df['dti_x_inquiries'] = df['dti'] * (1 + df['inquiries_3m'])
+    return df
+
+
+def _seed(df: pd.DataFrame, col: str, start: np.ndarray) -> np.ndarray:
+    """Per-row value of `col` taken from the first row of each customer, NaT if absent."""
+    if col not in df.columns:
+        return np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    return pd.to_datetime(df[col]).to_numpy()[start]
+
 
 def compute_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized feature engine; matches compute_features_groupby column for column.
+
+    Rows are sorted by (cust_id, month) once and every per-customer window is
+    evaluated on flat NumPy arrays using each row's position within its
+    customer, so no groupby/apply or Python callbacks run per customer.
+    """
+    out = _compute(df[RAW_COLUMNS])[FEATURES].copy()
+    out = out.fillna(0)
+    return out
+
+
+def update_features(state: pd.DataFrame, new_month_df: pd.DataFrame):
+    """Compute features for new rows given per-customer carried-over state.
+
+    `state` holds at most HISTORY_MONTHS raw rows per customer plus their
+    `first_month`/`last_payment_month` (see build_state); every row of
+    `new_month_df` must be later than the state rows of the same customer.
+    Returns the feature rows for `new_month_df` only -- identical to those
+    rows of a full recompute -- and the updated state for its customers
+    merged with the untouched customers of `state`.
+    """
+    new = new_month_df[RAW_COLUMNS].copy()
+    new['month'] = pd.to_datetime(new['month'])
+    last_month = new['cust_id'].map(state.groupby('cust_id')['month'].max())
+    if (new['month'] <= last_month).any():
+        raise ValueError('new rows must be later than the stored state for each customer')
+    seen = state['cust_id'].isin(new['cust_id'].unique())
+    hist = state[seen].assign(_carry=True)
+    work = _compute(pd.concat([hist, new.assign(_carry=False)], ignore_index=True))
+    feats = work.loc[~work['_carry'].astype(bool), FEATURES].fillna(0)
+    # history rows may have upcast integer inputs to float; restore the input dtypes
+    feats = feats.astype({c: new[c].dtype for c in FEATURES if c in new.columns and c != 'month'})
+    updated = build_state(work)
+    new_state = pd.concat([state[~seen], updated], ignore_index=True)
+    return feats.reset_index(drop=True), new_state
+
+
+def build_state(work: pd.DataFrame) -> pd.DataFrame:
+    """Carry-over state from a _compute working frame: last HISTORY_MONTHS rows per customer."""
+    state = work.groupby('cust_id', sort=False).tail(HISTORY_MONTHS)
+    return state[STATE_COLUMNS].reset_index(drop=True)
+
+
+def init_state(df: pd.DataFrame) -> pd.DataFrame:
+    """Carry-over state for a full history, as left behind by compute_features."""
+    return build_state(_compute(df[RAW_COLUMNS]))
+
+
+def save_state(state: pd.DataFrame, path: str):
+    write_state(state, path)
+
+
+def load_state(path: str) -> pd.DataFrame:
+    return read_state(path)
+
+
+def empty_state() -> pd.DataFrame:
+    state = pd.DataFrame({c: pd.Series(dtype='float64') for c in STATE_COLUMNS})
+    for c in ('month', 'first_month', 'last_payment_month'):
+        state[c] = pd.Series(dtype='datetime64[ns]')
+    return state
+
+
+def stream_features(infile: str, outfile: str, chunksize: int = 500_000) -> int:
+    """Compute features chunk by chunk from a (cust_id, month)-sorted CSV or Parquet file.
+
+    Only the last customer of a chunk can continue into the next one, so the
+    carried state is at most HISTORY_MONTHS rows and peak memory is bounded
+    by the chunk size rather than the panel size. Returns rows written.
+    """
+    state = empty_state()
+    last_cust = None
+    with TableWriter(outfile, 'features') as out:
+        for chunk in iter_table(infile, chunksize, columns=RAW_COLUMNS):
+            cust = chunk['cust_id'].to_numpy()
+            if (last_cust is not None and cust[0] < last_cust) or (np.diff(cust) < 0).any():
+                raise ValueError(f'{infile} must be sorted by cust_id for streaming')
+            feats, state = update_features(state, chunk)
+            last_cust = cust[-1]
+            state = state[state['cust_id'] == last_cust]
+            out.write(feats)
+    return out.rows
+
+
+def compute_features_groupby(df: pd.DataFrame) -> pd.DataFrame:
+    """Reference pandas groupby/apply implementation of compute_features."""
     df = df.copy()
     df['month'] = pd.to_datetime(df['month'])
     df = df.sort_values(['cust_id', 'month'])
@@ -44,28 +296,117 @@ def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     df['util_x_delinq'] = df['utilization'] * (df['max_days_past_due_12m'] > 0).astype(int)
     df['dti_x_inquiries'] = df['dti'] * (1 + df['inquiries_3m'])
 
-    # select a small stable feature set
-    features = [
-        'cust_id', 'month', 'balance', 'credit_limit', 'income', 'utilization', 'dti',
-        'util_3m_mean', 'util_6m_std', 'balance_3m_slope', 'payment_to_balance',
-        'on_time_ratio_6m', 'max_days_past_due_12m', 'inquiries_3m', 'new_accounts_6m',
-        'months_since_first', 'months_since_last_payment', 'util_x_delinq', 'dti_x_inquiries',
-        'default_next_3m'
-    ]
-    out = df[features].copy()
+    out = df[FEATURES].copy()
     # fill and clip
     out = out.fillna(0)
     return out
 
 
+def _feature_shard(in_path: str, out_path: str) -> int:
+    """Worker: features for one partition, exchanged as memory-mapped Arrow IPC files."""
+    feats = compute_features(read_ipc(in_path))
+    write_ipc(feats, out_path)
+    return len(feats)
+
+
+def parallel_features(infile: str, outfile: str, workers: int, chunksize: int = 1_000_000) -> int:
+    """Compute features in a process pool, hash-partitioned on cust_id.
+
+    The input is streamed once and each chunk's rows are appended to one
+    Arrow IPC file per partition; every customer lands in exactly one
+    partition, so workers need no cross-partition state. Workers receive
+    file paths and memory-map their input, so no DataFrames are pickled
+    between processes. Shards are merged and sorted by (cust_id, month),
+    giving the same output as a single-process run.
+    """
+    with tempfile.TemporaryDirectory(prefix='features-') as tmp:
+        inputs = [os.path.join(tmp, f'in-{i:04d}.arrow') for i in range(workers)]
+        outputs = [os.path.join(tmp, f'out-{i:04d}.arrow') for i in range(workers)]
+        with IpcPartitionWriter(inputs) as parts:
+            for chunk in iter_table(infile, chunksize, columns=RAW_COLUMNS):
+                cust = chunk['cust_id'].to_numpy().astype(np.int64)
+                part = pd.util.hash_array(cust) % np.uint64(workers)
+                for i in np.unique(part):
+                    parts.write(int(i), chunk[part == i])
+        jobs = [(i, o) for i, o in zip(inputs, outputs) if os.path.exists(i)]
+        if not jobs:
+            # no customers in the input: nothing to hand to the pool
+            feats = pd.DataFrame({col: pd.Series(dtype=float) for col in FEATURES})
+            write_table(feats, outfile, 'features')
+            return 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_feature_shard, *zip(*jobs)))
+        feats = pd.concat([read_ipc(o) for _, o in jobs], ignore_index=True)
+    feats = feats.sort_values(['cust_id', 'month'], kind='mergesort').reset_index(drop=True)
+    write_table(feats, outfile, 'features')
+    return len(feats)
+
+
+ENGINES = {
+    'vectorized': compute_features,
+    'groupby': compute_features_groupby,
+}
+
+
+def parity_report(df: pd.DataFrame, atol: float = 1e-6) -> pd.Series:
+    """Max absolute difference per column between the two engines, for columns above atol."""
+    fast = compute_features(df).reset_index(drop=True)
+    ref = compute_features_groupby(df).reset_index(drop=True)
+    if list(fast.columns) != list(ref.columns) or len(fast) != len(ref):
+        raise ValueError('engines disagree on output shape')
+    diff = {}
+    for col in FEATURES:
+        if col == 'month':
+            diff[col] = float((fast[col] != ref[col]).sum())
+        else:
+            diff[col] = float((fast[col].astype(float) - ref[col].astype(float)).abs().max())
+    diff = pd.Series(diff)
+    return diff[diff > atol]
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--in', dest='infile', default='ml/data.csv')
     p.add_argument('--out', dest='outfile', default='ml/features.csv')
+    p.add_argument('--engine', choices=sorted(ENGINES), default='vectorized')
+    p.add_argument('--check-parity', action='store_true', help='compare the vectorized and groupby engines and exit')
+    p.add_argument('--chunksize', type=int, default=0, help='stream the (cust_id, month)-sorted input in chunks of this many rows')
+    p.add_argument('--state', help='per-customer state store; written after a full run, read and updated with --update')
+    p.add_argument('--update', action='store_true', help='treat --in as new month rows and emit features only for them')
+    p.add_argument('--workers', type=int, default=0, help='compute in a process pool of this size, partitioned by cust_id')
     args = p.parse_args()
-    df = pd.read_csv(args.infile)
-    feat = compute_features(df)
-    feat.to_csv(args.outfile, index=False)
+    if args.workers and (args.engine != 'vectorized' or args.state or args.update or args.check_parity):
+        p.error('--workers runs the vectorized engine only; it cannot be combined with --engine, --state, --update or --check-parity')
+    if args.chunksize and not args.workers and (args.engine != 'vectorized' or args.state or args.update or args.check_parity):
+        p.error('--chunksize streams the vectorized engine only; it cannot be combined with --engine, --state, --update or --check-parity')
+    if args.workers:
+        n = parallel_features(args.infile, args.outfile, args.workers, args.chunksize or 1_000_000)
+        print('Wrote', n, 'rows to', args.outfile)
+        return
+    if args.update:
+        if not args.state:
+            p.error('--update requires --state')
+        feat, state = update_features(load_state(args.state), read_table(args.infile, columns=RAW_COLUMNS))
+        write_table(feat, args.outfile, 'features')
+        save_state(state, args.state)
+        print('Wrote', len(feat), 'rows to', args.outfile, 'and updated', args.state)
+        return
+    if args.chunksize:
+        n = stream_features(args.infile, args.outfile, args.chunksize)
+        print('Wrote', n, 'rows to', args.outfile)
+        return
+    df = read_table(args.infile, columns=RAW_COLUMNS)
+    if args.check_parity:
+        bad = parity_report(df)
+        if len(bad):
+            print('Parity mismatch:\n', bad.to_string())
+            raise SystemExit(1)
+        print('Engines match on', args.infile)
+        return
+    feat = ENGINES[args.engine](df)
+    write_table(feat, args.outfile, 'features')
+    if args.state:
+        save_state(init_state(df), args.state)
     print('Wrote', args.outfile)
 
 
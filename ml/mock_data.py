@@ -1,54 +1,86 @@
 """Generate synthetic monthly customer account data for feature engineering demos."""
 import argparse
+import os
 import numpy as np
 import pandas as pd
-from datetime import datetime
 
+from schema import write_table
 
-def generate(n_customers=1000, months=24, seed=42):
+
+def generate(n_customers=1000, months=24, seed=42, first_cust_id=1):
+    """Draw a (customers x months) panel with whole-matrix NumPy operations.
+
+    Per-customer constants are drawn as vectors and per-month noise as
+    (customers, months) matrices. The clipped balance recurrence steps over
+    the month axis for all customers at once, and the forward-looking label
+    is built from shifted boolean matrices. Rows come out sorted by
+    (cust_id, month).
+    """
     rng = np.random.default_rng(seed)
-    rows = []
-    for cid in range(1, n_customers + 1):
-        income = max(1000, int(rng.normal(5000, 1500)))
-        credit_limit = max(500, int(rng.normal(10000, 3000)))
-        last_balance = rng.integers(0, credit_limit)
-        for m in range(months):
-            month = pd.Timestamp('2020-01-01') + pd.DateOffset(months=m)
-            # simulate balance and payments
-            utilization_noise = rng.normal(0, 0.05)
-            balance = int(np.clip(last_balance * (1 + rng.normal(0.0, 0.15)) + rng.integers(-500, 500), 0, credit_limit))
-            payment = int(max(0, balance - rng.integers(0, int(balance * 0.5) + 1)))
-            days_past_due = int(abs(rng.normal(0, 5))) if rng.random() < 0.05 else 0
-            inquiries = int(rng.poisson(0.05))
-            open_accounts = int(1 + rng.poisson(1.0))
-            rows.append({
-                'cust_id': cid,
-                'month': month.to_period('M').to_timestamp(),
-                'balance': balance,
-                'credit_limit': credit_limit,
-                'payment': payment,
-                'days_past_due': days_past_due,
-                'inquiries': inquiries,
-                'open_accounts': open_accounts,
-                'income': income,
-            })
-            last_balance = balance
-    df = pd.DataFrame(rows)
+    shape = (n_customers, months)
+    income = np.maximum(1000, rng.normal(5000, 1500, n_customers).astype(np.int64))
+    credit_limit = np.maximum(500, rng.normal(10000, 3000, n_customers).astype(np.int64))
+    last_balance = rng.integers(0, credit_limit)
+
+    growth = 1 + rng.normal(0.0, 0.15, shape)
+    jitter = rng.integers(-500, 500, shape)
+    balance = np.empty(shape, dtype=np.int64)
+    for m in range(months):
+        last_balance = np.clip(last_balance * growth[:, m] + jitter[:, m], 0, credit_limit).astype(np.int64)
+        balance[:, m] = last_balance
+
+    payment = np.maximum(0, balance - rng.integers(0, (balance * 0.5).astype(np.int64) + 1))
+    late = rng.random(shape) < 0.05
+    days_past_due = np.where(late, np.abs(rng.normal(0, 5, shape)).astype(np.int64), 0)
+    inquiries = rng.poisson(0.05, shape)
+    open_accounts = 1 + rng.poisson(1.0, shape)
+
     # create a target: default in next 3 months if days_past_due large or sudden rise
-    df = df.sort_values(['cust_id', 'month'])
-    df['balance_prev'] = df.groupby('cust_id')['balance'].shift(1).fillna(0)
-    df['pct_change'] = (df['balance'] - df['balance_prev']) / (df['balance_prev'].replace(0, 1))
-    # label at row-level: default next 3 months
-    df['default_next_3m'] = 0
-    for cid, g in df.groupby('cust_id'):
-        idx = g.index
-        for i in range(len(g)):
-            window = g.iloc[i+1:i+4]
-            if window.empty:
-                continue
-            if (window['days_past_due'] > 30).any() or (window['pct_change'] > 0.5).any():
-                df.at[idx[i], 'default_next_3m'] = 1
-    return df
+    balance_prev = np.zeros(shape)
+    balance_prev[:, 1:] = balance[:, :-1]
+    pct_change = (balance - balance_prev) / np.where(balance_prev == 0, 1, balance_prev)
+    risky = (days_past_due > 30) | (pct_change > 0.5)
+    default_next_3m = np.zeros(shape, dtype=bool)
+    for k in range(1, 4):
+        default_next_3m[:, :-k] |= risky[:, k:]
+
+    month_index = pd.date_range('2020-01-01', periods=months, freq='MS')
+    cust_ids = np.arange(first_cust_id, first_cust_id + n_customers, dtype=np.int32)
+    return pd.DataFrame({
+        'cust_id': np.repeat(cust_ids, months),
+        'month': np.tile(month_index.values, n_customers),
+        'balance': balance.ravel().astype(np.int32),
+        'credit_limit': np.repeat(credit_limit, months).astype(np.int32),
+        'payment': payment.ravel().astype(np.int32),
+        'days_past_due': days_past_due.ravel().astype(np.int32),
+        'inquiries': inquiries.ravel().astype(np.int32),
+        'open_accounts': open_accounts.ravel().astype(np.int32),
+        'income': np.repeat(income, months).astype(np.int32),
+        'balance_prev': balance_prev.ravel(),
+        'pct_change': pct_change.ravel(),
+        'default_next_3m': default_next_3m.ravel().astype(np.int8),
+    })
+
+
+def generate_shards(out_dir, n_customers=1000, months=24, seed=42, shard_customers=100_000, fmt='parquet'):
+    """Write the panel as part-NNNNN files of `shard_customers` customers each.
+
+    Each shard draws from its own child of SeedSequence(seed), so output is
+    reproducible and peak memory is bounded by the shard size. Shards hold
+    consecutive cust_id ranges, so the directory reads back customer-sorted.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    n_shards = -(-n_customers // shard_customers)
+    seeds = np.random.SeedSequence(seed).spawn(n_shards)
+    paths = []
+    for i, shard_seed in enumerate(seeds):
+        first = i * shard_customers
+        count = min(shard_customers, n_customers - first)
+        df = generate(count, months, seed=shard_seed, first_cust_id=first + 1)
+        path = os.path.join(out_dir, f'part-{i:05d}.{fmt}')
+        write_table(df, path, 'raw')
+        paths.append(path)
+    return paths
 
 
 def main():
@@ -56,9 +88,16 @@ def main():
     p.add_argument('--out', default='ml/data.csv')
     p.add_argument('--n_customers', type=int, default=1000)
     p.add_argument('--months', type=int, default=24)
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--shard_customers', type=int, default=0, help='write --out as a directory of shards with this many customers each')
+    p.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help='shard file format')
     args = p.parse_args()
-    df = generate(n_customers=args.n_customers, months=args.months)
-    df.to_csv(args.out, index=False)
+    if args.shard_customers:
+        paths = generate_shards(args.out, args.n_customers, args.months, args.seed, args.shard_customers, args.format)
+        print('Wrote', len(paths), 'shards to', args.out)
+        return
+    df = generate(n_customers=args.n_customers, months=args.months, seed=args.seed)
+    write_table(df, args.out, 'raw')
     print('Wrote', args.out)
 
 
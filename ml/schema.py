@@ -0,0 +1,242 @@
+"""Column lists, compact dtypes and CSV/Parquet table I/O shared by the ml scripts.
+
+Paths ending in `.parquet`/`.pq` (or directories of such files) are read and
+written as Parquet with the explicit Arrow schemas below; anything else is
+treated as CSV so the existing `ml/data.csv` / `ml/features.csv` flow keeps
+working unchanged. pyarrow is only imported when a Parquet path is used.
+"""
+import os
+import hashlib
+import pandas as pd
+
+# raw monthly inputs the features are computed from
+RAW_COLUMNS = [
+    'cust_id', 'month', 'balance', 'credit_limit', 'payment', 'days_past_due',
+    'inquiries', 'open_accounts', 'income', 'default_next_3m'
+]
+
+# output columns, in the order written by features.py
+FEATURES = [
+    'cust_id', 'month', 'balance', 'credit_limit', 'income', 'utilization', 'dti',
+    'util_3m_mean', 'util_6m_std', 'balance_3m_slope', 'payment_to_balance',
+    'on_time_ratio_6m', 'max_days_past_due_12m', 'inquiries_3m', 'new_accounts_6m',
+    'months_since_first', 'months_since_last_payment', 'util_x_delinq', 'dti_x_inquiries',
+    'default_next_3m'
+]
+
+# Arrow type names per column; columns not listed keep their inferred type
+RAW_TYPES = {
+    'cust_id': 'int32',
+    'month': 'date32',
+    'balance': 'int32',
+    'credit_limit': 'int32',
+    'payment': 'int32',
+    'days_past_due': 'int16',
+    'inquiries': 'int16',
+    'open_accounts': 'int16',
+    'income': 'int32',
+    'balance_prev': 'float32',
+    'pct_change': 'float32',
+    'default_next_3m': 'int8',
+}
+
+FEATURE_TYPES = {c: 'float32' for c in FEATURES}
+FEATURE_TYPES.update({'cust_id': 'int32', 'month': 'date32', 'default_next_3m': 'int8'})
+
+# features.py's per-customer carry-over state: raw rows plus two month markers
+STATE_TYPES = dict(RAW_TYPES, first_month='date32', last_payment_month='date32')
+STATE_DATES = ('month', 'first_month', 'last_payment_month')
+
+SCHEMAS = {'raw': RAW_TYPES, 'features': FEATURE_TYPES, 'state': STATE_TYPES}
+
+
+def _parts(path: str):
+    """Files of a sharded directory in name order, or [path] for a single file."""
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if not f.startswith(('.', '_')))
+
+
+def input_files(path: str):
+    """Data files behind `path`: the file itself, or a sharded directory's files in name order."""
+    return _parts(path)
+
+
+def content_hash(path: str) -> str:
+    """sha256 over the bytes of every file behind `path` (and their names, for directories)."""
+    h = hashlib.sha256()
+    for part in _parts(path):
+        if part != path:
+            h.update(os.path.basename(part).encode())
+        with open(part, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def is_parquet(path: str) -> bool:
+    return _parts(path)[0].endswith(('.parquet', '.pq')) if os.path.isdir(path) else path.endswith(('.parquet', '.pq'))
+
+
+def _arrow_schema(df: pd.DataFrame, kind: str):
+    import pyarrow as pa
+    types = SCHEMAS[kind]
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    fields = []
+    for field in inferred:
+        name = types.get(field.name)
+        fields.append(pa.field(field.name, getattr(pa, name)()) if name else field)
+    return pa.schema(fields)
+
+
+def _to_arrow(df: pd.DataFrame, kind: str, schema=None):
+    """Convert to an Arrow table with the compact schema; lossy casts raise."""
+    import pyarrow as pa
+    df = df.copy()
+    if 'month' in df.columns:
+        df['month'] = pd.to_datetime(df['month'])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.cast(schema or _arrow_schema(df, kind), safe=True)
+
+
+def read_table(path: str, columns=None) -> pd.DataFrame:
+    """Read CSV or Parquet, loading only `columns`."""
+    if is_parquet(path):
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.concat([pd.read_csv(p, usecols=columns) for p in _parts(path)], ignore_index=True)
+    if 'month' in df.columns:
+        df['month'] = pd.to_datetime(df['month'])
+    return df
+
+
+def iter_table(path: str, chunksize: int, columns=None):
+    """Yield DataFrame chunks of about `chunksize` rows in file (and shard) order."""
+    for part in _parts(path):
+        yield from _iter_file(part, chunksize, columns)
+
+
+def _iter_file(path: str, chunksize: int, columns=None):
+    if not is_parquet(path):
+        chunks = pd.read_csv(path, chunksize=chunksize, usecols=columns)
+    else:
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        chunks = (batch.to_pandas() for batch in pf.iter_batches(batch_size=chunksize, columns=columns))
+    for df in chunks:
+        if 'month' in df.columns:
+            df['month'] = pd.to_datetime(df['month'])
+        yield df
+
+
+def write_table(df: pd.DataFrame, path: str, kind: str):
+    """Write `df` as CSV, or as Parquet with the `kind` ('raw'/'features') schema."""
+    if not is_parquet(path):
+        df.to_csv(path, index=False)
+        return
+    import pyarrow.parquet as pq
+    pq.write_table(_to_arrow(df, kind), path)
+
+
+def write_state(df: pd.DataFrame, path: str):
+    """Write the features state store as Parquet with the compact 'state' schema, whatever the extension."""
+    import pyarrow.parquet as pq
+    df = df.copy()
+    for c in STATE_DATES:
+        df[c] = pd.to_datetime(df[c])
+    pq.write_table(_to_arrow(df, 'state'), path)
+
+
+def read_state(path: str) -> pd.DataFrame:
+    """Read a state store written by write_state, with its month columns as datetimes."""
+    df = pd.read_parquet(path)
+    for c in STATE_DATES:
+        df[c] = pd.to_datetime(df[c])
+    return df
+
+
+def read_ipc(path: str) -> pd.DataFrame:
+    """Read an Arrow IPC file through a memory map (no copy of the file buffer)."""
+    import pyarrow as pa
+    with pa.memory_map(path) as source:
+        df = pa.ipc.open_file(source).read_pandas()
+    if 'month' in df.columns:
+        df['month'] = pd.to_datetime(df['month'])
+    return df
+
+
+def write_ipc(df: pd.DataFrame, path: str):
+    """Write an uncompressed Arrow IPC file, keeping the frame's own dtypes."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+class IpcPartitionWriter:
+    """Append DataFrame chunks to N Arrow IPC files, one per partition."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self._sinks = [None] * len(self.paths)
+        self._writers = [None] * len(self.paths)
+        self._schema = None
+
+    def write(self, i: int, df: pd.DataFrame):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._schema is None:
+            self._schema = table.schema
+        else:
+            table = table.cast(self._schema, safe=True)
+        if self._writers[i] is None:
+            self._sinks[i] = pa.OSFile(self.paths[i], 'wb')
+            self._writers[i] = pa.ipc.new_file(self._sinks[i], self._schema)
+        self._writers[i].write_table(table)
+
+    def close(self):
+        for writer, sink in zip(self._writers, self._sinks):
+            if writer is not None:
+                writer.close()
+                sink.close()
+        self._writers = [None] * len(self.paths)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TableWriter:
+    """Append DataFrame chunks to one CSV or Parquet file."""
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.kind = kind
+        self.rows = 0
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        if not is_parquet(self.path):
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+        else:
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                table = _to_arrow(df, self.kind)
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = _to_arrow(df, self.kind, self._writer.schema)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
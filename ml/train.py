@@ -1,47 +1,265 @@
-"""Train a LightGBM model on engineered features and show feature importance."""
+"""Train a LightGBM model on engineered features and show feature importance.
+
+By default the sample is each customer's latest row with a random split.
+`--sample panel` trains on every customer-month row instead, validated out
+of time: the last labelled months are held out, and training rows whose
+label window reaches into them are purged. `--folds K` adds
+customer-grouped cross-validation over the training months, and
+`--sample-rate` keeps a seeded fraction of the rows.
+
+The binned sample is cached as a LightGBM binary Dataset under
+`--cache-dir`, named by a hash of the features file and the sampling and
+binning parameters, so reruns on unchanged input skip loading and binning.
+Parquet input is fed to LightGBM as one Sequence per file that decodes a
+row group at a time as float32, so only the label and key columns are held
+in memory.
+"""
 import argparse
+import json
+import os
+import hashlib
 import joblib
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import GroupKFold, train_test_split
 import lightgbm as lgb
 
+from schema import FEATURES, content_hash, input_files, is_parquet, read_table
+
+LABEL = 'default_next_3m'
+MODEL_COLUMNS = [c for c in FEATURES if c not in ('cust_id', 'month', LABEL)]
+
+# binning parameters; they are baked into the binary Dataset, so they are part of the cache key.
+# feature_pre_filter is off so cached Datasets stay valid when min_data_in_leaf is tuned.
+DATASET_PARAMS = {
+    'max_bin': 255,
+    'min_data_in_bin': 3,
+    'bin_construct_sample_cnt': 200000,
+    'feature_pre_filter': False,
+    'verbosity': -1,
+}
+# bump when the sample selection or the cache files change
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = 'ml/.dataset_cache'
+
+SAMPLES = ('latest', 'panel')
+# default_next_3m looks this many months past the row's own month
+LABEL_HORIZON = 3
+# fixed so a given --sample-rate always keeps the same rows (and hits the same cache entry)
+SAMPLE_SEED = 42
+
+PARAMS = {
+    'objective': 'binary',
+    'metric': 'auc',
+    'boosting_type': 'gbdt',
+    'learning_rate': 0.05,
+    'num_leaves': 64,
+    'feature_fraction': 0.8,
+    'bagging_fraction': 0.8,
+    'bagging_freq': 5,
+    'verbosity': -1,
+    'seed': 42,
+}
+
+
+class ParquetSequence(lgb.Sequence):
+    """Selected rows of one Parquet file as float32 feature rows.
+
+    LightGBM reads a Sequence in ascending row order (its binning sample,
+    then `batch_size` slices), so only the selected rows of the row group
+    being read are decoded and kept.
+    """
+
+    def __init__(self, path: str, rows: np.ndarray, columns=MODEL_COLUMNS, batch_size: int = 65536):
+        import pyarrow.parquet as pq
+        self.file = pq.ParquetFile(path)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        sizes = [self.file.metadata.row_group(i).num_rows for i in range(self.file.num_row_groups)]
+        self.starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        # rows are sorted, so row group g holds self.rows[bounds[g]:bounds[g + 1]]
+        self.group = np.searchsorted(self.starts, self.rows, side='right') - 1
+        self.bounds = np.searchsorted(self.group, np.arange(len(sizes) + 1))
+        self._group = -1
+        self._values = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _row_group(self, g: int) -> np.ndarray:
+        if g != self._group:
+            local = self.rows[self.bounds[g]:self.bounds[g + 1]] - self.starts[g]
+            table = self.file.read_row_group(g, columns=self.columns).take(local)
+            values = np.empty((len(local), len(self.columns)), dtype=np.float32)
+            for j, c in enumerate(self.columns):
+                # nulls come back as NaN, which LightGBM treats as missing
+                values[:, j] = table[c].to_numpy()
+            self._group, self._values = g, values
+        return self._values
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, _ = idx.indices(len(self.rows))
+            if stop <= start:
+                return np.empty((0, len(self.columns)), dtype=np.float32)
+            groups = range(self.group[start], self.group[stop - 1] + 1)
+            return np.concatenate([
+                self._row_group(g)[max(start, self.bounds[g]) - self.bounds[g]:min(stop, self.bounds[g + 1]) - self.bounds[g]]
+                for g in groups
+            ])
+        # single rows are LightGBM's binning sample, which it only takes as float64
+        g = self.group[idx]
+        return self._row_group(g)[idx - self.bounds[g]].astype(np.float64)
+
+
+def sample_rows(cust_id: np.ndarray, month: np.ndarray, sample: str = 'latest', latest_month: bool = False,
+                sample_rate: float = 1.0) -> np.ndarray:
+    """Positions (ascending) of the training sample.
+
+    'latest' keeps each customer's latest row, 'panel' keeps every row.
+    With `latest_month` only rows of the panel's last month are eligible,
+    and a `sample_rate` below 1 keeps that fraction of the rows at random.
+    """
+    pos = np.arange(len(cust_id))
+    if latest_month:
+        pos = pos[month == month.max()]
+    if sample == 'latest':
+        order = pos[np.lexsort((month[pos], cust_id[pos]))]
+        last = np.r_[cust_id[order][1:] != cust_id[order][:-1], True]
+        pos = np.sort(order[last])
+    if sample_rate < 1.0:
+        pos = pos[np.random.default_rng(SAMPLE_SEED).random(len(pos)) < sample_rate]
+    return pos
+
+
+def _row_keys(path: str):
+    """cust_id, month and label of every row of one Parquet file, without the feature columns."""
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=['cust_id', 'month', LABEL])
+    return table['cust_id'].to_numpy(), table['month'].to_numpy().astype('datetime64[M]'), table[LABEL].to_numpy()
+
+
+def build_dataset(features_path: str, sample: str = 'latest', latest_month: bool = False, sample_rate: float = 1.0):
+    """Construct (bin) the training sample as a LightGBM Dataset; the raw matrix is freed afterwards.
+
+    Returns the Dataset and the cust_id/month of each of its rows, which the splits need.
+    """
+    if is_parquet(features_path):
+        parts = input_files(features_path)
+        keys = [_row_keys(p) for p in parts]
+        offsets = np.cumsum([0] + [len(k[0]) for k in keys])
+        cust_id, month = np.concatenate([k[0] for k in keys]), np.concatenate([k[1] for k in keys])
+        rows = sample_rows(cust_id, month, sample, latest_month, sample_rate)
+        label = np.concatenate([k[2] for k in keys])[rows]
+        del keys
+        seqs = []
+        for i, part in enumerate(parts):
+            mine = rows[(rows >= offsets[i]) & (rows < offsets[i + 1])] - offsets[i]
+            if len(mine):
+                seqs.append(ParquetSequence(part, mine))
+        data = seqs
+    else:
+        df = read_table(features_path, columns=FEATURES)
+        cust_id, month = df['cust_id'].to_numpy(), df['month'].to_numpy().astype('datetime64[M]')
+        rows = sample_rows(cust_id, month, sample, latest_month, sample_rate)
+        label = df[LABEL].to_numpy()[rows]
+        data = df[MODEL_COLUMNS].to_numpy(dtype=np.float32)[rows]
+        del df
+    ds = lgb.Dataset(data, label=label, feature_name=MODEL_COLUMNS, params=DATASET_PARAMS, free_raw_data=True)
+    return ds.construct(), {'cust_id': cust_id[rows], 'month': month[rows]}
+
+
+def dataset_key(features_path: str, sample: str = 'latest', latest_month: bool = False, sample_rate: float = 1.0) -> str:
+    h = hashlib.sha256(content_hash(features_path).encode())
+    h.update(json.dumps({'version': CACHE_VERSION, 'sample': sample, 'latest_month': latest_month,
+                         'sample_rate': sample_rate, 'seed': SAMPLE_SEED, 'columns': MODEL_COLUMNS,
+                         'params': DATASET_PARAMS, 'lightgbm': lgb.__version__}, sort_keys=True).encode())
+    return h.hexdigest()[:24]
+
+
+def load_dataset(features_path: str, sample: str = 'latest', latest_month: bool = False, sample_rate: float = 1.0,
+                 cache_dir: str = DEFAULT_CACHE_DIR):
+    """build_dataset, read from the binary cache (plus a .keys.npz of row keys) when the input is unchanged."""
+    if not cache_dir:
+        return build_dataset(features_path, sample, latest_month, sample_rate)
+    os.makedirs(cache_dir, exist_ok=True)
+    base = os.path.join(cache_dir, dataset_key(features_path, sample, latest_month, sample_rate))
+    if os.path.exists(base + '.bin') and os.path.exists(base + '.keys.npz'):
+        print('Using cached Dataset', base + '.bin')
+        with np.load(base + '.keys.npz') as f:
+            keys = {k: f[k] for k in f.files}
+        return lgb.Dataset(base + '.bin', params=DATASET_PARAMS).construct(), keys
+    ds, keys = build_dataset(features_path, sample, latest_month, sample_rate)
+    # write then rename, so an interrupted save never leaves a truncated cache entry;
+    # the keys go last because their presence marks the entry complete
+    ds.save_binary(base + '.bin.tmp')
+    os.replace(base + '.bin.tmp', base + '.bin')
+    with open(base + '.keys.npz.tmp', 'wb') as f:
+        np.savez(f, **keys)
+    os.replace(base + '.keys.npz.tmp', base + '.keys.npz')
+    print('Cached Dataset to', base + '.bin')
+    return ds, keys
+
+
+def time_split(month: np.ndarray, valid_months: int = 3, horizon: int = LABEL_HORIZON):
+    """Out-of-time (train, validation) row positions for a panel sample.
+
+    The last `horizon` months are dropped, since their label window runs
+    past the end of the panel. The `valid_months` months before those are
+    validation. Training rows whose label window reaches into the
+    validation months are purged, so no training label is observed during
+    validation.
+    """
+    months = np.unique(month)
+    labelled = months[:len(months) - horizon]
+    if len(labelled) <= valid_months + horizon:
+        raise ValueError(f'{len(months)} months is too short for {valid_months} validation months '
+                         f'with a {horizon}-month label horizon')
+    valid_start, valid_end = labelled[-valid_months], labelled[-1]
+    train_end = valid_start - np.timedelta64(horizon, 'M')
+    return np.flatnonzero(month < train_end), np.flatnonzero((month >= valid_start) & (month <= valid_end))
+
+
+def grouped_folds(cust_id: np.ndarray, rows: np.ndarray, folds: int):
+    """(train, validation) positions of `folds` folds over `rows`, never splitting a customer."""
+    for tr, va in GroupKFold(n_splits=folds).split(rows, groups=cust_id[rows]):
+        yield rows[tr], rows[va]
+
+
+def fit(full: lgb.Dataset, train_idx, valid_idx, params=PARAMS):
+    """Train on subsets of the constructed Dataset (sharing its bins, so nothing is re-binned)."""
+    bst = lgb.train(params, full.subset(train_idx), num_boost_round=2000, valid_sets=[full.subset(valid_idx)],
+                    valid_names=['val'], callbacks=[lgb.early_stopping(50, verbose=False), lgb.log_evaluation(100)])
+    # the raw validation rows are freed once binned; LightGBM's AUC at the best iteration is the same metric
+    return bst, bst.best_score['val']['auc']
+
+
+def train(features_csv: str, model_out: str = 'ml/model.txt', latest_month: bool = False, cache_dir: str = DEFAULT_CACHE_DIR,
+          sample: str = 'latest', sample_rate: float = 1.0, valid_months: int = 3, horizon: int = LABEL_HORIZON,
+          folds: int = 0):
+    full, keys = load_dataset(features_csv, sample, latest_month, sample_rate, cache_dir)
+    print(f'{full.num_data()} rows, sample={sample}, sample_rate={sample_rate}')
+
+    if sample == 'panel':
+        train_idx, val_idx = time_split(keys['month'], valid_months, horizon)
+        print(f'Out-of-time split: {len(train_idx)} training rows before {keys["month"][train_idx].max() + 1}, '
+              f'{len(val_idx)} validation rows from {keys["month"][val_idx].min()} to {keys["month"][val_idx].max()}')
+        if folds > 1:
+            aucs = []
+            for k, (tr, va) in enumerate(grouped_folds(keys['cust_id'], train_idx, folds)):
+                aucs.append(fit(full, tr, va)[1])
+                print(f'Fold {k + 1}/{folds} AUC: {aucs[-1]:.4f}')
+            print(f'Customer-grouped CV AUC: {np.mean(aucs):.4f} +/- {np.std(aucs):.4f}')
+    else:
+        # latest month per customer as sample (simple approach), split at random
+        train_idx, val_idx = train_test_split(np.arange(full.num_data()), test_size=0.2, random_state=42, stratify=full.get_label())
 
-def train(features_csv: str, model_out: str = 'ml/model.txt'):
-    df = pd.read_csv(features_csv)
-    # latest month per customer as sample (simple approach)
-    df = df.sort_values(['cust_id', 'month'])
-    df = df.groupby('cust_id').tail(1).reset_index(drop=True)
-    y = df['default_next_3m']
-    X = df.drop(columns=['cust_id', 'month', 'default_next_3m'])
-
-    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
-
-    train_data = lgb.Dataset(X_train, label=y_train)
-    val_data = lgb.Dataset(X_val, label=y_val, reference=train_data)
-
-    params = {
-        'objective': 'binary',
-        'metric': 'auc',
-        'boosting_type': 'gbdt',
-        'learning_rate': 0.05,
-        'num_leaves': 64,
-        'feature_fraction': 0.8,
-        'bagging_fraction': 0.8,
-        'bagging_freq': 5,
-        'verbosity': -1,
-        'seed': 42,
-    }
-
-    bst = lgb.train(params, train_data, num_boost_round=2000, valid_sets=[val_data], early_stopping_rounds=50, verbose_eval=100)
-
-    y_pred = bst.predict(X_val, num_iteration=bst.best_iteration)
-    auc = roc_auc_score(y_val, y_pred)
+    bst, auc = fit(full, train_idx, val_idx)
     print(f'Validation AUC: {auc:.4f}')
 
     # feature importance
-    fi = pd.DataFrame({'feature': X.columns, 'importance': bst.feature_importance(importance_type='gain')})
+    fi = pd.DataFrame({'feature': bst.feature_name(), 'importance': bst.feature_importance(importance_type='gain')})
     fi = fi.sort_values('importance', ascending=False)
     print('\nTop features:\n', fi.head(20).to_string(index=False))
 
@@ -54,8 +272,19 @@ def main():
     p = argparse.ArgumentParser()
     p.add_argument('--features', default='ml/features.csv')
     p.add_argument('--model', default='ml/model.txt')
+    p.add_argument('--latest-month', action='store_true', help='only load rows from the latest month in the file')
+    p.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where binned Datasets are cached')
+    p.add_argument('--no-cache', action='store_true', help='always rebuild the Dataset and do not cache it')
+    p.add_argument('--sample', choices=SAMPLES, default='latest', help="'panel' trains on every customer-month row")
+    p.add_argument('--sample-rate', type=float, default=1.0, help='fraction of the sample rows to keep')
+    p.add_argument('--valid-months', type=int, default=3, help='months held out for the panel out-of-time split')
+    p.add_argument('--horizon', type=int, default=LABEL_HORIZON, help='months the label looks ahead')
+    p.add_argument('--folds', type=int, default=0, help='customer-grouped CV folds over the panel training months')
     args = p.parse_args()
-    train(args.features, args.model)
+    if not 0.0 < args.sample_rate <= 1.0:
+        p.error('--sample-rate must be in (0, 1]')
+    train(args.features, args.model, args.latest_month, None if args.no_cache else args.cache_dir,
+          args.sample, args.sample_rate, args.valid_months, args.horizon, args.folds)
 
 
 if __name__ == '__main__':
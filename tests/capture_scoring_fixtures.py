@@ -0,0 +1,88 @@
+"""Regenerate fixtures/scoring_parity.json from a given version of api/python.
+
+The committed fixtures were captured from the handlers before the scoring
+core (_scoring.py) was extracted:
+
+    git archive e3deee7^ api/python | tar -x -C /tmp/pre-scoring
+    python tests/capture_scoring_fixtures.py /tmp/pre-scoring/api/python
+
+--train-model also rewrites fixtures/score_model.txt, the small
+deterministic regression model the "model" fixtures are scored with.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scoring_cases as cases  # noqa: E402
+
+
+def train_model(path: str):
+    import lightgbm as lgb
+    rng = np.random.default_rng(0)
+    n = 4000
+    X = np.column_stack([
+        rng.uniform(0, 100_000, n),      # avg_monthly_income
+        rng.uniform(-60_000, 0, n),      # avg_monthly_expense
+        rng.uniform(-300, 200, n),       # savings_rate
+        rng.uniform(-2, 1, n),           # expense_to_income_ratio
+        rng.integers(0, 40, n),          # num_loan_payments
+        rng.uniform(0, 100, n),          # pct_spend_on_food
+        rng.integers(0, 400, n),         # total_transactions
+    ])
+    y = 600 + np.clip(X[:, 2], -150, 150) - 4 * X[:, 4] - 0.5 * X[:, 5] + rng.normal(0, 10, n)
+    params = {"objective": "regression", "num_leaves": 15, "learning_rate": 0.1, "min_data_in_leaf": 20,
+              "seed": 0, "deterministic": True, "num_threads": 1, "verbosity": -1}
+    bst = lgb.train(params, lgb.Dataset(X, y), num_boost_round=40)
+    bst.save_model(path)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("api_dir", help="api/python directory of the version to capture")
+    p.add_argument("--train-model", action="store_true")
+    args = p.parse_args()
+
+    if args.train_model or not os.path.exists(cases.MODEL_PATH):
+        train_model(cases.MODEL_PATH)
+    model = cases.load_fixture_model()
+
+    os.environ["DATABASE_URL"] = "postgresql://fixtures"
+    sys.path.insert(0, os.path.abspath(args.api_dir))
+    import get_score
+    import simulate
+    modules = {"get_score": get_score, "simulate": simulate}
+    for mod in modules.values():
+        mod.db_connection = cases.fake_db_connection
+
+    out = {"responses": {}}
+    for label, m in (("model", model), ("heuristic", None)):
+        for mod in modules.values():
+            mod.load_model = lambda *a, m=m, **k: m
+        out["responses"][label] = cases.run_requests(modules)
+
+    features = {uid: get_score.compute_features_from_df(cases.transactions_frame(uid)) for uid in cases.USERS}
+    out["features"] = features
+    grouped = get_score.compute_features_grouped(cases.all_transactions_frame()).sort("userId")
+    out["grouped"] = grouped.to_dicts()
+
+    # scored matrix: every user's features plus edge rows (no income, heavy debt, all zeros)
+    names = get_score.FEATURE_NAMES
+    X = [[float(features[uid][n]) for n in names] for uid in cases.USERS]
+    X += [[0.0, -2500.0, 0.0, 0.0, 3.0, 40.0, 12.0], [1000.0, -9000.0, -800.0, -9.0, 60.0, 0.0, 80.0], [0.0] * 7]
+    out["matrix"] = X
+    out["predict"] = {
+        "model": simulate.predict_scores(model, np.asarray(X)).tolist(),
+        "heuristic": simulate.predict_scores(None, np.asarray(X)).tolist(),
+    }
+
+    with open(cases.PARITY_PATH, "w") as f:
+        json.dump(out, f, indent=1, sort_keys=True, default=str)
+    print("wrote", cases.PARITY_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ml/ and api/python/ import their siblings by bare name, as their scripts do
+for path in (os.path.join(ROOT, "ml"), os.path.join(ROOT, "api", "python")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,139 @@
+"""Users, requests and an in-memory database shared by the scoring parity fixtures and tests.
+
+The fixtures in fixtures/scoring_parity.json were produced by running these
+requests through the handlers as they were before the scoring core was
+extracted (see capture_scoring_fixtures.py); test_scoring_parity.py runs the
+same requests through the current code.
+"""
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PARITY_PATH = os.path.join(FIXTURES, "scoring_parity.json")
+MODEL_PATH = os.path.join(FIXTURES, "score_model.txt")
+
+FOOD_WORDS = ["Zomato order", "Swiggy dinner", "Cafe Coffee Day", "DOMINOS pizza", "restaurant bill"]
+OTHER_WORDS = ["Uber ride", "Electricity bill", "Amazon", "Rent transfer", None]
+LOAN_WORDS = ["HDFC EMI", "Car loan instalment", "Equated monthly", "installment plan"]
+
+
+def _rows(seed: int, months: int, per_month: int):
+    """(date, description, amount, type) rows like the Transaction table returns, in date order."""
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for m in range(months):
+        base = start + timedelta(days=31 * m)
+        rows.append((base + timedelta(days=1), "Salary credit ACME", float(rng.integers(30_000, 90_000)), "Credit"))
+        for i in range(per_month):
+            pool = [FOOD_WORDS, OTHER_WORDS, LOAN_WORDS][int(rng.integers(0, 3))]
+            desc = pool[int(rng.integers(0, len(pool)))]
+            rows.append((base + timedelta(days=2 + i % 25, hours=i), desc, -float(rng.integers(50, 8_000)), "Debit"))
+        if m % 4 == 1:
+            # refund credited with a food keyword: income, never food spend
+            rows.append((base + timedelta(days=20), "Zomato refund", float(rng.integers(100, 900)), "Credit"))
+    return sorted(rows, key=lambda r: r[0])
+
+
+USERS = {
+    "rich": _rows(1, 14, 12),
+    "sparse": _rows(2, 3, 2),
+    "debt": [r for r in _rows(3, 9, 8) if r[3] == "Debit"] + [(datetime(2024, 2, 1), "HDFC EMI bounce", -500.0, "Debit")],
+    "nulldesc": [(d, None, a, t) for d, _, a, t in _rows(4, 5, 6)],
+    "empty": [],
+}
+USERS["debt"].sort(key=lambda r: r[0])
+EMAILS = {f"{uid}@example.com": uid for uid in USERS}
+
+SIMULATION = {"missed_payments": 2, "income_change": -5000, "spending_increase": 15}
+GRID = {"missed_payments": [0, 1, 3], "income_change": {"min": -20000, "max": 20000, "step": 10000}, "spending_increase": [0, 25]}
+
+# (case id, handler module, request body)
+REQUESTS = (
+    [(f"score:{uid}", "get_score", {"userId": uid}) for uid in USERS]
+    + [("score:by-email", "get_score", {"userEmail": "rich@example.com"}),
+       ("score:email-miss", "get_score", {"userEmail": "nobody@example.com"}),
+       ("score:batch", "get_score", {"userIds": ["rich", "empty", "ghost", "sparse"],
+                                     "userEmails": ["debt@example.com", "nobody@example.com", "nulldesc@example.com"]})]
+    + [(f"simulate:{uid}", "simulate", {"userId": uid, "simulation": SIMULATION}) for uid in USERS]
+    + [(f"grid:{uid}", "simulate", {"userId": uid, "grid": GRID}) for uid in ("rich", "debt", "empty")]
+    + [("simulate:email-miss", "simulate", {"userEmail": "nobody@example.com", "simulation": SIMULATION})]
+)
+
+
+class FakeCursor:
+    """Answers exactly the queries the transactions-mode handlers issue."""
+
+    def __init__(self):
+        self._result = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        if sql == 'SELECT id FROM "User" WHERE email = %s LIMIT 1':
+            uid = EMAILS.get(params[0])
+            self._result = [(uid,)] if uid else []
+        elif sql == 'SELECT id, email FROM "User" WHERE email = ANY(%s)':
+            self._result = [(EMAILS[e], e) for e in params[0] if e in EMAILS]
+        elif sql == 'SELECT date, description, amount, type FROM "Transaction" WHERE "userId" = %s ORDER BY date ASC':
+            self._result = list(USERS.get(params[0], []))
+        elif sql == 'SELECT "userId", date, description, amount, type FROM "Transaction" WHERE "userId" = ANY(%s)':
+            self._result = [(uid,) + row for uid in params[0] for row in USERS.get(uid, [])]
+        else:
+            raise AssertionError(f"unexpected query: {sql}")
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+
+@contextmanager
+def fake_db_connection(dsn=None):
+    yield FakeConnection()
+
+
+def load_fixture_model():
+    import lightgbm as lgb
+    return lgb.Booster(model_file=MODEL_PATH)
+
+
+def run_requests(modules) -> dict:
+    """{case id: {"statusCode": ..., "body": parsed JSON}} for every request."""
+    out = {}
+    for case, name, body in REQUESTS:
+        response = modules[name].handler({"body": json.dumps(body)})
+        out[case] = {"statusCode": response["statusCode"], "body": json.loads(response["body"])}
+    return out
+
+
+def transactions_frame(uid: str):
+    import polars as pl
+    rows = USERS[uid]
+    if not rows:
+        return pl.DataFrame([])
+    return pl.DataFrame(rows, schema=["date", "description", "amount", "type"])
+
+
+def all_transactions_frame():
+    import polars as pl
+    rows = [(uid,) + row for uid in USERS for row in USERS[uid]]
+    return pl.DataFrame(rows, schema=["userId", "date", "description", "amount", "type"])
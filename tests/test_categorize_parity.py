@@ -0,0 +1,84 @@
+"""clean_dataframe's vectorized categorizer and type mapping against the per-row rules they replaced."""
+import random
+
+import polars as pl
+import pytest
+
+import process_csv
+
+EDGE_DESCRIPTIONS = [
+    None, "", " ", "ZOMATO", "Swiggy*Order 123", "UPI/uber india/ref", "olala", "Grocery + cafe",
+    "train ticket via IRCTC", "GAS BILL (march)", "salary credit ACME", "SalaryCredit", "payroll\tjune",
+    "mcdonald's", "dmart.ready", "c++ books", "price $5 [promo]", "a|b", "^caret", "back\\slash", "{braces}",
+    "Café Coffee Day", "KÖLN HBF", "ΣΟΥΒΛΑΚΙ", "विद्युत बिल electricity", "transfer to mom", "ATM WDL",
+]
+EDGE_TYPES = [None, "", " ", "credit", "CR", " Deposit ", "in", "DEBIT", "dr", "Withdrawal", "OUT", "12345",
+              "refund", "REVERSAL", "neft-in", "Cr.", "débit"]
+
+WORDS = ["zomato", "swiggy", "dominos", "restaurant", "cafe", "mcdonald", "bigbasket", "grocery", "dmart",
+         "supermarket", "uber", "ola", "flight", "indigo", "train", "electricity", "water", "gas", "internet",
+         "mobile", "salary", "payroll", "upi", "neft", "imps", "atm", "transfer", "rent", "amazon", "flipkart",
+         "pos", "ref", "no.", "(1)", "*", "/", "-", "+", "?", "$", "#"]
+
+
+def random_descriptions(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 5))]
+        words = [w.upper() if rng.random() < 0.3 else w.title() if rng.random() < 0.3 else w for w in words]
+        sep = rng.choice([" ", "/", "", "-", "  "])
+        out.append(sep.join(words) + (str(rng.randint(0, 9999)) if rng.random() < 0.5 else ""))
+    return out
+
+
+def baseline_clean(descriptions, types):
+    """The per-row rules as clean_dataframe applied them: categorize on the null-filled
+    description, standardize_type on each non-null type."""
+    return ([process_csv.categorize(d or "") for d in descriptions],
+            [None if t is None else process_csv.standardize_type(t) for t in types])
+
+
+def test_clean_dataframe_matches_per_row_rules():
+    descriptions = EDGE_DESCRIPTIONS + random_descriptions(2000)
+    types = [EDGE_TYPES[i % len(EDGE_TYPES)] for i in range(len(descriptions))]
+    df = pl.DataFrame({"Date": ["01-01-2024"] * len(descriptions), "Narration": descriptions,
+                       "Amount": [1.0] * len(descriptions), "Type": types})
+    out = process_csv.clean_dataframe(df)
+    want_categories, want_types = baseline_clean(descriptions, types)
+    assert out["category"].to_list() == want_categories
+    assert out["type"].to_list() == want_types
+
+
+def test_custom_rules_with_regex_characters_match(monkeypatch):
+    rules = [
+        ("Books", ["c++", "a.b", "(x)"]),
+        ("Fees", ["$5", "[promo]", "a|b", "^caret", "back\\slash", "{braces}", "what?"]),
+        ("Spaces", ["big bazaar", "  "]),
+        ("Empty", []),
+        ("Shadowed", ["cafe"]),
+        ("Food", ["café", "cafe"]),
+    ]
+    monkeypatch.setattr(process_csv, "CATEGORY_RULES", rules)
+    monkeypatch.setattr(process_csv, "_CATEGORY_PATTERNS", process_csv._compile_rules(rules))
+    descriptions = EDGE_DESCRIPTIONS + ["aXb", "a.b", "x", "(x)", "BIG BAZAAR", "big  bazaar", "what?", "what",
+                                        "ab", "c+", "double  space", "Café"] + random_descriptions(500, seed=1)
+    df = pl.DataFrame({"description": [d or "" for d in descriptions]})
+    got = df.select(process_csv.category_expr().alias("category"))["category"].to_list()
+    assert got == baseline_clean(descriptions, [])[0]
+
+
+@pytest.mark.parametrize("rules_file", ["rules.json", "rules.csv"])
+def test_rule_files_match(rules_file, tmp_path, monkeypatch):
+    path = tmp_path / rules_file
+    if rules_file.endswith(".json"):
+        path.write_text('{"Fuel": ["HP Petrol", "shell"], "Food": ["zomato", "Shell Cafe"]}')
+    else:
+        path.write_text("category,keyword\nFuel,HP Petrol\nFuel,shell\nFood,zomato\nFood,Shell Cafe\n")
+    rules = process_csv.load_category_rules(str(path))
+    monkeypatch.setattr(process_csv, "CATEGORY_RULES", rules)
+    monkeypatch.setattr(process_csv, "_CATEGORY_PATTERNS", process_csv._compile_rules(rules))
+    descriptions = ["hp petrol pump", "SHELL CAFE", "zomato", "shellfish", ""] + random_descriptions(300, seed=2)
+    df = pl.DataFrame({"description": descriptions})
+    got = df.select(process_csv.category_expr().alias("category"))["category"].to_list()
+    assert got == baseline_clean(descriptions, [])[0]
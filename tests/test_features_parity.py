@@ -0,0 +1,99 @@
+"""compute_features (vectorized) against compute_features_groupby (reference)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from features import compute_features, compute_features_groupby, parity_report
+from mock_data import generate
+from schema import RAW_COLUMNS
+
+
+def panel(rows):
+    return pd.DataFrame(rows, columns=RAW_COLUMNS)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 7])
+def test_random_panels_match(seed):
+    df = generate(n_customers=60, months=18, seed=seed)[RAW_COLUMNS]
+    assert parity_report(df).empty
+
+
+def test_unsorted_input_matches():
+    df = generate(n_customers=40, months=14, seed=3)[RAW_COLUMNS]
+    shuffled = df.sample(frac=1.0, random_state=0).reset_index(drop=True)
+    assert parity_report(shuffled).empty
+    # both engines sort, so shuffling does not change the output either
+    pd.testing.assert_frame_equal(compute_features(shuffled).reset_index(drop=True),
+                                  compute_features(df).reset_index(drop=True))
+
+
+def test_zero_balance_limit_and_income_match():
+    months = pd.date_range("2022-01-01", periods=8, freq="MS")
+    rows = []
+    for i, m in enumerate(months):
+        rows.append([1, m, 0, 5000, 100, 0, 0, 1, 3000, 0])            # zero balance
+        rows.append([2, m, 1200, 0, 50, 30 * (i % 2), 1, 2, 4000, 0])   # zero credit limit
+        rows.append([3, m, 800, 2000, 0, 0, 0, 1, 0, 0])               # zero income
+    assert parity_report(panel(rows)).empty
+
+
+def test_customers_without_payments_match():
+    months = pd.date_range("2021-06-01", periods=13, freq="MS")
+    rows = [[c, m, 1000 + 10 * i, 3000, 0, 30 * i, i % 3, 2 + i // 4, 2500, 0]
+            for c in (10, 11) for i, m in enumerate(months)]
+    df = panel(rows)
+    assert parity_report(df).empty
+    assert (compute_features(df)["months_since_last_payment"] == 999.0).all()
+
+
+def test_single_month_customers_match():
+    rng = np.random.default_rng(5)
+    rows = [[c, pd.Timestamp("2023-03-01"), int(rng.integers(0, 5000)), 6000, int(rng.integers(0, 300)),
+             int(rng.choice([0, 30])), int(rng.integers(0, 3)), 2, 4000, 0] for c in range(20)]
+    df = panel(rows)
+    assert parity_report(df).empty
+    assert len(compute_features(df)) == len(compute_features_groupby(df)) == 20
+
+
+def test_parallel_features_matches_and_handles_empty_input(tmp_path):
+    from features import parallel_features
+    from schema import read_table
+    df = generate(n_customers=30, months=12, seed=11)[RAW_COLUMNS]
+    src, out = tmp_path / "raw.csv", tmp_path / "feat.csv"
+    df.to_csv(src, index=False)
+    assert parallel_features(str(src), str(out), workers=2) == len(df)
+    expected = compute_features(df).reset_index(drop=True)
+    got = read_table(str(out))
+    assert list(got.columns) == list(expected.columns) and len(got) == len(expected)
+
+    panel([]).to_csv(src, index=False)
+    assert parallel_features(str(src), str(out), workers=2) == 0
+    assert list(read_table(str(out)).columns) == list(expected.columns)
+
+
+@pytest.mark.parametrize("seed", [0, 4])
+def test_incremental_update_matches_full_recompute(seed, tmp_path):
+    from features import init_state, load_state, save_state, update_features
+    df = generate(n_customers=50, months=16, seed=seed)[RAW_COLUMNS]
+    months = sorted(df["month"].unique())
+    # a customer first seen in the new month, and one that skipped it
+    joiner = panel([[9999, months[-1], 400, 2000, 50, 0, 1, 1, 3000, 0]])
+    df = pd.concat([df[~((df["cust_id"] == 0) & (df["month"] == months[-1]))], joiner], ignore_index=True)
+    history, new = df[df["month"] < months[-1]], df[df["month"] == months[-1]]
+
+    path = str(tmp_path / "state.parquet")
+    save_state(init_state(history), path)
+    feats, state = update_features(load_state(path), new)
+
+    full = compute_features(df)
+    want = full[full["month"] == months[-1]].sort_values("cust_id").reset_index(drop=True)
+    got = feats.sort_values("cust_id").reset_index(drop=True)
+    pd.testing.assert_frame_equal(got, want, check_dtype=False)
+
+    # the updated state, after a save/load round trip, carries on to the month after
+    save_state(state, path)
+    nxt = new.assign(month=pd.Timestamp(months[-1]) + pd.DateOffset(months=1), payment=0)
+    feats2, _ = update_features(load_state(path), nxt)
+    full2 = compute_features(pd.concat([df, nxt], ignore_index=True))
+    want2 = full2[full2["month"] == nxt["month"].iloc[0]].sort_values("cust_id").reset_index(drop=True)
+    pd.testing.assert_frame_equal(feats2.sort_values("cust_id").reset_index(drop=True), want2, check_dtype=False)
@@ -0,0 +1,31 @@
+"""ScoreCache behaviour that needs no database: SQLite chunking and backend failures."""
+import _score_cache as score_cache
+import _tracing as tracing
+
+
+def test_sqlite_backend_handles_more_ids_than_sqlite_variables(tmp_path):
+    backend = score_cache._SqliteBackend(str(tmp_path / "cache.db"))
+    ids = [f"u{i}" for i in range(50_000)]
+    backend.put_many(None, {uid: ("k", "{}") for uid in ids[::2]})
+    found = backend.get_many(None, ids)
+    assert set(found) == set(ids[::2])
+    backend.invalidate(ids)
+    assert backend.get_many(None, ids) == {}
+
+
+class _DownBackend:
+    def get_many(self, cur, user_ids):
+        raise RuntimeError("cache is down")
+
+    def put_many(self, cur, items):
+        raise RuntimeError("cache is down")
+
+
+def test_backend_failures_are_misses_not_errors():
+    cache = score_cache.ScoreCache(backend=_DownBackend())
+    with tracing.request("test") as trace:
+        assert cache.get_many(None, {"a": "k1", "b": "k2"}) == {}
+        cache.put_many(None, {"a": ("k1", {"score": 700})})
+        # the write still lands in the in-process LRU
+        assert cache.get_many(None, {"a": "k1"}) == {"a": {"score": 700}}
+    assert trace.counts == {"cache_hits": 1, "cache_misses": 2, "cache_errors": 2}
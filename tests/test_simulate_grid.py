@@ -0,0 +1,39 @@
+"""Grid validation in simulate: oversized or malformed grids are 400s, decided before allocating."""
+import json
+
+import numpy as np
+import pytest
+
+import simulate
+
+
+def post(grid):
+    response = simulate.handler({"body": json.dumps({"userId": "u", "grid": grid})})
+    return response["statusCode"], json.loads(response["body"])
+
+
+@pytest.mark.parametrize("grid", [
+    {"income_change": {"min": 0, "max": 2e8, "step": 1}},
+    {"income_change": {"min": 0, "max": 1e13, "step": 1}},
+    {"income_change": {"min": -1e308, "max": 1e308, "step": 1e-300}},
+    {"income_change": {"min": 0, "max": 100, "step": 0}},
+    {"income_change": {"min": 0, "max": 100, "step": -5}},
+    {"income_change": {"min": 10, "max": 0, "step": 1}},
+    {"income_change": {"min": 0, "max": "NaN", "step": 1}},
+    {"income_change": {"min": 0, "max": "Infinity", "step": 1}},
+    # each axis fits, the product does not
+    {"missed_payments": list(range(100)), "income_change": {"min": 0, "max": 99, "step": 1}, "spending_increase": [0, 1]},
+    {"income_change": []},
+    "not an object",
+])
+def test_rejected_grids_are_400(grid, monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    status, body = post(grid)
+    assert status == 400, body
+
+
+def test_axis_length_matches_grid_axis():
+    for spec in [{"min": 0, "max": 10, "step": 1}, {"min": -20000, "max": 20000, "step": 10000},
+                 {"min": 0, "max": 1, "step": 0.1}, {"min": 0.5, "max": 0.5, "step": 3}, [1, 2, 3], 7, None]:
+        assert simulate.axis_length(spec) == len(simulate.grid_axis(spec)), spec
+    np.testing.assert_allclose(simulate.grid_axis({"min": 0, "max": 1, "step": 0.1}), np.arange(0, 1.05, 0.1))
@@ -0,0 +1,60 @@
+"""TreeModel (the FAST_PREDICT NumPy evaluator) against LightGBM's own Booster.predict."""
+import lightgbm as lgb
+import numpy as np
+import pytest
+
+from _treemodel import TreeModel, UnsupportedModel
+
+
+def _data(seed: int, n: int = 3000):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 6))
+    X[:, 4] = rng.integers(0, 4, n)          # many exact zeros
+    X[rng.random((n, 6)) < 0.1] = np.nan     # missing values in every column
+    signal = np.nan_to_num(X[:, 0]) - 0.5 * np.nan_to_num(X[:, 1]) + 0.3 * X[:, 4] + np.isnan(X[:, 2])
+    return X, signal + rng.normal(scale=0.3, size=n)
+
+
+def _inputs(X: np.ndarray) -> np.ndarray:
+    # training rows plus rows made of NaN, exact zeros, values below LightGBM's zero threshold and extremes
+    edge = np.array([[np.nan] * 6, [0.0] * 6, [1e-40, -1e-40, 0.0, np.nan, 0.0, 1e-36],
+                     [1e300, -1e300, np.inf, -np.inf, 3.0, 0.0]])
+    return np.vstack([X, edge])
+
+
+def _train(objective: str, seed: int, **params):
+    X, y = _data(seed)
+    if objective == "binary":
+        y = (y > np.median(y)).astype(float)
+    base = {"objective": objective, "num_leaves": 31, "min_data_in_leaf": 5, "learning_rate": 0.1,
+            "seed": seed, "deterministic": True, "num_threads": 1, "verbosity": -1}
+    booster = lgb.train({**base, **params}, lgb.Dataset(X, y), num_boost_round=60)
+    return booster, _inputs(X)
+
+
+@pytest.mark.parametrize("objective", ["binary", "regression"])
+@pytest.mark.parametrize("params", [{}, {"zero_as_missing": True}, {"use_missing": False}],
+                         ids=["nan-missing", "zero-as-missing", "no-missing"])
+def test_predict_matches_booster(objective, params):
+    booster, X = _train(objective, seed=7, **params)
+    model = TreeModel.from_booster(booster)
+    np.testing.assert_allclose(model.predict(X), booster.predict(X), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(model.predict(X, raw_score=True), booster.predict(X, raw_score=True), rtol=1e-9, atol=1e-9)
+    # one row at a time, as score_one predicts
+    for row in X[-4:]:
+        np.testing.assert_allclose(model.predict(row[None, :]), booster.predict(row[None, :]), rtol=1e-9, atol=1e-9)
+
+
+def test_saved_model_predicts_the_same(tmp_path):
+    booster, X = _train("binary", seed=3, zero_as_missing=True)
+    path = str(tmp_path / "model.npz")
+    TreeModel.from_booster(booster).save(path)
+    np.testing.assert_allclose(TreeModel.load(path).predict(X), booster.predict(X), rtol=1e-9, atol=1e-9)
+
+
+def test_unsupported_objective_is_refused():
+    X, y = _data(1, 600)
+    booster = lgb.train({"objective": "multiclass", "num_class": 3, "verbosity": -1},
+                        lgb.Dataset(X, (y > 0).astype(int) + (y > 1)), num_boost_round=3)
+    with pytest.raises(UnsupportedModel):
+        TreeModel.from_booster(booster)